@@ -0,0 +1,188 @@
+# Standard libraries:
+from collections import deque
+import json
+import sys
+import time
+
+# Local modules:
+from chess_in_terminal import ChessPosition, ChessValidator, AUX, PGN_EXTENSION, START_FEN, WHITE_ID
+from chess_engine import ChessEngine, DEFAULT_HASH_MB, MATE_SCORE, MAX_PLY
+from chess_formats import Pgn
+
+
+# Constants:
+DEFAULT_ANALYSIS_NODES = 10000   # Nodes searched per position (rounded up to the next 1024, see ChessEngine.max_nodes).
+MISTAKE_THRESHOLD = 100          # Centipawns lost by a move to flag it.
+BLUNDER_THRESHOLD = 300
+EVALUATION_LIMIT = 1000          # Evaluations are clamped to +/- this (mates reach it), so swings in decided positions are not flagged.
+GAMES_IN_FLIGHT = 2              # Games queued per worker process.
+MISTAKE = "mistake"
+BLUNDER = "blunder"
+LABEL_NAGS = {MISTAKE: "$2", BLUNDER: "$4"}   # PGN annotation glyphs ("?" and "??").
+
+
+# Classes:
+class GameAnalyzer():
+  '''The class that analyzes games with the engine: every position is searched with a fixed budget (nodes, or seconds if a time limit is given),
+  and the moves that lose enough of the evaluation of the player are flagged as mistakes or blunders.'''
+  def __init__(self, nodes=DEFAULT_ANALYSIS_NODES, time_limit=None, hash_mb=DEFAULT_HASH_MB):
+    self.engine = ChessEngine(time_limit=time_limit or float("inf"), hash_mb=hash_mb, max_nodes=0 if time_limit else nodes)
+    self.pgn = Pgn()
+    self.aux = AUX
+
+  def evaluate(self, position):
+    '''Method that searches a position within the budget. Returns a tuple with the score in centipawns (clamped to EVALUATION_LIMIT) and the moves to mate
+    (None if there is no mate, 0 if it is already mated), both from the point of view of the side to move, and the best 16-bit move (0 if there is none).
+    A mate in 0 has no sign, so the side that is mated is given by the score, which is then -EVALUATION_LIMIT (see format_evaluation).'''
+    move = self.engine.search(position)
+    score = self.engine.score
+    mate = None
+    if abs(score) >= MATE_SCORE - MAX_PLY:
+      mate = (MATE_SCORE - abs(score) + 1) // 2 * (1 if score > 0 else -1)
+
+    return max(-EVALUATION_LIMIT, min(score, EVALUATION_LIMIT)), mate, move
+
+  def analyze(self, game):
+    '''Method that analyzes a game (a dict with its file, number, initial FEN, 16-bit moves and error, see iterate_games). Returns a dict with the same data,
+    its PGN result, the positions and nodes searched, the mistakes and blunders, and a dict per move: its names (coordinates and SAN), the evaluation after it
+    (centipawns and moves to mate for the whites, with a mate in 0 won by the whites if the score is positive), the best move (SAN), the centipawns lost by
+    the player and its label (MISTAKE, BLUNDER or None).'''
+    self.engine.new_game()
+    position = ChessPosition()
+    position.set_fen(game["fen"])
+    score, mate, best_move = self.evaluate(position)
+    nodes = self.engine.nodes
+    moves = []
+
+    for move in game["moves"]:
+      san = self.pgn.get_san(position, move)
+      best = self.pgn.get_san(position, best_move) if best_move and best_move != move else san
+      position.make_move(move)
+      player_score = score
+      score, mate, best_move = self.evaluate(position)
+      nodes += self.engine.nodes
+
+      # The loss is the drop of the evaluation of the player (the evaluation after the move is the one of the opponent):
+      loss = max(player_score + score, 0) if best != san else 0
+      label = BLUNDER if loss >= BLUNDER_THRESHOLD else MISTAKE if loss >= MISTAKE_THRESHOLD else None
+      sign = 1 if position.side == WHITE_ID else -1
+      moves.append({"move": self.aux.get_move_name(move), "san": san, "score": score * sign, "mate": None if mate is None else mate * sign,
+                    "best": best, "loss": loss, "label": label})
+
+    return {"file": game["file"], "game": game["game"], "fen": game["fen"], "result": "*" if game["error"] else self.pgn.get_result(position),
+            "error": game["error"], "positions": len(moves) + 1, "nodes": nodes,
+            "mistakes": sum(move["label"] == MISTAKE for move in moves), "blunders": sum(move["label"] == BLUNDER for move in moves), "moves": moves}
+
+
+# Functions:
+def format_evaluation(score, mate):
+  '''Function that returns an evaluation for the whites as in PGN comments: "0.35", "#3" or "#-3", and "#0" or "#-0" if the blacks or the whites are mated
+  (the sign of a mate in 0 is taken from the score).'''
+  if mate is None:
+    return format(score / 100, ".2f")
+  return f"#{'-' if mate < 0 or (mate == 0 and score < 0) else ''}{abs(mate)}"
+
+
+def iterate_games(files):
+  '''Generator that yields a dict per game of the move files: its file, number, initial FEN, 16-bit moves (up to the first illegal one) and error (or None).'''
+  validator = ChessValidator()
+  for file in files:
+    for result, board, start_fen in validator.replay_file(file):
+      yield {"file": file, "game": result["game"], "fen": start_fen or START_FEN, "moves": list(board.position.get_moves()) if board else [],
+             "error": result["error"] or result["message"]}
+
+
+def write_pgn(pgn, open_file, analysis):
+  '''Function that writes an analyzed game in PGN (with a Pgn object) to an open file, with the evaluation after each move as a comment ("[%eval 0.35]" or "[%eval #-3]")
+  and a glyph and the best move on mistakes and blunders.'''
+  position = ChessPosition()
+  position.set_fen(analysis["fen"])
+  moves = []
+  annotations = []
+  for move in analysis["moves"]:
+    moves.append(pgn.parse_san(position, move["san"]))
+    position.make_move(moves[-1])
+    comment = f"[%eval {format_evaluation(move['score'], move['mate'])}]"
+    if move["label"]:
+      comment += f" {move['label'].capitalize()}, best was {move['best']}."
+    annotations.append((LABEL_NAGS.get(move["label"], ""), comment))
+
+  tags = {"Event": analysis["file"], "Round": analysis["game"]}
+  pgn.write_game(open_file, moves, tags, analysis["fen"], analysis["result"], annotations)
+
+
+def iterate_analyses(files, workers=1, nodes=DEFAULT_ANALYSIS_NODES, time_limit=None):
+  '''Generator that yields the analysis of each game of the files in order, as it is done. With more than 1 worker the games are sent to a process pool,
+  keeping only a few games in flight (GAMES_IN_FLIGHT per worker), so reading never gets far ahead of the analysis and the memory stays bounded.'''
+  games = iterate_games(files)
+  if workers <= 1:
+    analyzer = GameAnalyzer(nodes, time_limit)
+    for game in games:
+      yield analyzer.analyze(game)
+    return
+
+  from concurrent.futures import ProcessPoolExecutor
+  pending = deque()
+  with ProcessPoolExecutor(max_workers=workers, initializer=_init_analyzer, initargs=(nodes, time_limit)) as executor:
+    while True:
+      while len(pending) < workers * GAMES_IN_FLIGHT:
+        game = next(games, None)
+        if game is None:
+          break
+        pending.append(executor.submit(_analyze_game, game))
+      if not pending:
+        break
+      yield pending.popleft().result()
+
+
+def run_analysis(files, workers=1, nodes=DEFAULT_ANALYSIS_NODES, time_limit=None, output=None):
+  '''Function that analyzes the games of move files, streaming each annotated game as soon as it is done to an output file (PGN with comments if its name
+  ends with ".pgn", JSON lines otherwise) or to the standard output as JSON lines. The progress and the throughput in positions/sec are printed to the
+  standard error. Returns the exit status for the command line (1 if any game could not be read whole).'''
+  open_file = open(output, "w") if output else sys.stdout
+  pgn = Pgn() if output and output.lower().endswith(PGN_EXTENSION) else None
+  games = positions = mistakes = blunders = failures = 0
+
+  start = time.perf_counter()
+  try:
+    for analysis in iterate_analyses(files, workers, nodes, time_limit):
+      games += 1
+      positions += analysis["positions"]
+      mistakes += analysis["mistakes"]
+      blunders += analysis["blunders"]
+      failures += bool(analysis["error"])
+      if pgn:
+        write_pgn(pgn, open_file, analysis)
+      else:
+        open_file.write(json.dumps(analysis) + "\n")
+      open_file.flush()
+
+      elapsed = time.perf_counter() - start
+      error = f", ERROR {analysis['error']}" if analysis["error"] else ""
+      print(f"{analysis['file']} #{analysis['game']}: {analysis['positions']} positions, {analysis['mistakes']} mistakes, {analysis['blunders']} blunders{error} "
+            f"({positions / elapsed if elapsed else 0:,.1f} positions/sec)", file=sys.stderr)
+  finally:
+    if output:
+      open_file.close()
+  elapsed = time.perf_counter() - start
+
+  print(f"Games: {games}, {failures} not read whole. Mistakes: {mistakes}, blunders: {blunders}.", file=sys.stderr)
+  print(f"Positions: {positions} in {elapsed:.3f} s ({positions / elapsed if elapsed else 0:,.1f} positions/sec with {max(workers, 1)} "
+        f"worker{'s' if workers > 1 else ''})", file=sys.stderr)
+
+  return 1 if failures else 0
+
+
+# Helper processes:
+_analyzer = None
+
+
+def _init_analyzer(nodes, time_limit):
+  '''Function that creates the analyzer of a worker process, used for all the games it gets.'''
+  global _analyzer
+  _analyzer = GameAnalyzer(nodes, time_limit)
+
+
+def _analyze_game(game):
+  '''Function that analyzes a game in a worker process.'''
+  return _analyzer.analyze(game)
@@ -0,0 +1,197 @@
+# 3° libraries:
+import numpy as np
+
+# Local modules:
+from chess_in_terminal import (BETWEEN, KING_ATTACKS, KNIGHT_ATTACKS, PAWN_ATTACKS, BISHOP_ID, BLACK_ID, BLACK_KING_SIDE, BLACK_QUEEN_SIDE, COLOR_SHIFT,
+                               KING_HOME_SQUARES, KING_ID, KNIGHT_ID, NO_SQUARE, PAWN_FORWARD, PAWN_ID, PAWN_START_ROWS, PIECE_MASK, PROMOTION, PROMOTION_ROWS,
+                               QUEEN_ID, ROOK_ID, TOTAL_COLS, TOTAL_ROWS, TOTAL_SQUARES, WHITE_ID, WHITE_KING_SIDE, WHITE_QUEEN_SIDE)
+
+
+# Constants:
+BATCH_CHUNK_SIZE = 1 << 16   # Boards checked at once, so the temporary arrays stay small whatever the batch size.
+PLANE_CODES = [piece_id | color_id << COLOR_SHIFT for color_id in (WHITE_ID, BLACK_ID) for piece_id in range(PAWN_ID, KING_ID+1)]   # Piece code of each of the 12 planes.
+STRAIGHT_DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+DIAGONAL_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+# Castling moves (color, king source, king destination, rook square, square the king passes and right):
+CASTLING_MOVES = tuple((color_id, KING_HOME_SQUARES[color_id], KING_HOME_SQUARES[color_id] + side * 2, KING_HOME_SQUARES[color_id] + (3 if side > 0 else -4),
+                        KING_HOME_SQUARES[color_id] + side, right)
+                       for color_id, rights in ((WHITE_ID, (WHITE_KING_SIDE, WHITE_QUEEN_SIDE)), (BLACK_ID, (BLACK_KING_SIDE, BLACK_QUEEN_SIDE)))
+                       for side, right in zip((1, -1), rights))
+
+
+# Precomputed tables:
+def _build_square_table(bitboards):
+  '''Function that returns a (len, 64) boolean array with the squares set in each bitboard of a list.'''
+  return np.array([[bitboard >> square & 1 for square in range(TOTAL_SQUARES)] for bitboard in bitboards], dtype=bool)
+
+
+def _build_ray_tables():
+  '''Function that returns the tables of the slider moves: the squares of each direction from each square, in order (8, 64, 7) with -1 after the edge,
+  and whether 2 squares share a row or column (64, 64) or a diagonal (64, 64).'''
+  rays = np.full((8, TOTAL_SQUARES, TOTAL_ROWS-1), NO_SQUARE, dtype=np.int64)
+  straight = np.zeros((TOTAL_SQUARES, TOTAL_SQUARES), dtype=bool)
+  diagonal = np.zeros((TOTAL_SQUARES, TOTAL_SQUARES), dtype=bool)
+
+  for direction, (row_step, col_step) in enumerate(STRAIGHT_DIRECTIONS + DIAGONAL_DIRECTIONS):
+    for square in range(TOTAL_SQUARES):
+      row, col = divmod(square, TOTAL_COLS)
+      for step in range(TOTAL_ROWS-1):
+        row, col = row + row_step, col + col_step
+        if not (0 <= row < TOTAL_ROWS and 0 <= col < TOTAL_COLS):
+          break
+        rays[direction, square, step] = row * TOTAL_COLS + col
+        (straight if direction < len(STRAIGHT_DIRECTIONS) else diagonal)[square, row * TOTAL_COLS + col] = True
+
+  return rays, straight, diagonal
+
+
+KNIGHT_TABLE = _build_square_table(KNIGHT_ATTACKS)
+KING_TABLE = _build_square_table(KING_ATTACKS)
+PAWN_TABLE = np.stack([_build_square_table(PAWN_ATTACKS[color_id]) for color_id in (WHITE_ID, BLACK_ID)])
+BETWEEN_TABLE = np.array(BETWEEN, dtype=np.uint64)   # Bitboards, compared with the occupancy packed in 64 bits.
+RAYS, STRAIGHT_LINES, DIAGONAL_LINES = _build_ray_tables()
+
+
+# Classes:
+class BatchRules():
+  '''The class that checks many positions at once with NumPy array operations (no Python loop over the boards), for bulk validation and dataset cleaning.
+  Boards are (N, 64) arrays of mailbox codes or (N, 12, 64) arrays of piece planes (whites P, N, B, R, Q, K and then blacks).
+  Moves are the usual 16-bit moves, of which only the source, destination and promotion piece are used.'''
+  def get_boards(self, positions):
+    '''Method that returns the arrays of a list of ChessPosition objects: mailboxes (N, 64), sides to move, castling rights and en passant squares (N).'''
+    boards = np.frombuffer(b"".join(position.squares.tobytes() for position in positions), dtype=np.int8).reshape(-1, TOTAL_SQUARES)
+    sides = np.array([position.side for position in positions], dtype=np.int64)
+    castling = np.array([position.castling for position in positions], dtype=np.int64)
+    ep_squares = np.array([position.ep_square for position in positions], dtype=np.int64)
+
+    return boards, sides, castling, ep_squares
+
+  def get_mailboxes(self, boards):
+    '''Method that returns an (N, 64) array of mailbox codes from an array of mailboxes (N, 64) or of piece planes (N, 12, 64).'''
+    boards = np.asarray(boards)
+    if boards.ndim == 2:
+      return boards.astype(np.int8, copy=False)
+
+    mailboxes = np.zeros((boards.shape[0], TOTAL_SQUARES), dtype=np.int8)
+    for plane, code in enumerate(PLANE_CODES):
+      mailboxes[boards[:, plane] != 0] = code
+
+    return mailboxes
+
+  def legal_mask(self, boards, moves, sides=None, castling=None, ep_squares=None):
+    '''Method that returns a boolean array with the legality of the move of each board (side to move, castling rights and en passant square of each one are
+    white, none and none if not given). The boards are checked in chunks of BATCH_CHUNK_SIZE, so big batches use little extra memory.'''
+    boards = self.get_mailboxes(boards)
+    total = boards.shape[0]
+    moves = np.asarray(moves, dtype=np.int64)
+    sides = np.zeros(total, dtype=np.int64) if sides is None else np.asarray(sides, dtype=np.int64)
+    castling = np.zeros(total, dtype=np.int64) if castling is None else np.asarray(castling, dtype=np.int64)
+    ep_squares = np.full(total, NO_SQUARE, dtype=np.int64) if ep_squares is None else np.asarray(ep_squares, dtype=np.int64)
+
+    mask = np.zeros(total, dtype=bool)
+    for start in range(0, total, BATCH_CHUNK_SIZE):
+      chunk = slice(start, start + BATCH_CHUNK_SIZE)
+      mask[chunk] = self._legal_mask_chunk(boards[chunk], moves[chunk], sides[chunk], castling[chunk], ep_squares[chunk])
+
+    return mask
+
+  def is_square_attacked(self, boards, squares, colors):
+    '''Method that returns a boolean array saying if the square of each board (N) is attacked by any piece of the color of each board (N).'''
+    rows = np.arange(boards.shape[0])
+    shifts = colors << COLOR_SHIFT
+
+    # Leapers (pawns attack a square from the squares a pawn of the other color would attack):
+    attacked = (KNIGHT_TABLE[squares] & (boards == (KNIGHT_ID | shifts)[:, None])).any(axis=1)
+    attacked |= (KING_TABLE[squares] & (boards == (KING_ID | shifts)[:, None])).any(axis=1)
+    attacked |= (PAWN_TABLE[colors ^ 1, squares] & (boards == (PAWN_ID | shifts)[:, None])).any(axis=1)
+
+    # Sliders: the first piece found in each direction attacks the square if it moves that way:
+    queens = QUEEN_ID | shifts
+    for direction in range(len(RAYS)):
+      sliders = (ROOK_ID if direction < len(STRAIGHT_DIRECTIONS) else BISHOP_ID) | shifts
+      done = np.zeros(boards.shape[0], dtype=bool)
+      for step in range(TOTAL_ROWS-1):
+        ray = RAYS[direction, squares, step]
+        done |= ray == NO_SQUARE
+        if done.all():
+          break
+        pieces = boards[rows, np.maximum(ray, 0)]
+        found = ~done & (pieces != 0)
+        attacked |= found & ((pieces == sliders) | (pieces == queens))
+        done |= found
+
+    return attacked
+
+  def _legal_mask_chunk(self, boards, moves, sides, castling, ep_squares):
+    '''Method that returns the legality mask of a chunk of boards (see legal_mask).'''
+    rows = np.arange(boards.shape[0])
+    sources = moves & 63
+    destinations = moves >> 6 & 63
+    promotions = (moves >> 12 & PROMOTION) != 0
+    codes = boards[rows, sources].astype(np.int64)
+    targets = boards[rows, destinations].astype(np.int64)
+    pieces = codes & PIECE_MASK
+    occupied = np.packbits(boards != 0, axis=1, bitorder="little").view("<u8").ravel()
+    path_clear = (BETWEEN_TABLE[sources, destinations] & occupied) == 0
+
+    # 1) A piece of the side to move, going to an empty square or to a piece of the other color:
+    legal = (codes != 0) & (codes >> COLOR_SHIFT == sides) & ((targets == 0) | (targets >> COLOR_SHIFT != sides))
+
+    # 2) Moves of each kind of piece:
+    forward = np.where(sides == WHITE_ID, PAWN_FORWARD[WHITE_ID], PAWN_FORWARD[BLACK_ID])
+    start_rows = np.where(sides == WHITE_ID, PAWN_START_ROWS[WHITE_ID], PAWN_START_ROWS[BLACK_ID])
+    last_rows = np.where(sides == WHITE_ID, PROMOTION_ROWS[WHITE_ID], PROMOTION_ROWS[BLACK_ID])
+    en_passant = (destinations == ep_squares) & (targets == 0)
+    pawn_moves = ((destinations == sources + forward) & (targets == 0)
+                  | (destinations == sources + 2 * forward) & (sources // TOTAL_COLS == start_rows) & (targets == 0) & path_clear
+                  | PAWN_TABLE[sides, sources, destinations] & ((targets != 0) | en_passant))
+    castles = self._castling_mask(boards, sources, destinations, pieces, sides, castling, occupied)
+    legal &= ((pieces == PAWN_ID) & pawn_moves
+              | (pieces == KNIGHT_ID) & KNIGHT_TABLE[sources, destinations]
+              | (pieces == BISHOP_ID) & DIAGONAL_LINES[sources, destinations] & path_clear
+              | (pieces == ROOK_ID) & STRAIGHT_LINES[sources, destinations] & path_clear
+              | (pieces == QUEEN_ID) & (STRAIGHT_LINES[sources, destinations] | DIAGONAL_LINES[sources, destinations]) & path_clear
+              | (pieces == KING_ID) & (KING_TABLE[sources, destinations] | castles))
+
+    # 3) Pawns reaching the last row must promote, and only them:
+    legal &= promotions == ((pieces == PAWN_ID) & (destinations // TOTAL_COLS == last_rows))
+
+    # 4) The king can't be in check after the move (checked on a copy of the boards with the move made):
+    candidates = np.flatnonzero(legal)
+    if candidates.size:
+      after = boards[candidates].copy()
+      rows = np.arange(candidates.size)
+      sides = sides[candidates]
+      sources, destinations = sources[candidates], destinations[candidates]
+      moved = np.where(promotions[candidates], KNIGHT_ID + (moves[candidates] >> 12 & 3) | sides << COLOR_SHIFT, codes[candidates])
+      after[rows, sources] = 0
+      after[rows, destinations] = moved
+      captured = (pieces[candidates] == PAWN_ID) & en_passant[candidates]
+      after[rows[captured], (destinations - forward[candidates])[captured]] = 0
+      for color_id, king_source, king_destination, rook_square, pass_square, _ in CASTLING_MOVES:
+        castled = castles[candidates] & (sources == king_source) & (destinations == king_destination)
+        after[rows[castled], rook_square] = 0
+        after[rows[castled], pass_square] = ROOK_ID | color_id << COLOR_SHIFT
+
+      kings = (after == (KING_ID | sides << COLOR_SHIFT)[:, None]).argmax(axis=1)
+      legal[candidates] = ~self.is_square_attacked(after, kings, sides ^ 1)
+
+    return legal
+
+  def _castling_mask(self, boards, sources, destinations, pieces, sides, castling, occupied):
+    '''Method that returns a boolean array saying if the move of each board is a castling allowed by the rights, with the squares between the king and the rook
+    empty and the king neither in check nor passing an attacked square (its destination is checked with the other moves).'''
+    castles = np.zeros(boards.shape[0], dtype=bool)
+
+    for color_id, king_source, king_destination, rook_square, pass_square, right in CASTLING_MOVES:
+      allowed = ((pieces == KING_ID) & (sides == color_id) & (sources == king_source) & (destinations == king_destination) & (castling & right != 0)
+                 & (boards[:, rook_square] == ROOK_ID | color_id << COLOR_SHIFT) & (BETWEEN_TABLE[king_source, rook_square] & occupied == 0))
+      candidates = np.flatnonzero(allowed)
+      if candidates.size:
+        colors = np.full(candidates.size, color_id ^ 1)
+        safe = ~self.is_square_attacked(boards[candidates], np.full(candidates.size, king_source), colors)
+        safe &= ~self.is_square_attacked(boards[candidates], np.full(candidates.size, pass_square), colors)
+        castles[candidates] = safe
+
+    return castles
@@ -0,0 +1,684 @@
+# Standard libraries:
+from array import array
+from collections import Counter
+from multiprocessing import shared_memory
+import mmap
+import multiprocessing
+import os
+import random
+import struct
+import time
+
+# Local modules:
+from chess_in_terminal import ChessPosition, ChessValidator, AUX, RULES, CAPTURE, COLOR_SHIFT, KING_ID, PAWN_ID, PIECE_MASK, PROMOTION
+
+
+# Constants:
+DEFAULT_TIME_LIMIT = 3.0    # Seconds per move.
+MAX_DEPTH = 32
+MAX_PLY = 96
+INFINITE = 32000
+MATE_SCORE = 30000
+DRAW_SCORE = 0
+TIME_CHECK_NODES = 1023     # The clock is read once every 1024 nodes.
+
+# Transposition table (buckets of 2 entries: a depth-preferred one and an always-replace one, 16 bytes each):
+DEFAULT_HASH_MB = 16
+ENTRY_BYTES = 16
+BUCKET_BYTES = 2 * ENTRY_BYTES
+BOUND_UPPER = 1
+BOUND_LOWER = 2
+BOUND_EXACT = 3
+AGE_MASK = 63
+REPLACE_TWO_TIER = "two-tier"
+REPLACE_DEPTH = "depth-preferred"
+REPLACE_ALWAYS = "always"
+REPLACEMENT_POLICIES = (REPLACE_TWO_TIER, REPLACE_DEPTH, REPLACE_ALWAYS)
+
+# Opening book (records sorted by key: 64-bit Zobrist key of the position, 16-bit move and 16-bit weight):
+BOOK_RECORD = struct.Struct("<QHH")
+BOOK_KEY = struct.Struct("<Q")
+BOOK_MAX_PLIES = 16         # Plies of each game added to the book by the builder.
+MAX_BOOK_WEIGHT = 0xFFFF
+
+# Move ordering scores:
+HASH_MOVE_SCORE = 1 << 30
+CAPTURE_SCORE = 1 << 28
+KILLER_SCORES = (1 << 27, (1 << 27) - 1)
+
+
+# Classes:
+class TranspositionTable():
+  '''The class that keeps the results of already searched positions in a fixed-size table (preallocated buffer of 64-bit words), so memory stays flat.
+  Each entry is a key word and a data word packing move (16 bits), score (16 bits), depth (8 bits), bound (2 bits) and age (6 bits).
+  The key word is saved XORed with the data word, so an entry half-written by another process never matches (lockless hashing).'''
+  def __init__(self, size_mb=DEFAULT_HASH_MB, policy=REPLACE_TWO_TIER, buffer=None):
+    if policy not in REPLACEMENT_POLICIES:
+      raise ValueError(f"Invalid replacement policy: {policy}")
+
+    # The number of buckets is a power of two, so the bucket of a key is just its lowest bits:
+    if buffer is None:
+      buffer = bytearray(self.get_size_in_bytes(size_mb))
+    self.buckets = 1 << ((len(buffer) // BUCKET_BYTES).bit_length() - 1)
+    self.mask = self.buckets - 1
+    self.buffer = buffer
+    self.view = memoryview(buffer)[:self.buckets * BUCKET_BYTES]
+    self.table = self.view.cast("Q")
+    self.policy = policy
+    self.age = 0
+
+    # Stats:
+    self.hits = 0
+    self.misses = 0
+    self.collisions = 0
+
+  @staticmethod
+  def get_size_in_bytes(size_mb):
+    '''Method that returns the bytes of a table of size_mb MB (rounded down to a power of two buckets).'''
+    return max(1 << ((int(size_mb * (1 << 20)) // BUCKET_BYTES).bit_length() - 1), 1) * BUCKET_BYTES
+
+  @property
+  def size_mb(self):
+    '''The size of the table in MB.'''
+    return self.buckets * BUCKET_BYTES / (1 << 20)
+
+  def release(self):
+    '''Method that releases the views of the buffer (required before closing a shared memory buffer).'''
+    self.table.release()
+    self.view.release()
+
+  def new_search(self):
+    '''Method that increases the age counter (so entries of older searches are replaced first) and resets the stats.'''
+    self.age = (self.age + 1) & AGE_MASK
+    self.hits = 0
+    self.misses = 0
+    self.collisions = 0
+
+  def clear(self):
+    '''Method that empties all the entries of the table.'''
+    self.table[:] = array("Q", bytes(len(self.table) * 8))
+
+  def probe(self, key):
+    '''Method that looks for a position (by its 64-bit key) in the table. Returns the data word of the entry or 0 if it's not found.'''
+    table = self.table
+    index = (key & self.mask) << 2
+
+    data = table[index + 1]
+    if data and table[index] ^ data == key:
+      self.hits += 1
+      return data
+    data = table[index + 3]
+    if data and table[index + 2] ^ data == key:
+      self.hits += 1
+      return data
+
+    self.misses += 1
+    return 0
+
+  def store(self, key, move, score, depth, bound):
+    '''Method that saves the result of a search of a position (by its 64-bit key), according to the replacement policy of the table.'''
+    table = self.table
+    index = (key & self.mask) << 2
+    data = move | (score + 32768) << 16 | depth << 32 | bound << 40 | self.age << 42
+
+    # Choose the entry: the depth-preferred one keeps the deepest results of the current search, the other one is always replaced:
+    old_data = table[index + 1]
+    if self.policy != REPLACE_ALWAYS and old_data and table[index] ^ old_data != key \
+       and depth < (old_data >> 32 & 0xFF) and old_data >> 42 == self.age:
+      if self.policy == REPLACE_DEPTH:
+        return
+      index += 2
+      old_data = table[index + 1]
+
+    if old_data:
+      if table[index] ^ old_data != key:
+        self.collisions += 1
+      elif not move:
+        data |= old_data & 0xFFFF    # Keep the best move of the same position when the new result has none.
+
+    table[index] = key ^ data
+    table[index + 1] = data
+
+  def unpack(self, data):
+    '''Method that returns a tuple (move, score, depth, bound, age) from the data word of an entry.'''
+    return data & 0xFFFF, (data >> 16 & 0xFFFF) - 32768, data >> 32 & 0xFF, data >> 40 & 3, data >> 42
+
+  def hashfull(self):
+    '''Method that returns the permille of the first 1000 entries used by the current search.'''
+    table = self.table
+    entries = min(1000, len(table) // 2)
+    used = sum(1 for index in range(1, entries * 2, 2) if table[index] and table[index] >> 42 == self.age)
+
+    return used * 1000 // entries
+
+  def get_stats(self):
+    '''Method that returns a one-line summary of the table stats.'''
+    probes = self.hits + self.misses
+    hit_rate = 100 * self.hits / probes if probes else 0.0
+
+    return f"hash {self.size_mb:g} MB ({self.policy}) hits {self.hits} misses {self.misses} ({hit_rate:.1f}% hits) " \
+           f"collisions {self.collisions} hashfull {self.hashfull()}"
+
+
+class OpeningBook():
+  '''The class that reads an opening book: a file of fixed-width records sorted by position key, memory-mapped and searched by binary search,
+  so lookups take O(log n) reads and the book is never loaded whole. Books are compiled from game collections with OpeningBook.build.'''
+  def __init__(self, file):
+    self.file = open(file, "rb")
+    size = os.fstat(self.file.fileno()).st_size
+    if size % BOOK_RECORD.size:
+      self.file.close()
+      raise ValueError(f"Invalid opening book: {file}")
+    self.records = size // BOOK_RECORD.size
+    self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exception):
+    self.close()
+
+  def __len__(self):
+    return self.records
+
+  def close(self):
+    '''Method that closes the memory map and the file of the book.'''
+    if self.map:
+      self.map.close()
+    self.file.close()
+
+  def get_moves(self, position):
+    '''Method that returns a list of (16-bit move, weight) tuples with the book moves of a position (empty if it is not in the book).'''
+    key = position.hash
+
+    # Binary search of the first record with the key:
+    low, high = 0, self.records
+    while low < high:
+      middle = (low + high) // 2
+      if BOOK_KEY.unpack_from(self.map, middle * BOOK_RECORD.size)[0] < key:
+        low = middle + 1
+      else:
+        high = middle
+
+    moves = []
+    for index in range(low, self.records):
+      record_key, move, weight = BOOK_RECORD.unpack_from(self.map, index * BOOK_RECORD.size)
+      if record_key != key:
+        break
+      moves.append((move, weight))
+
+    return moves
+
+  def choose_move(self, position, legal_moves=None, generator=random):
+    '''Method that chooses a book move of a position at random, with a probability proportional to its weight. Book moves that are not legal
+    (only possible with a key collision) are skipped, if the legal moves are passed. Returns the 16-bit move (0 if there is none).'''
+    moves = [(move, weight) for move, weight in self.get_moves(position) if weight and (legal_moves is None or move in legal_moves)]
+    if not moves:
+      return 0
+
+    return generator.choices([move for move, _ in moves], weights=[weight for _, weight in moves])[0]
+
+  @staticmethod
+  def build(files, book, max_plies=BOOK_MAX_PLIES):
+    '''Method that compiles an opening book from the games of move files (JSON, JSON lines, PGN or game archives), weighting each move of the first plies
+    by the number of games that played it in that position. Only the legal part of each game is used. Returns the number of positions and the number of records.'''
+    validator = ChessValidator()
+    counts = Counter()
+
+    for file in files:
+      for _, board, start_fen in validator.replay_file(file):
+        if board is None:
+          continue
+        position = ChessPosition()
+        position.set_fen(start_fen)
+        for move in board.position.get_moves()[:max_plies]:
+          counts[position.hash, move] += 1
+          position.make_move(move)
+
+    with open(book, "wb") as open_file:
+      for (key, move), count in sorted(counts.items()):
+        open_file.write(BOOK_RECORD.pack(key, move, min(count, MAX_BOOK_WEIGHT)))
+
+    return len({key for key, _ in counts}), len(counts)
+
+
+class ChessEngine():
+  '''The class that searches the best move of a position with negamax alpha-beta and iterative deepening, within a time budget per move.
+  Moves are ordered by hash move, MVV-LVA captures, killer moves and the history heuristic.'''
+  def __init__(self, time_limit=DEFAULT_TIME_LIMIT, max_depth=MAX_DEPTH, hash_mb=DEFAULT_HASH_MB, policy=REPLACE_TWO_TIER, debug=False,
+               tt_buffer=None, stop_event=None, book=None, tablebase=None, max_nodes=0):
+    self.rules = RULES
+    self.aux = AUX
+    self.time_limit = time_limit
+    self.max_depth = max_depth
+    self.max_nodes = max_nodes      # Node budget per search (0 for none), checked with the clock, so it is rounded up to the next 1024 nodes.
+    self.debug = debug              # Verify the incremental evaluation against a full-board one (slow).
+    self.tt = TranspositionTable(hash_mb, policy, tt_buffer)
+    self.stop_event = stop_event    # Optional multiprocessing.Event to stop the search from another process.
+    self.book = book                # Optional OpeningBook, whose moves are played without searching.
+    self.tablebase = tablebase      # Optional chess_tablebase.Tablebase, whose endings are played perfectly without searching.
+
+    # Move ordering data:
+    self.killers = [[0, 0] for _ in range(MAX_PLY)]
+    self.history = [0] * 4096    # Indexed by the source and destination bits of a move.
+
+    # Search state and stats of the last search:
+    self.stop = False
+    self.deadline = 0.0
+    self.nodes = 0
+    self.depth = 0
+    self.score = 0
+    self.best_move = 0
+    self.from_book = False
+    self.from_tablebase = False
+    self.pv = []
+    self.elapsed = 0.0
+
+  @property
+  def nodes_per_second(self):
+    '''The nodes per second of the last search.'''
+    return self.nodes / self.elapsed if self.elapsed else 0.0
+
+  def search(self, position, time_limit=None, max_depth=None, on_iteration=None, start_depth=1):
+    '''Method that searches the best move of a position, deepening one ply at a time until the time budget (seconds) or the max depth is reached.
+    An optional on_iteration function is called with the engine after each completed depth. Returns the best 16-bit move (0 if there are no legal moves).'''
+    time_limit = self.time_limit if time_limit is None else time_limit
+    max_depth = self.max_depth if max_depth is None else max_depth
+    start = time.perf_counter()
+
+    # Reset the search state (the history is halved, so older searches still help ordering):
+    self.stop = False
+    self.deadline = start + time_limit
+    self.nodes = 0
+    self.depth = 0
+    self.score = 0
+    self.pv = []
+    self.killers = [[0, 0] for _ in range(MAX_PLY)]
+    self.history = [value >> 1 for value in self.history]
+    self.tt.new_search()
+
+    root_moves = self.rules.generate_legal_moves(position)
+    self.best_move = root_moves[0] if root_moves else 0
+    self.from_book = False
+    self.from_tablebase = False
+    if not root_moves:
+      self.score = -MATE_SCORE if self._in_check(position) else DRAW_SCORE
+      self.elapsed = time.perf_counter() - start
+      return self.best_move
+
+    # Positions of the opening book are not searched:
+    book_move = self.book.choose_move(position, root_moves) if self.book else 0
+    if book_move:
+      self.best_move = book_move
+      self.from_book = True
+      self.elapsed = time.perf_counter() - start
+      return self.best_move
+
+    # Nor the endings of the tablebase (the score is the distance to mate of the tables):
+    tablebase_move = self.tablebase.choose_move(position, root_moves) if self.tablebase else None
+    if tablebase_move:
+      self.best_move, result, plies = tablebase_move
+      self.score = result * (MATE_SCORE - plies) if result else DRAW_SCORE
+      self.from_tablebase = True
+      self.elapsed = time.perf_counter() - start
+      return self.best_move
+
+    for depth in range(min(start_depth, max_depth), max_depth + 1):
+      score, move = self._search_root(position, root_moves, depth)
+      if move:
+        self.best_move = move
+        self.score = score
+      if self.stop:
+        break
+
+      self.depth = depth
+      self.elapsed = time.perf_counter() - start
+      self.pv = self._get_pv(position, depth)
+      if on_iteration:
+        on_iteration(self)
+
+      # A forced mate was found or there is only one legal move, deeper searches won't change anything:
+      if abs(score) >= MATE_SCORE - MAX_PLY or len(root_moves) <= 1:
+        break
+
+    self.elapsed = time.perf_counter() - start
+
+    return self.best_move
+
+  def new_game(self):
+    '''Method that forgets what was learnt in previous searches (transposition table and history), so the searches of a game don't depend on the games before.'''
+    self.tt.clear()
+    self.history = [0] * 4096
+
+  def evaluate(self, position):
+    '''Method that returns the static evaluation of a position in centipawns, from the point of view of the side to move.
+    The material and piece-square scores are kept up to date by the position on every move, so nothing is scanned here (except in debug mode).'''
+    if self.debug:
+      scores = position.compute_scores()
+      if scores != (position.middlegame_score, position.endgame_score, position.phase):
+        raise AssertionError(f"Incremental evaluation {(position.middlegame_score, position.endgame_score, position.phase)} != full-board evaluation {scores}")
+
+    return position.evaluate()
+
+  def get_info(self):
+    '''Method that returns a one-line summary of the last search (depth, score, nodes, nodes/sec, time and principal variation).'''
+    if self.from_book:
+      return f"book move {self.aux.get_move_name(self.best_move)}"
+    if abs(self.score) >= MATE_SCORE - MAX_PLY:
+      moves_to_mate = (MATE_SCORE - abs(self.score) + 1) // 2
+      score = f"mate {moves_to_mate if self.score > 0 else -moves_to_mate}"
+    else:
+      score = f"cp {self.score}"
+    if self.from_tablebase:
+      return f"tablebase move {self.aux.get_move_name(self.best_move)} score {score}"
+    pv = " ".join(self.aux.get_move_name(move) for move in self.pv)
+
+    return f"depth {self.depth} score {score} nodes {self.nodes} nps {self.nodes_per_second:.0f} time {self.elapsed:.2f} pv {pv}"
+
+  def _search_root(self, position, root_moves, depth):
+    '''Method that searches all the root moves at a depth. Returns a tuple with the best score and move found (move is 0 if the search was stopped before any result).'''
+    alpha = -INFINITE
+    best_move = 0
+    ordered_moves = self._order_moves(position, root_moves, self.best_move, 0)
+
+    for move in ordered_moves:
+      position.make_move(move)
+      score = -self._negamax(position, depth - 1, -INFINITE, -alpha, 1)
+      position.unmake_move()
+
+      if self.stop:
+        break
+      if score > alpha:
+        alpha = score
+        best_move = move
+
+    if best_move:
+      self.tt.store(position.hash, best_move, alpha, depth, BOUND_EXACT)
+
+    return alpha, best_move
+
+  def _negamax(self, position, depth, alpha, beta, ply):
+    '''Method that returns the score of a position with a fail-soft negamax alpha-beta search of a depth (int), from the point of view of the side to move.'''
+    self.nodes += 1
+    if not self.nodes & TIME_CHECK_NODES:
+      self._check_time()
+    if self.stop:
+      return 0
+
+    # Draws by the fifty moves rule or repetition (a single repetition is enough inside the search):
+    if position.halfmove_clock >= 100 or position.repetition_count():
+      return DRAW_SCORE
+
+    # Endings of the tablebase have an exact score (the probe returns None at once with more pieces):
+    if self.tablebase and ply:
+      probe = self.tablebase.probe(position)
+      if probe:
+        return probe[0] * (MATE_SCORE - ply - probe[1]) if probe[0] else DRAW_SCORE
+
+    # Check extension, so the search doesn't stop in the middle of a mating attack:
+    in_check = self._in_check(position)
+    if in_check and ply < MAX_PLY // 2:
+      depth += 1
+    if depth <= 0 or ply >= MAX_PLY - 1:
+      return self._quiescence(position, alpha, beta, ply)
+
+    # Transposition table: a deep enough result can end the search, and its move is searched first:
+    data = self.tt.probe(position.hash)
+    if data and data >> 32 & 0xFF >= depth:
+      score = self._score_from_tt((data >> 16 & 0xFFFF) - 32768, ply)
+      bound = data >> 40 & 3
+      if bound == BOUND_EXACT or (bound == BOUND_LOWER and score >= beta) or (bound == BOUND_UPPER and score <= alpha):
+        return score
+
+    moves = self.rules.generate_legal_moves(position)
+    if not moves:
+      return -MATE_SCORE + ply if in_check else DRAW_SCORE
+
+    original_alpha = alpha
+    best_score = -INFINITE
+    best_move = 0
+    for move in self._order_moves(position, moves, data & 0xFFFF, ply):
+      position.make_move(move)
+      score = -self._negamax(position, depth - 1, -beta, -alpha, ply + 1)
+      position.unmake_move()
+
+      if self.stop:
+        return 0
+      if score > best_score:
+        best_score = score
+        best_move = move
+        if score > alpha:
+          alpha = score
+          if score >= beta:
+            # Quiet moves that cause a cutoff become killers and gain history:
+            if not move >> 12 & (CAPTURE | PROMOTION):
+              killers = self.killers[ply]
+              if killers[0] != move:
+                killers[1] = killers[0]
+                killers[0] = move
+              self.history[move & 0xFFF] += depth * depth
+            break
+
+    if best_score >= beta:
+      bound = BOUND_LOWER
+    elif best_score > original_alpha:
+      bound = BOUND_EXACT
+    else:
+      bound = BOUND_UPPER
+      best_move = 0    # Every move failed low, so none of them is known to be the best.
+    self.tt.store(position.hash, best_move, self._score_to_tt(best_score, ply), depth, bound)
+
+    return best_score
+
+  def _quiescence(self, position, alpha, beta, ply):
+    '''Method that extends the search with captures only until the position is quiet, so the static evaluation isn't taken in the middle of an exchange.'''
+    self.nodes += 1
+    if not self.nodes & TIME_CHECK_NODES:
+      self._check_time()
+    if self.stop:
+      return 0
+
+    # Stand pat: the side to move can usually avoid capturing:
+    best_score = self.evaluate(position)
+    if best_score >= beta or ply >= MAX_PLY - 1:
+      return best_score
+    if best_score > alpha:
+      alpha = best_score
+
+    captures = [move for move in self.rules.generate_legal_moves(position) if move >> 12 & CAPTURE]
+    for move in self._order_moves(position, captures, 0, ply):
+      position.make_move(move)
+      score = -self._quiescence(position, -beta, -alpha, ply + 1)
+      position.unmake_move()
+
+      if self.stop:
+        return 0
+      if score > best_score:
+        best_score = score
+        if score > alpha:
+          alpha = score
+          if score >= beta:
+            break
+
+    return best_score
+
+  def _order_moves(self, position, moves, hash_move, ply):
+    '''Method that returns the moves sorted to search first the ones most likely to cause a cutoff: hash move, captures (most valuable victim,
+    least valuable attacker), killer moves and then quiet moves by their history score.'''
+    squares = position.squares
+    killers = self.killers[ply]
+    history = self.history
+    scored_moves = []
+
+    for move in moves:
+      if move == hash_move:
+        score = HASH_MOVE_SCORE
+      elif move >> 12 & CAPTURE:
+        victim = squares[move >> 6 & 63] & PIECE_MASK or PAWN_ID   # En passant destination squares are empty.
+        score = CAPTURE_SCORE + (victim << 4) - (squares[move & 63] & PIECE_MASK)
+      elif move >> 12 & PROMOTION:
+        score = CAPTURE_SCORE + (move >> 12 & 3)
+      elif move == killers[0]:
+        score = KILLER_SCORES[0]
+      elif move == killers[1]:
+        score = KILLER_SCORES[1]
+      else:
+        score = history[move & 0xFFF]
+      scored_moves.append((score, move))
+
+    scored_moves.sort(reverse=True)
+
+    return [move for _, move in scored_moves]
+
+  def _check_time(self):
+    '''Method that stops the search when the time or node budget is over (the node budget once the first depth is done) or when another process asks for it.'''
+    if (time.perf_counter() > self.deadline or (self.stop_event is not None and self.stop_event.is_set())
+        or self.max_nodes and self.nodes >= self.max_nodes and self.depth):
+      self.stop = True
+
+  def _score_to_tt(self, score, ply):
+    '''Method that converts a mate score from distance to the root into distance to the current position, before saving it in the transposition table.'''
+    if score >= MATE_SCORE - MAX_PLY:
+      return score + ply
+    if score <= -MATE_SCORE + MAX_PLY:
+      return score - ply
+
+    return score
+
+  def _score_from_tt(self, score, ply):
+    '''Method that converts a mate score read from the transposition table back into distance to the root.'''
+    if score >= MATE_SCORE - MAX_PLY:
+      return score - ply
+    if score <= -MATE_SCORE + MAX_PLY:
+      return score + ply
+
+    return score
+
+  def _in_check(self, position):
+    '''Method that checks if the side to move is in check. Returns a boolean according to the case.'''
+    king_square = position.bitboards[KING_ID | position.side << COLOR_SHIFT].bit_length() - 1
+
+    return self.rules.is_square_attacked(position, king_square, position.side ^ 1, position.occupied)
+
+  def _get_pv(self, position, depth):
+    '''Method that returns the principal variation (list of moves) by following the saved hash moves from a position.'''
+    pv = []
+
+    while len(pv) < depth:
+      move = self.tt.probe(position.hash) & 0xFFFF
+      if not move or move not in self.rules.generate_legal_moves(position):
+        break
+      pv.append(move)
+      position.make_move(move)
+
+    for _ in pv:
+      position.unmake_move()
+
+    return pv
+
+
+class ParallelSearch():
+  '''The class that runs the engine search on several processes (lazy SMP): helper processes search the same position, at staggered depths,
+  sharing one transposition table in shared memory, so the main search finds more of the tree already explored.
+  With one thread it is just the engine search in this process, so results are deterministic.'''
+  def __init__(self, threads=1, time_limit=DEFAULT_TIME_LIMIT, max_depth=MAX_DEPTH, hash_mb=DEFAULT_HASH_MB, policy=REPLACE_TWO_TIER, book=None,
+               tablebase=None):
+    self.threads = max(threads, 1)
+    self.shared_memory = None
+    self.stop_event = None
+    self.pool = None
+
+    if self.threads == 1:
+      self.engine = ChessEngine(time_limit, max_depth, hash_mb, policy, book=book, tablebase=tablebase)
+    else:
+      self.shared_memory = shared_memory.SharedMemory(create=True, size=TranspositionTable.get_size_in_bytes(hash_mb))
+      self.stop_event = multiprocessing.Event()
+      self.engine = ChessEngine(time_limit, max_depth, hash_mb, policy, tt_buffer=self.shared_memory.buf, stop_event=self.stop_event, book=book,
+                                tablebase=tablebase)
+      self.pool = multiprocessing.Pool(self.threads - 1, initializer=_init_helper,
+                                       initargs=(self.shared_memory.name, hash_mb, policy, self.stop_event))
+
+    # Stats of the last search (all processes):
+    self.nodes = 0
+    self.elapsed = 0.0
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exception):
+    self.close()
+
+  @property
+  def nodes_per_second(self):
+    '''The nodes per second of the last search, adding the nodes of all processes.'''
+    return self.nodes / self.elapsed if self.elapsed else 0.0
+
+  def search(self, position, time_limit=None, max_depth=None, on_iteration=None):
+    '''Method that searches the best move of a position with all the threads. Returns the best 16-bit move found by the main search.'''
+    start = time.perf_counter()
+
+    # Book and tablebase positions don't need the helpers:
+    if (self.threads == 1 or self.engine.book and self.engine.book.get_moves(position)
+        or self.engine.tablebase and self.engine.tablebase.probe(position)):
+      move = self.engine.search(position, time_limit, max_depth, on_iteration)
+      self.nodes = self.engine.nodes
+
+    else:
+      # Helpers start at depth 1 or 2 alternately, so they don't all search the same nodes at the same time:
+      self.stop_event.clear()
+      age = (self.engine.tt.age + 1) & AGE_MASK
+      helpers = [self.pool.apply_async(_helper_search, (position, time_limit, max_depth, 1 + helper % 2, age))
+                 for helper in range(1, self.threads)]
+      move = self.engine.search(position, time_limit, max_depth, on_iteration)
+      self.stop_event.set()
+      self.nodes = self.engine.nodes + sum(helper.get() for helper in helpers)
+
+    self.elapsed = time.perf_counter() - start
+
+    return move
+
+  def measure_speedup(self, position, depth):
+    '''Method that searches a position to a fixed depth with one worker and then with all the threads (both starting with an empty table).
+    Returns a tuple with the seconds and nodes/sec of one worker and of all the threads.'''
+    single = ChessEngine(time_limit=float("inf"), hash_mb=self.engine.tt.size_mb, policy=self.engine.tt.policy)
+    start = time.perf_counter()
+    single.search(position, max_depth=depth)
+    single_time = time.perf_counter() - start
+
+    self.engine.tt.clear()
+    self.search(position, time_limit=float("inf"), max_depth=depth)
+
+    return single_time, single.nodes / single_time if single_time else 0.0, self.elapsed, self.nodes_per_second
+
+  def close(self):
+    '''Method that stops the helper processes and frees the shared memory.'''
+    if self.pool is not None:
+      self.stop_event.set()
+      self.pool.terminate()
+      self.pool.join()
+      self.pool = None
+    if self.shared_memory is not None:
+      self.engine.tt.release()
+      self.shared_memory.close()
+      self.shared_memory.unlink()
+      self.shared_memory = None
+
+
+# Helper processes:
+_helper_engine = None
+_helper_shared_memory = None
+
+
+def _init_helper(shared_memory_name, hash_mb, policy, stop_event):
+  '''Function that creates the engine of a helper process, attached to the shared transposition table.'''
+  global _helper_engine, _helper_shared_memory
+  _helper_shared_memory = shared_memory.SharedMemory(name=shared_memory_name)
+  _helper_engine = ChessEngine(hash_mb=hash_mb, policy=policy, tt_buffer=_helper_shared_memory.buf, stop_event=stop_event)
+
+
+def _helper_search(position, time_limit, max_depth, start_depth, age):
+  '''Function that runs a helper search (with the same table age as the main search). Returns the nodes searched.'''
+  _helper_engine.tt.age = (age - 1) & AGE_MASK    # The search increases it once more.
+  _helper_engine.search(position, time_limit, max_depth, start_depth=start_depth)
+
+  return _helper_engine.nodes
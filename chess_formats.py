@@ -0,0 +1,384 @@
+# Standard libraries:
+from array import array
+import mmap
+import os
+import re
+import struct
+import sys
+
+# Local modules:
+from chess_in_terminal import (ChessPosition, ChessValidator, AUX, RULES, ALGEBRAIC_NAMES, ALGEBRAIC_SQUARES, CAPTURE, COLOR_SHIFT, GAME_END,
+                               KING_CASTLE, KING_ID, KNIGHT_ID, PAWN_ID, PIECE_IDS, PIECE_LETTERS, PIECE_MASK, PROMOTION, PROMOTION_IDS,
+                               QUEEN_CASTLE, START_FEN, WHITE_ID)
+
+
+# Constants:
+SAN_PATTERN = re.compile(r"([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQnbrq]))?")
+CASTLING_SANS = {"O-O": KING_CASTLE, "0-0": KING_CASTLE, "O-O-O": QUEEN_CASTLE, "0-0-0": QUEEN_CASTLE}
+SAN_SUFFIXES = "+#!?"
+PGN_RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+PGN_TAG_PATTERN = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+PGN_TOKEN_PATTERN = re.compile(r"\{[^}]*\}?|;.*|\(|\)|\$\d+|\d+\.(?:\.\.)?|[^\s(){};]+")
+PGN_SEVEN_TAGS = (("Event", "?"), ("Site", "?"), ("Date", "????.??.??"), ("Round", "?"), ("White", "?"), ("Black", "?"))
+PGN_LINE_LENGTH = 79
+
+# Binary game archive: a header, a block per game (FEN of its initial position if it is not the usual one, and its 16-bit moves as a little-endian array('H'))
+# and an index at the end with an entry per game, so any game can be read at once from a memory map:
+ARCHIVE_MAGIC = b"CHESSARC"
+ARCHIVE_VERSION = 1
+ARCHIVE_HEADER = struct.Struct("<8sHxxIQ")      # Magic, version, number of games and offset of the index.
+ARCHIVE_INDEX_ENTRY = struct.Struct("<QIHBx")   # Offset of the game block, number of moves, length of the FEN (0 if none) and result.
+ARCHIVE_RESULTS = PGN_RESULTS[-1:] + PGN_RESULTS[:-1]   # Unknown result ("*") first, so it is 0.
+
+
+# Classes:
+class PgnGame():
+  '''The class that keeps a game read from a PGN file: its tags (dict), its moves in SAN (list) and its result.'''
+  def __init__(self, tags=None, sans=None, result="*"):
+    self.tags = tags if tags is not None else {}
+    self.sans = sans if sans is not None else []
+    self.result = result
+
+
+class Pgn():
+  '''The class that reads and writes games in PGN (Portable Game Notation), with moves in SAN (Standard Algebraic Notation) resolved through the legal move generator.'''
+  def __init__(self):
+    self.rules = RULES
+    self.aux = AUX
+
+  def parse_san(self, position, san, moves=None):
+    '''Method that returns the legal 16-bit move of a SAN string (like "Nbd7", "exd5", "e8=Q+" or "O-O") in a position, or None if it is not legal or it is ambiguous.
+    The legal moves of the position can be passed if they are already known.'''
+    san = san.rstrip(SAN_SUFFIXES)
+    if moves is None:
+      moves = self.rules.generate_legal_moves(position)
+
+    if san in CASTLING_SANS:
+      flags = CASTLING_SANS[san]
+      return next((move for move in moves if move >> 12 == flags), None)
+
+    match = SAN_PATTERN.fullmatch(san)
+    if not match:
+      return None
+    piece, from_col, from_row, destination, promotion = match.groups()
+    piece_id = PIECE_IDS[piece] if piece else PAWN_ID
+    destination = ALGEBRAIC_SQUARES[destination]
+    promotion_id = PROMOTION_IDS[promotion.upper()] if promotion else None
+
+    # Only 1 legal move must match the piece, destination, disambiguation and promotion:
+    found = None
+    for move in moves:
+      source = move & 63
+      if move >> 6 & 63 != destination or position.squares[source] & PIECE_MASK != piece_id:
+        continue
+      if from_col and ALGEBRAIC_NAMES[source][0] != from_col or from_row and ALGEBRAIC_NAMES[source][1] != from_row:
+        continue
+      if (KNIGHT_ID + (move >> 12 & 3) if move >> 12 & PROMOTION else None) != promotion_id:
+        continue
+      if found is not None:
+        return None
+      found = move
+
+    return found
+
+  def get_san(self, position, move, moves=None):
+    '''Method that returns the SAN string of a legal 16-bit move in a position (with the "+" or "#" suffix if it gives check or checkmate).
+    The legal moves of the position can be passed if they are already known.'''
+    if moves is None:
+      moves = self.rules.generate_legal_moves(position)
+    source = move & 63
+    destination = move >> 6 & 63
+    flags = move >> 12
+
+    if flags == KING_CASTLE:
+      san = "O-O"
+    elif flags == QUEEN_CASTLE:
+      san = "O-O-O"
+    else:
+      piece_id = position.squares[source] & PIECE_MASK
+      capture = "x" if flags & CAPTURE else ""
+
+      if piece_id == PAWN_ID:
+        san = (ALGEBRAIC_NAMES[source][0] if capture else "") + capture + ALGEBRAIC_NAMES[destination]
+        if flags & PROMOTION:
+          san += "=" + PIECE_LETTERS[KNIGHT_ID + (flags & 3)]
+      else:
+        # Add the col, the row or both of the source when other pieces of the same kind can move to the destination:
+        name = ALGEBRAIC_NAMES[source]
+        others = [ALGEBRAIC_NAMES[other & 63] for other in moves
+                  if other >> 6 & 63 == destination and other & 63 != source and position.squares[other & 63] & PIECE_MASK == piece_id]
+        disambiguation = ""
+        if others:
+          if all(other[0] != name[0] for other in others):
+            disambiguation = name[0]
+          elif all(other[1] != name[1] for other in others):
+            disambiguation = name[1]
+          else:
+            disambiguation = name
+        san = PIECE_LETTERS[piece_id] + disambiguation + capture + ALGEBRAIC_NAMES[destination]
+
+    position.make_move(move)
+    king_square = position.bitboards[KING_ID | position.side << COLOR_SHIFT].bit_length() - 1
+    if self.rules.is_square_attacked(position, king_square, position.side ^ 1, position.occupied):
+      san += "+" if self.rules.generate_legal_moves(position) else "#"
+    position.unmake_move()
+
+    return san
+
+  def read_games(self, open_file):
+    '''Generator that reads the games of a PGN file one at a time, so big files with many games are streamed from disk. Yields a PgnGame object per game.
+    Comments, variations, NAGs and move numbers are skipped.'''
+    game = PgnGame()
+    in_comment = False
+    variation_depth = 0
+
+    for line in open_file:
+      # A comment between braces can span several lines:
+      if in_comment:
+        end = line.find("}")
+        if end < 0:
+          continue
+        line = line[end + 1:]
+        in_comment = False
+
+      stripped = line.strip()
+      if not stripped or stripped[0] == '%':
+        continue
+
+      # Tags after the moves of a game start the next one:
+      if stripped[0] == '[':
+        if game.sans:
+          game.result = game.tags.get("Result", "*")
+          yield game
+          game = PgnGame()
+        for name, value in PGN_TAG_PATTERN.findall(stripped):
+          game.tags[name] = value.replace('\\"', '"').replace("\\\\", "\\")
+        continue
+
+      for token in PGN_TOKEN_PATTERN.findall(line):
+        first = token[0]
+        if first == '{':
+          in_comment = not token.endswith("}")
+        elif first == '(':
+          variation_depth += 1
+        elif first == ')':
+          variation_depth = max(variation_depth - 1, 0)
+        elif variation_depth or first in ";$" or first.isdigit() and token.endswith("."):
+          continue
+        elif token in PGN_RESULTS:
+          game.result = token
+          yield game
+          game = PgnGame()
+        else:
+          game.sans.append(token)
+
+    if game.sans:
+      game.result = game.tags.get("Result", "*")
+      yield game
+
+  def iterate_moves(self, open_file):
+    '''Generator that yields the moves of the games of a PGN file like the other move file readers (see Aux.get_moves_from_file), closing the file at the end.'''
+    with open_file:
+      for game in self.read_games(open_file):
+        position = ChessPosition()
+        fen = game.tags.get("FEN")
+        try:
+          position.set_fen(fen or START_FEN)
+        except ValueError:
+          yield f"[FEN \"{fen}\"]"
+          yield GAME_END
+          continue
+        if fen:
+          yield {"fen": fen}
+
+        for san in game.sans:
+          move = self.parse_san(position, san)
+          if move is None:
+            yield san
+            break
+          yield self.aux.get_move_array(move)
+          position.make_move(move)
+
+        yield GAME_END
+
+  def write_game(self, open_file, moves, tags=None, fen=None, result="*", annotations=None):
+    '''Method that writes a game in PGN to an open file, from its list of 16-bit moves (and the FEN string of its initial position, if it is not the usual one).
+    Moves can be annotated with a list of (NAG, comment) tuples, one per move, where empty ones are left out (like ("$4", "Blunder.") or ("", "")).'''
+    tags = tags or {}
+    tags = {**{name: tags.get(name, value) for name, value in PGN_SEVEN_TAGS}, "Result": result, **tags}
+    tags["Result"] = result
+    if fen and fen != START_FEN:
+      tags["SetUp"] = "1"
+      tags["FEN"] = fen
+
+    for name, value in tags.items():
+      value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+      open_file.write(f'[{name} "{value}"]\n')
+    open_file.write("\n")
+
+    # Moves in SAN, with the move number before white moves (and before the first one if black starts):
+    position = ChessPosition()
+    position.set_fen(fen or START_FEN)
+    tokens = []
+    for index, move in enumerate(moves):
+      if position.side == WHITE_ID or not tokens or annotations and annotations[index-1][1]:
+        tokens.append(f"{position.fullmove_number}{'.' if position.side == WHITE_ID else '...'}")
+      tokens.append(self.get_san(position, move))
+      position.make_move(move)
+      if annotations:
+        nag, comment = annotations[index]
+        if nag:
+          tokens.append(nag)
+        if comment:
+          tokens.extend(f"{{{comment.replace('}', ')')}}}".split(" "))
+    tokens.append(result)
+
+    line = ""
+    for token in tokens:
+      if line and len(line) + 1 + len(token) > PGN_LINE_LENGTH:
+        open_file.write(line + "\n")
+        line = token
+      else:
+        line = f"{line} {token}" if line else token
+    open_file.write(line + "\n\n")
+
+  def run_export(self, files, open_file=sys.stdout):
+    '''Method that converts the games of move files (JSON, JSON lines or PGN) to PGN, written to an open file (the standard output by default).
+    Games with an illegal move are written up to it, with an unknown result ("*"). Returns the exit status for the command line (1 if any game could not be fully converted).'''
+    failures = 0
+    validator = ChessValidator()
+
+    for file in files:
+      for result, board, start_fen in validator.replay_file(file):
+        if result["error"] or result["illegal_move"]:
+          failures += 1
+          print(f"{file} #{result['game']}: {result['error'] or result['message']}", file=sys.stderr)
+        if board is None:
+          continue
+
+        tags = {"Event": file, "Round": result["game"]}
+        self.write_game(open_file, board.position.get_moves(), tags, start_fen, "*" if result["illegal_move"] else self.get_result(board.position))
+
+    return 1 if failures else 0
+
+  def get_result(self, position):
+    '''Method that returns the PGN result of a position: who won if the side to move is checkmated, a draw if it is stalemated and "*" otherwise.'''
+    if self.rules.generate_legal_moves(position):
+      return "*"
+    king_square = position.bitboards[KING_ID | position.side << COLOR_SHIFT].bit_length() - 1
+    if not self.rules.is_square_attacked(position, king_square, position.side ^ 1, position.occupied):
+      return "1/2-1/2"
+
+    return "0-1" if position.side == WHITE_ID else "1-0"
+
+
+class GameArchive():
+  '''The class that reads a binary archive of games (written with GameArchive.write), memory-mapped so big collections are not loaded and any game is read at once.
+  Each game is returned as a tuple with its 16-bit moves (array('H')), the FEN string of its initial position (None for the usual one) and its PGN result.'''
+  def __init__(self, file):
+    self.aux = AUX
+    self.file = open(file, "rb")
+    try:
+      self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+      magic, version, self.games, self.index_offset = ARCHIVE_HEADER.unpack_from(self.map)
+    except (ValueError, struct.error):
+      self.file.close()
+      raise ValueError(f"Invalid game archive: {file}")
+    if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION or self.index_offset + self.games * ARCHIVE_INDEX_ENTRY.size > len(self.map):
+      self.close()
+      raise ValueError(f"Invalid game archive: {file}")
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exception):
+    self.close()
+
+  def __len__(self):
+    return self.games
+
+  def __getitem__(self, index):
+    if index < 0:
+      index += self.games
+    if not 0 <= index < self.games:
+      raise IndexError("Game index out of range.")
+
+    offset, total_moves, fen_length, result = ARCHIVE_INDEX_ENTRY.unpack_from(self.map, self.index_offset + index * ARCHIVE_INDEX_ENTRY.size)
+    fen = self.map[offset:offset + fen_length].decode() if fen_length else None
+    start = offset + fen_length + (fen_length & 1)   # Moves start at an even offset.
+    moves = array("H", self.map[start:start + 2 * total_moves])
+    if sys.byteorder == "big":
+      moves.byteswap()
+
+    return moves, fen, ARCHIVE_RESULTS[result]
+
+  def __iter__(self):
+    for index in range(self.games):
+      yield self[index]
+
+  def close(self):
+    '''Method that closes the memory map and the file of the archive.'''
+    self.map.close()
+    self.file.close()
+
+  def iterate_moves(self):
+    '''Generator that yields the moves of the games of the archive like the other move file readers (see Aux.get_moves_from_file), closing the archive at the end.'''
+    with self:
+      for moves, fen, _ in self:
+        if fen:
+          yield {"fen": fen}
+        for move in moves:
+          yield self.aux.get_move_array(move)
+        yield GAME_END
+
+  @staticmethod
+  def write(file, games):
+    '''Method that writes an archive from an iterable of games, each one a tuple with its 16-bit moves, the FEN string of its initial position (or None) and its PGN result.
+    Games are written as they come (only the index is kept until the end), so the iterable can be a generator. Returns the number of games written.'''
+    index = bytearray()
+    with open(file, "wb") as open_file:
+      open_file.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, 0, 0))
+      offset = ARCHIVE_HEADER.size
+
+      for moves, fen, result in games:
+        fen = fen.encode() if fen and fen != START_FEN else b""
+        moves = array("H", moves)
+        if sys.byteorder == "big":
+          moves.byteswap()
+        block = fen + bytes(len(fen) & 1) + moves.tobytes()
+        index += ARCHIVE_INDEX_ENTRY.pack(offset, len(moves), len(fen), ARCHIVE_RESULTS.index(result) if result in ARCHIVE_RESULTS else 0)
+        open_file.write(block)
+        offset += len(block)
+
+      # The index goes at the end and the header is written again with its offset:
+      open_file.write(index)
+      games = len(index) // ARCHIVE_INDEX_ENTRY.size
+      open_file.seek(0)
+      open_file.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, games, offset))
+
+    return games
+
+  @staticmethod
+  def run_build(files, archive):
+    '''Method that replays the games of move files (JSON, JSON lines, PGN or archives) and writes the legal ones to an archive, printing the number of games and the sizes.
+    Games with an illegal move are written up to it, with an unknown result ("*"). Returns the exit status for the command line (1 if any game could not be fully converted).'''
+    validator = ChessValidator()
+    pgn = Pgn()
+    failures = 0
+
+    def iterate_games():
+      nonlocal failures
+      for file in files:
+        for result, board, start_fen in validator.replay_file(file):
+          if result["error"] or result["illegal_move"]:
+            failures += 1
+            print(f"{file} #{result['game']}: {result['error'] or result['message']}", file=sys.stderr)
+          if board is not None:
+            yield board.position.get_moves(), start_fen, "*" if result["illegal_move"] else pgn.get_result(board.position)
+
+    games = GameArchive.write(archive, iterate_games())
+    files_size = sum(os.path.getsize(file) for file in files if os.path.isfile(file))
+    archive_size = os.path.getsize(archive)
+    print(f"{games} games written to {archive}: {archive_size:,} bytes ({archive_size / files_size if files_size else 0:.1%} of {files_size:,} bytes).")
+
+    return 1 if failures else 0
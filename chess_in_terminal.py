@@ -1,16 +1,16 @@
 # Standard libraries:
+from array import array
+from collections import deque
+from itertools import islice
+import argparse
+import csv
+import glob
 import json
-import os
+import random
 import sys
 import time
 
-# 3° libraries:
-from rich.console import Console
-from rich.padding import Padding
-from rich.panel import Panel
-from rich.table import Table
-from rich import box
-import numpy
+# 3° libraries: Rich, imported by the TUI the first time it shows something (so the modes that render nothing never load it).
 
 
 # Constants:
@@ -18,7 +18,9 @@ JSON_FILE = "moves.json"
 OPTION_ONE = '1'
 OPTION_TWO = '2'
 OPTION_THREE = '3'
-VALID_OPTIONS = (OPTION_ONE, OPTION_TWO, OPTION_THREE)
+OPTION_FOUR = '4'
+VALID_OPTIONS = (OPTION_ONE, OPTION_TWO, OPTION_THREE, OPTION_FOUR)
+QUIT_COMMANDS = ("quit", "exit", 'q')
 
 WHITES = "white"
 BLACKS = "black"
@@ -43,6 +45,202 @@ SECOND_ROW = 1
 SEVENTH_ROW = 6
 TABLE_WIDTH = 55
 
+# Position core (squares are numbered row * 8 + col, so square 0 is "1a" and square 63 is "8h"):
+TOTAL_SQUARES = TOTAL_ROWS * TOTAL_COLS
+FULL_BOARD = (1 << TOTAL_SQUARES) - 1
+EMPTY = 0
+PAWN_ID = 1
+KNIGHT_ID = 2
+BISHOP_ID = 3
+ROOK_ID = 4
+QUEEN_ID = 5
+KING_ID = 6
+WHITE_ID = 0
+BLACK_ID = 1
+COLOR_SHIFT = 3   # Mailbox codes are piece id | color id << 3 (white pieces 1-6, black pieces 9-14).
+PIECE_MASK = 7
+COLOR_IDS = {WHITE: WHITE_ID, BLACK: BLACK_ID}
+COLOR_NAMES = (WHITES, BLACKS)
+PIECE_ID_NAMES = (None, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING)
+PIECE_IDS = {'P': PAWN_ID, 'N': KNIGHT_ID, 'B': BISHOP_ID, 'R': ROOK_ID, 'Q': QUEEN_ID, 'K': KING_ID}
+PIECE_LETTERS = (None, 'P', 'N', 'B', 'R', 'Q', 'K')
+SQUARE_NAMES = tuple(row + col for row in ROWS for col in COLS)
+ALGEBRAIC_NAMES = tuple(col + row for row in reversed(ROWS) for col in COLS)   # Standard names ("a8" ... "h1") used by FEN.
+ALGEBRAIC_SQUARES = {name: square for square, name in enumerate(ALGEBRAIC_NAMES)}
+NO_SQUARE = -1
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+# FEN piece placement, translated in a single pass to mailbox codes (empty squares expanded to '.') and to a bitboard per piece code:
+FEN_EMPTY = '.'
+FEN_PIECE_CHARS = FEN_EMPTY + "PNBRQKpnbrqk"
+FEN_CODES = bytes([EMPTY] + [piece_id | color_id << COLOR_SHIFT for color_id in (WHITE_ID, BLACK_ID) for piece_id in range(PAWN_ID, KING_ID+1)])
+FEN_EXPAND = str.maketrans({str(count): FEN_EMPTY * count for count in range(1, TOTAL_COLS+1)})
+FEN_TO_CODES = bytes.maketrans(FEN_PIECE_CHARS.encode(), FEN_CODES)
+CODES_TO_FEN = bytes.maketrans(FEN_CODES, FEN_PIECE_CHARS.encode())
+FEN_TO_BITBOARDS = {code: str.maketrans(FEN_PIECE_CHARS, "".join('1' if other == char else '0' for other in FEN_PIECE_CHARS))
+                    for char, code in zip(FEN_PIECE_CHARS[1:], FEN_CODES[1:])}
+
+# Castling rights (bit flags) and the squares involved (kings on "8e"/"1e", rooks on the corners):
+WHITE_KING_SIDE = 1
+WHITE_QUEEN_SIDE = 2
+BLACK_KING_SIDE = 4
+BLACK_QUEEN_SIDE = 8
+ALL_CASTLING_RIGHTS = WHITE_KING_SIDE | WHITE_QUEEN_SIDE | BLACK_KING_SIDE | BLACK_QUEEN_SIDE
+KING_HOME_SQUARES = (60, 4)                  # Indexed by color id.
+CASTLING_ROOK_SQUARES = (63, 56, 7, 0)       # Corner of the rook of each right, in "KQkq" order.
+PAWN_FORWARD = (-TOTAL_COLS, TOTAL_COLS)     # Whites move row-descending, blacks row-ascending.
+PAWN_START_ROWS = (SEVENTH_ROW, SECOND_ROW)
+PROMOTION_ROWS = (0, TOTAL_ROWS-1)
+MAX_FEN_COUNTER = (1 << 32) - 1              # The undo records keep the halfmove clock in 33 bits, so a FEN leaves room for as many more moves.
+
+# 16-bit moves: source square (bits 0-5), destination square (bits 6-11) and flags (bits 12-15):
+QUIET_MOVE = 0
+DOUBLE_PAWN_PUSH = 1
+KING_CASTLE = 2
+QUEEN_CASTLE = 3
+CAPTURE = 4
+EP_CAPTURE = 5
+PROMOTION = 8
+PROMOTION_CAPTURE = 12
+PROMOTION_IDS = {'N': KNIGHT_ID, 'B': BISHOP_ID, 'R': ROOK_ID, 'Q': QUEEN_ID}
+
+# Game status after a move (None if the game goes on without check):
+CHECK = "check"
+CHECKMATE = "checkmate"
+STALEMATE = "stalemate"
+FIFTY_MOVE_RULE = "fifty-move rule"
+INSUFFICIENT_MATERIAL = "insufficient material"
+GAME_OVER_STATUSES = (CHECKMATE, STALEMATE, FIFTY_MOVE_RULE, INSUFFICIENT_MATERIAL)
+FIFTY_MOVE_PLIES = 100   # Halfmove clock (plies without captures or pawn moves) of the fifty-move rule.
+LIGHT_SQUARES = sum(1 << square for square in range(TOTAL_SQUARES) if (square // TOTAL_COLS + square % TOTAL_COLS) % 2 == 0)
+
+# Perft reference positions (name, FEN and published leaf nodes counts for depths 1, 2, 3...):
+PERFT_SUITE = (
+  ("Initial position", START_FEN, (20, 400, 8902, 197281, 4865609)),
+  ("Kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", (48, 2039, 97862, 4085603)),
+  ("Position 3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", (14, 191, 2812, 43238, 674624)),
+  ("Position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", (6, 264, 9467, 422333)),
+  ("Position 5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", (44, 1486, 62379, 2103487)),
+  ("Position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", (46, 2079, 89890, 3894594)),
+)
+PERFT_SUITE_DEPTH = 3
+GAME_END = None   # Yielded by the move file readers after the last move of each game.
+JSON_LINES_EXTENSIONS = (".jsonl", ".ndjson")
+PGN_EXTENSION = ".pgn"
+ARCHIVE_EXTENSION = ".cga"   # Binary chess game archive (see chess_formats.GameArchive).
+READ_CHUNK_SIZE = 1 << 16   # Chars read at once by the streaming JSON reader.
+VALIDATE_CHUNK_SIZE = 64   # Files sent at once to each worker process of the validator.
+VALIDATE_REPORT_FIELDS = ("file", "game", "moves", "illegal_move_number", "illegal_move", "message", "fen", "error")
+ZOBRIST_SEED = 2022   # Fixed, so the same position gets the same key on every run and process.
+
+# Evaluation (PeSTO piece values and piece-square tables, written from the whites point of view with row "1" first, just like the squares):
+TOTAL_PHASE = 24
+PHASE_WEIGHTS = (0, 0, 1, 1, 2, 4, 0)   # Indexed by piece id (full material is the middlegame, no pieces the endgame).
+MIDDLEGAME_VALUES = (0, 82, 337, 365, 477, 1025, 0)
+ENDGAME_VALUES = (0, 94, 281, 297, 512, 936, 0)
+MIDDLEGAME_TABLES = (
+  None,
+  (   0,   0,   0,   0,   0,   0,   0,   0,     # Pawn.
+     98, 134,  61,  95,  68, 126,  34, -11,
+     -6,   7,  26,  31,  65,  56,  25, -20,
+    -14,  13,   6,  21,  23,  12,  17, -23,
+    -27,  -2,  -5,  12,  17,   6,  10, -25,
+    -26,  -4,  -4, -10,   3,   3,  33, -12,
+    -35,  -1, -20, -23, -15,  24,  38, -22,
+      0,   0,   0,   0,   0,   0,   0,   0),
+  (-167, -89, -34, -49,  61, -97, -15, -107,   # Knight.
+    -73, -41,  72,  36,  23,  62,   7,  -17,
+    -47,  60,  37,  65,  84, 129,  73,   44,
+     -9,  17,  19,  53,  37,  69,  18,   22,
+    -13,   4,  16,  13,  28,  19,  21,   -8,
+    -23,  -9,  12,  10,  19,  17,  25,  -16,
+    -29, -53, -12,  -3,  -1,  18, -14,  -19,
+   -105, -21, -58, -33, -17, -28, -19,  -23),
+  ( -29,   4, -82, -37, -25, -42,   7,  -8,     # Bishop.
+    -26,  16, -18, -13,  30,  59,  18, -47,
+    -16,  37,  43,  40,  35,  50,  37,  -2,
+     -4,   5,  19,  50,  37,  37,   7,  -2,
+     -6,  13,  13,  26,  34,  12,  10,   4,
+      0,  15,  15,  15,  14,  27,  18,  10,
+      4,  15,  16,   0,   7,  21,  33,   1,
+    -33,  -3, -14, -21, -13, -12, -39, -21),
+  (  32,  42,  32,  51,  63,   9,  31,  43,     # Rook.
+     27,  32,  58,  62,  80,  67,  26,  44,
+     -5,  19,  26,  36,  17,  45,  61,  16,
+    -24, -11,   7,  26,  24,  35,  -8, -20,
+    -36, -26, -12,  -1,   9,  -7,   6, -23,
+    -45, -25, -16, -17,   3,   0,  -5, -33,
+    -44, -16, -20,  -9,  -1,  11,  -6, -71,
+    -19, -13,   1,  17,  16,   7, -37, -26),
+  ( -28,   0,  29,  12,  59,  44,  43,  45,     # Queen.
+    -24, -39,  -5,   1, -16,  57,  28,  54,
+    -13, -17,   7,   8,  29,  56,  47,  57,
+    -27, -27, -16, -16,  -1,  17,  -2,   1,
+     -9, -26,  -9, -10,  -2,  -4,   3,  -3,
+    -14,   2, -11,  -2,  -5,   2,  14,   5,
+    -35,  -8,  11,   2,   8,  15,  -3,   1,
+     -1, -18,  -9,  10, -15, -25, -31, -50),
+  ( -65,  23,  16, -15, -56, -34,   2,  13,     # King.
+     29,  -1, -20,  -7,  -8,  -4, -38, -29,
+     -9,  24,   2, -16, -20,   6,  22, -22,
+    -17, -20, -12, -27, -30, -25, -14, -36,
+    -49,  -1, -27, -39, -46, -44, -33, -51,
+    -14, -14, -22, -46, -44, -30, -15, -27,
+      1,   7,  -8, -64, -43, -16,   9,   8,
+    -15,  36,  12, -54,   8, -28,  24,  14),
+)
+ENDGAME_TABLES = (
+  None,
+  (   0,   0,   0,   0,   0,   0,   0,   0,     # Pawn.
+    178, 173, 158, 134, 147, 132, 165, 187,
+     94, 100,  85,  67,  56,  53,  82,  84,
+     32,  24,  13,   5,  -2,   4,  17,  17,
+     13,   9,  -3,  -7,  -7,  -8,   3,  -1,
+      4,   7,  -6,   1,   0,  -5,  -1,  -8,
+     13,   8,   8,  10,  13,   0,   2,  -7,
+      0,   0,   0,   0,   0,   0,   0,   0),
+  ( -58, -38, -13, -28, -31, -27, -63, -99,     # Knight.
+    -25,  -8, -25,  -2,  -9, -25, -24, -52,
+    -24, -20,  10,   9,  -1,  -9, -19, -41,
+    -17,   3,  22,  22,  22,  11,   8, -18,
+    -18,  -6,  16,  25,  16,  17,   4, -18,
+    -23,  -3,  -1,  15,  10,  -3, -20, -22,
+    -42, -20, -10,  -5,  -2, -20, -23, -44,
+    -29, -51, -23, -15, -22, -18, -50, -64),
+  ( -14, -21, -11,  -8,  -7,  -9, -17, -24,     # Bishop.
+     -8,  -4,   7, -12,  -3, -13,  -4, -14,
+      2,  -8,   0,  -1,  -2,   6,   0,   4,
+     -3,   9,  12,   9,  14,  10,   3,   2,
+     -6,   3,  13,  19,   7,  10,  -3,  -9,
+    -12,  -3,   8,  10,  13,   3,  -7, -15,
+    -14, -18,  -7,  -1,   4,  -9, -15, -27,
+    -23,  -9, -23,  -5,  -9, -16,  -5, -17),
+  (  13,  10,  18,  15,  12,  12,   8,   5,     # Rook.
+     11,  13,  13,  11,  -3,   3,   8,   3,
+      7,   7,   7,   5,   4,  -3,  -5,  -3,
+      4,   3,  13,   1,   2,   1,  -1,   2,
+      3,   5,   8,   4,  -5,  -6,  -8, -11,
+     -4,   0,  -5,  -1,  -7, -12,  -8, -16,
+     -6,  -6,   0,   2,  -9,  -9, -11,  -3,
+     -9,   2,   3,  -1,  -5, -13,   4, -20),
+  (  -9,  22,  22,  27,  27,  19,  10,  20,     # Queen.
+    -17,  20,  32,  41,  58,  25,  30,   0,
+    -20,   6,   9,  49,  47,  35,  19,   9,
+      3,  22,  24,  45,  57,  40,  57,  36,
+    -18,  28,  19,  47,  31,  34,  39,  23,
+    -16, -27,  15,   6,   9,  17,  10,   5,
+    -22, -23, -30, -16, -16, -23, -36, -32,
+    -33, -28, -22, -43,  -5, -32, -20, -41),
+  ( -74, -35, -18, -18, -11,  15,   4, -17,     # King.
+    -12,  17,  14,  17,  17,  38,  23,  11,
+     10,  17,  23,  15,  20,  45,  44,  13,
+     -8,  22,  24,  27,  26,  33,  26,   3,
+    -18,  -4,  21,  24,  27,  23,   9, -11,
+    -19,  -3,  11,  21,  23,  16,   7,  -9,
+    -27, -11,   4,  13,  14,   4,  -5, -17,
+    -53, -34, -21, -11, -28, -14, -24, -43),
+)
+
 NORMAL_TYPE = "normal_type"
 ERROR_TYPE = "error_type"
 
@@ -51,12 +249,464 @@ STYLE_ERROR = "red on white bold"
 STYLE_WHITE = "black on white bold"
 STYLE_BLACK = "white on black bold"
 
+# Escape codes of the differential board renderer (cursor addressing, so only the squares that changed are drawn again):
+ESCAPE_CLEAR_SCREEN = "\x1b[H\x1b[2J"
+ESCAPE_ERASE_LINE = "\x1b[2K"
+ESCAPE_ERASE_DOWN = "\x1b[J"
+ESCAPE_RESET = "\x1b[0m"
+ESCAPE_STYLE_1 = "\x1b[1;3;37m"
+ESCAPE_STYLE_WHITE = "\x1b[1;30;47m"
+ESCAPE_STYLE_BLACK = "\x1b[1;37;40m"
+ESCAPE_WHITE_PIECE = "\x1b[30;47m"
+ESCAPE_BLACK_PIECE = "\x1b[37;40m"
+ESCAPE_EMPTY_SQUARE = "\x1b[2m"
+BOARD_TOP_LINE = 4    # Screen line of the col letters (lines 1-2 are the status and line 3 is the check or result of the game).
+BOARD_LEFT_COLUMN = 4  # Screen column of the first square.
+SQUARE_WIDTH = 4
+
+
+# Precomputed tables:
+def _build_between_table():
+  '''Function that returns a 64x64 table with the bitboard of the squares strictly between two squares sharing a row, column or diagonal (0 if they are not aligned).'''
+  between = [[0] * TOTAL_SQUARES for _ in range(TOTAL_SQUARES)]
+
+  for square in range(TOTAL_SQUARES):
+    row, col = divmod(square, TOTAL_COLS)
+    for row_step, col_step in ((0, 1), (0, -1), (1, 0), (-1, 0), (1, 1), (1, -1), (-1, 1), (-1, -1)):
+      squares_walked = 0
+      next_row, next_col = row + row_step, col + col_step
+      while 0 <= next_row < TOTAL_ROWS and 0 <= next_col < TOTAL_COLS:
+        next_square = next_row * TOTAL_COLS + next_col
+        between[square][next_square] = squares_walked
+        squares_walked |= 1 << next_square
+        next_row, next_col = next_row + row_step, next_col + col_step
+
+  return between
+
+
+def _build_leaper_table(steps):
+  '''Function that returns, for each square, the bitboard of the squares reached with one of the (row, col) steps received (knights and kings).'''
+  table = []
+
+  for square in range(TOTAL_SQUARES):
+    row, col = divmod(square, TOTAL_COLS)
+    attacks = 0
+    for row_step, col_step in steps:
+      if 0 <= row + row_step < TOTAL_ROWS and 0 <= col + col_step < TOTAL_COLS:
+        attacks |= 1 << ((row + row_step) * TOTAL_COLS + col + col_step)
+    table.append(attacks)
+
+  return table
+
+
+def _build_line_tables(directions):
+  '''Function that precomputes the sliding attacks along one line (two opposite directions) for every square and every blockers combination.
+  Returns a list with the mask of relevant blockers of each square and a list with one dict per square mapping masked occupancy -> attacks.'''
+  masks = []
+  tables = []
+
+  for square in range(TOTAL_SQUARES):
+    row, col = divmod(square, TOTAL_COLS)
+
+    # Squares walked on each direction, from the nearest one to the board edge:
+    rays = []
+    for row_step, col_step in directions:
+      ray = []
+      next_row, next_col = row + row_step, col + col_step
+      while 0 <= next_row < TOTAL_ROWS and 0 <= next_col < TOTAL_COLS:
+        ray.append(next_row * TOTAL_COLS + next_col)
+        next_row, next_col = next_row + row_step, next_col + col_step
+      rays.append(ray)
+
+    # A piece on the last square of a ray never blocks anything, so it is left out of the mask:
+    mask = 0
+    for ray in rays:
+      for ray_square in ray[:-1]:
+        mask |= 1 << ray_square
+
+    # Walk every subset of the mask (carry-rippler) and save its attacks:
+    table = {}
+    blockers = 0
+    while True:
+      attacks = 0
+      for ray in rays:
+        for ray_square in ray:
+          attacks |= 1 << ray_square
+          if blockers >> ray_square & 1:
+            break
+      table[blockers] = attacks
+      blockers = (blockers - mask) & mask
+      if blockers == 0:
+        break
+
+    masks.append(mask)
+    tables.append(table)
+
+  return masks, tables
+
+
+def _build_castling_masks():
+  '''Function that returns, for each square, the castling rights kept when a piece moves from or to that square.'''
+  masks = [ALL_CASTLING_RIGHTS] * TOTAL_SQUARES
+  masks[60] &= ~(WHITE_KING_SIDE | WHITE_QUEEN_SIDE)
+  masks[63] &= ~WHITE_KING_SIDE
+  masks[56] &= ~WHITE_QUEEN_SIDE
+  masks[4] &= ~(BLACK_KING_SIDE | BLACK_QUEEN_SIDE)
+  masks[7] &= ~BLACK_KING_SIDE
+  masks[0] &= ~BLACK_QUEEN_SIDE
+
+  return masks
+
+
+BETWEEN = _build_between_table()
+KNIGHT_ATTACKS = _build_leaper_table(((1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)))
+KING_ATTACKS = _build_leaper_table(((0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1)))
+PAWN_ATTACKS = (_build_leaper_table(((-1, -1), (-1, 1))),   # Indexed by color id (whites attack row-descending).
+                _build_leaper_table(((1, -1), (1, 1))))
+RANK_MASKS, RANK_ATTACKS = _build_line_tables(((0, 1), (0, -1)))
+FILE_MASKS, FILE_ATTACKS = _build_line_tables(((1, 0), (-1, 0)))
+DIAGONAL_MASKS, DIAGONAL_ATTACKS = _build_line_tables(((1, 1), (-1, -1)))
+ANTI_DIAGONAL_MASKS, ANTI_DIAGONAL_ATTACKS = _build_line_tables(((1, -1), (-1, 1)))
+CASTLING_MASKS = _build_castling_masks()
+
+# Zobrist keys (pieces indexed by code << 6 | square, castling by rights and en passant by square + 1, using the key of its column):
+_zobrist_random = random.Random(ZOBRIST_SEED)
+ZOBRIST_PIECES = [_zobrist_random.getrandbits(64) for _ in range(16 * TOTAL_SQUARES)]
+ZOBRIST_SIDE = _zobrist_random.getrandbits(64)
+ZOBRIST_CASTLING = [0] + [_zobrist_random.getrandbits(64) for _ in range(ALL_CASTLING_RIGHTS)]
+_zobrist_ep_cols = [_zobrist_random.getrandbits(64) for _ in range(TOTAL_COLS)]
+ZOBRIST_EP = [0] + [_zobrist_ep_cols[square % TOTAL_COLS] for square in range(TOTAL_SQUARES)]
+del _zobrist_random, _zobrist_ep_cols
+
+
+def _build_score_table(values, tables):
+  '''Function that returns the score (piece value plus piece-square bonus, positive for whites and negative for blacks) of every piece on every square,
+  indexed by code << 6 | square. Blacks use the table of the whites mirrored vertically.'''
+  scores = [0] * (16 * TOTAL_SQUARES)
+
+  for piece in range(PAWN_ID, KING_ID + 1):
+    for square in range(TOTAL_SQUARES):
+      scores[(piece | WHITE_ID << COLOR_SHIFT) << 6 | square] = values[piece] + tables[piece][square]
+      scores[(piece | BLACK_ID << COLOR_SHIFT) << 6 | square] = -(values[piece] + tables[piece][square ^ 56])
+
+  return scores
+
+
+MIDDLEGAME_SCORES = _build_score_table(MIDDLEGAME_VALUES, MIDDLEGAME_TABLES)
+ENDGAME_SCORES = _build_score_table(ENDGAME_VALUES, ENDGAME_TABLES)
+
+
+def rook_attacks(square, occupied):
+  '''Function that returns the bitboard of squares attacked by a rook on a square, given the occupancy of the board.'''
+  return RANK_ATTACKS[square][occupied & RANK_MASKS[square]] | FILE_ATTACKS[square][occupied & FILE_MASKS[square]]
+
+
+def bishop_attacks(square, occupied):
+  '''Function that returns the bitboard of squares attacked by a bishop on a square, given the occupancy of the board.'''
+  return DIAGONAL_ATTACKS[square][occupied & DIAGONAL_MASKS[square]] | \
+         ANTI_DIAGONAL_ATTACKS[square][occupied & ANTI_DIAGONAL_MASKS[square]]
+
 
 # Classes:
+class ChessPosition():
+  '''The class that keeps the position core: one 64-bit bitboard per piece code, the occupancy of each color and an int8 mailbox for square lookups.'''
+  __slots__ = ("squares", "bitboards", "colors", "occupied", "side", "castling", "ep_square", "halfmove_clock", "fullmove_number", "undo_stack",
+               "hash", "hash_history", "middlegame_score", "endgame_score", "phase")
+
+  def __init__(self):
+    self.squares = array("b", bytes(TOTAL_SQUARES))   # Mailbox with the piece code of each square (0 if empty).
+    self.bitboards = [0] * 16                         # Indexed by piece code.
+    self.colors = [0, 0]                              # Occupancy indexed by color id.
+    self.occupied = 0
+    self.side = WHITE_ID
+    self.castling = 0
+    self.ep_square = NO_SQUARE
+    self.halfmove_clock = 0
+    self.fullmove_number = 1
+    self.undo_stack = array("Q")                      # Packed undo records (see make_move).
+    self.hash = 0                                     # Zobrist key, updated incrementally.
+    self.hash_history = array("Q")                    # Zobrist keys of the previous positions.
+    self.middlegame_score = 0                         # Material + piece-square scores (whites - blacks), updated incrementally.
+    self.endgame_score = 0
+    self.phase = 0                                    # Non-pawn material left (TOTAL_PHASE with all the pieces).
+
+  def clear(self):
+    '''Method that removes all the pieces from the position.'''
+    self.squares = array("b", bytes(TOTAL_SQUARES))
+    self.bitboards = [0] * 16
+    self.colors = [0, 0]
+    self.occupied = 0
+    self.side = WHITE_ID
+    self.castling = 0
+    self.ep_square = NO_SQUARE
+    self.halfmove_clock = 0
+    self.fullmove_number = 1
+    self.undo_stack = array("Q")
+    self.hash = 0
+    self.hash_history = array("Q")
+    self.middlegame_score = 0
+    self.endgame_score = 0
+    self.phase = 0
+
+  def evaluate(self):
+    '''Method that returns the static evaluation of the position in centipawns from the point of view of the side to move,
+    tapering the middlegame and endgame scores by the game phase.'''
+    phase = min(self.phase, TOTAL_PHASE)
+    score = (self.middlegame_score * phase + self.endgame_score * (TOTAL_PHASE - phase)) // TOTAL_PHASE
+
+    return score if self.side == WHITE_ID else -score
+
+  def compute_scores(self):
+    '''Method that computes the middlegame score, endgame score and phase from scratch (the incremental ones must always be equal to them).
+    Returns them as a tuple.'''
+    middlegame_score = 0
+    endgame_score = 0
+    phase = 0
+    for square, code in enumerate(self.squares):
+      if code != EMPTY:
+        middlegame_score += MIDDLEGAME_SCORES[code << 6 | square]
+        endgame_score += ENDGAME_SCORES[code << 6 | square]
+        phase += PHASE_WEIGHTS[code & PIECE_MASK]
+
+    return middlegame_score, endgame_score, phase
+
+  def compute_hash(self):
+    '''Method that computes the Zobrist key of the position from scratch (the incremental one in self.hash must always be equal to it).'''
+    key = ZOBRIST_CASTLING[self.castling] ^ ZOBRIST_EP[self.ep_square + 1]
+    if self.side == BLACK_ID:
+      key ^= ZOBRIST_SIDE
+    for square, code in enumerate(self.squares):
+      if code != EMPTY:
+        key ^= ZOBRIST_PIECES[code << 6 | square]
+
+    return key
+
+  def repetition_count(self):
+    '''Method that returns how many times the current position was already reached before (same pieces, side to move, castling rights and en passant).
+    Only the positions since the last capture or pawn move are compared, since none before can repeat.'''
+    count = 0
+    history = self.hash_history
+    oldest = max(len(history) - self.halfmove_clock, 0)
+
+    for index in range(len(history) - 2, oldest - 1, -2):
+      if history[index] == self.hash:
+        count += 1
+
+    return count
+
+  def is_threefold_repetition(self):
+    '''Method that checks if the current position has appeared 3 times (so a draw can be claimed). Returns a boolean according to the case.'''
+    return self.repetition_count() >= 2
+
+  def set_fen(self, fen):
+    '''Method that sets up the position from a FEN string (placement, side to move, castling rights, en passant square and move counters).
+    Raises ValueError if the string is not a valid FEN.'''
+    fields = fen.split()
+    if len(fields) < 4 or len(fields[0].split("/")) != TOTAL_ROWS:
+      raise ValueError(f"Invalid FEN: {fen}")
+
+    # Piece placement (FEN starts with the black side, just like the rows of the board), with a char per square:
+    rows = fields[0].translate(FEN_EXPAND).split("/")
+    placement = "".join(rows)
+    if any(len(row) != TOTAL_COLS for row in rows) or placement.strip(FEN_PIECE_CHARS):
+      raise ValueError(f"Invalid FEN piece placement: {fields[0]}")
+    if placement.count("K") != 1 or placement.count("k") != 1:
+      raise ValueError(f"Invalid FEN piece placement (each side needs one king): {fields[0]}")
+    if "P" in rows[0] + rows[-1] or "p" in rows[0] + rows[-1]:
+      raise ValueError(f"Invalid FEN piece placement (pawns can't be on the first or last row): {fields[0]}")
+
+    # The other fields are checked before changing anything, so the position is kept if the string is not valid:
+    if fields[1] not in (WHITE, BLACK):
+      raise ValueError(f"Invalid FEN side to move: {fields[1]}")
+    if fields[2] != "-" and (fields[2].strip("KQkq") or len(set(fields[2])) != len(fields[2])):
+      raise ValueError(f"Invalid FEN castling rights: {fields[2]}")
+    if fields[3] != "-" and (fields[3] not in ALGEBRAIC_SQUARES or fields[3][1] != ("6" if fields[1] == WHITE else "3")):
+      raise ValueError(f"Invalid FEN en passant square: {fields[3]}")
+    if len(fields) >= 6 and not (fields[4].isdecimal() and fields[5].isdecimal() and max(int(fields[4]), int(fields[5])) <= MAX_FEN_COUNTER):
+      raise ValueError(f"Invalid FEN move counters: {fields[4]} {fields[5]}")
+
+    # Mailbox and bitboards are translated at once (bitboards are binary numbers with square 0 as the lowest bit), still apart from this position:
+    placed = ChessPosition()
+    placed.squares = array("b", placement.encode().translate(FEN_TO_CODES))
+    reversed_placement = placement[::-1]
+    for code, table in FEN_TO_BITBOARDS.items():
+      if chr(CODES_TO_FEN[code]) in placement:
+        placed.bitboards[code] = int(reversed_placement.translate(table), 2)
+        placed.colors[code >> COLOR_SHIFT] |= placed.bitboards[code]
+    placed.occupied = placed.colors[WHITE_ID] | placed.colors[BLACK_ID]
+
+    # The side that just moved can't be in check (the side to move could take its king):
+    side = COLOR_IDS[fields[1]]
+    their_king_square = placed.bitboards[KING_ID | (side ^ 1) << COLOR_SHIFT].bit_length() - 1
+    if RULES.is_square_attacked(placed, their_king_square, side, placed.occupied):
+      raise ValueError(f"Invalid FEN position (the side not to move is in check): {fields[0]} {fields[1]}")
+
+    self.clear()
+    self.squares, self.bitboards, self.colors, self.occupied = placed.squares, placed.bitboards, placed.colors, placed.occupied
+    self.middlegame_score, self.endgame_score, self.phase = self.compute_scores()
+
+    # Side to move, castling rights (only kept with their king and rook on the home squares, so castling never moves a missing piece) and en passant square:
+    self.side = side
+    for index, (char, castling_right) in enumerate(zip("KQkq", (WHITE_KING_SIDE, WHITE_QUEEN_SIDE, BLACK_KING_SIDE, BLACK_QUEEN_SIDE))):
+      color = index >> 1
+      if char in fields[2] and self.squares[KING_HOME_SQUARES[color]] == KING_ID | color << COLOR_SHIFT \
+         and self.squares[CASTLING_ROOK_SQUARES[index]] == ROOK_ID | color << COLOR_SHIFT:
+        self.castling |= castling_right
+    self.ep_square = ALGEBRAIC_SQUARES.get(fields[3], NO_SQUARE)
+    if self.ep_square != NO_SQUARE and not PAWN_ATTACKS[self.side ^ 1][self.ep_square] & self.bitboards[PAWN_ID | self.side << COLOR_SHIFT]:
+      self.ep_square = NO_SQUARE   # Only kept when a pawn can capture, as in make_move.
+
+    # Move counters (optional):
+    if len(fields) >= 6:
+      self.halfmove_clock = int(fields[4])
+      self.fullmove_number = int(fields[5])
+
+    self.hash = self.compute_hash()
+
+  def get_moves(self):
+    '''Method that returns an array of the 16-bit moves made since the position was set up (taken from the undo stack).'''
+    return array("H", (record & 0xFFFF for record in self.undo_stack))
+
+  def get_fen(self):
+    '''Method that returns the position as a FEN string.'''
+    placement = self.squares.tobytes().translate(CODES_TO_FEN).decode()
+    placement = "/".join(placement[row * TOTAL_COLS:(row + 1) * TOTAL_COLS] for row in range(TOTAL_ROWS))
+    for count in range(TOTAL_COLS, 0, -1):
+      placement = placement.replace(FEN_EMPTY * count, str(count))
+
+    castling = "".join(char for char, castling_right in zip("KQkq", (WHITE_KING_SIDE, WHITE_QUEEN_SIDE, BLACK_KING_SIDE, BLACK_QUEEN_SIDE))
+                       if self.castling & castling_right)
+    ep_square = ALGEBRAIC_NAMES[self.ep_square] if self.ep_square != NO_SQUARE else "-"
+
+    return f"{placement} {WHITE if self.side == WHITE_ID else BLACK} {castling or '-'} {ep_square} {self.halfmove_clock} {self.fullmove_number}"
+
+  def put_piece(self, square, code):
+    '''Method that places a piece (received as its mailbox code) on an empty square.'''
+    bit = 1 << square
+    self.squares[square] = code
+    self.bitboards[code] |= bit
+    self.colors[code >> COLOR_SHIFT] |= bit
+    self.occupied |= bit
+    self.hash ^= ZOBRIST_PIECES[code << 6 | square]
+    self.middlegame_score += MIDDLEGAME_SCORES[code << 6 | square]
+    self.endgame_score += ENDGAME_SCORES[code << 6 | square]
+    self.phase += PHASE_WEIGHTS[code & PIECE_MASK]
+
+  def remove_piece(self, square):
+    '''Method that removes the piece on a square and returns its mailbox code.'''
+    code = self.squares[square]
+    bit = 1 << square
+    self.squares[square] = EMPTY
+    self.bitboards[code] &= ~bit
+    self.colors[code >> COLOR_SHIFT] &= ~bit
+    self.occupied &= ~bit
+    self.hash ^= ZOBRIST_PIECES[code << 6 | square]
+    self.middlegame_score -= MIDDLEGAME_SCORES[code << 6 | square]
+    self.endgame_score -= ENDGAME_SCORES[code << 6 | square]
+    self.phase -= PHASE_WEIGHTS[code & PIECE_MASK]
+
+    return code
+
+  def make_move(self, move):
+    '''Method that plays a legal 16-bit move on the position (captures, castling, en passant and promotions included) and passes the turn.
+    Everything that can't be recomputed from the move is pushed on the undo stack as one 64-bit record, so unmake_move can restore the position.'''
+    square_source = move & 63
+    square_destination = move >> 6 & 63
+    flags = move >> 12
+    side = self.side
+    self.hash_history.append(self.hash)
+
+    # Captured piece (the en passant pawn is behind the destination square):
+    captured = EMPTY
+    if flags == EP_CAPTURE:
+      captured = self.remove_piece(square_destination - PAWN_FORWARD[side])
+    elif flags & CAPTURE:
+      captured = self.remove_piece(square_destination)
+
+    # Undo record: move (16 bits), captured code (4 bits), castling rights (4 bits), en passant square + 1 (7 bits) and halfmove clock:
+    self.undo_stack.append(move | captured << 16 | self.castling << 20 | (self.ep_square + 1) << 24 | self.halfmove_clock << 31)
+    old_castling = self.castling
+    old_ep_square = self.ep_square
+
+    # Moving (and maybe promoting) the piece:
+    code = self.remove_piece(square_source)
+    pawn_moved = code & PIECE_MASK == PAWN_ID
+    if flags & PROMOTION:
+      code = (KNIGHT_ID + (flags & 3)) | side << COLOR_SHIFT
+    self.put_piece(square_destination, code)
+
+    # Castling also moves the rook:
+    if flags == KING_CASTLE:
+      self.put_piece(square_destination - 1, self.remove_piece(square_destination + 1))
+    elif flags == QUEEN_CASTLE:
+      self.put_piece(square_destination + 1, self.remove_piece(square_destination - 2))
+
+    # Update castling rights, en passant square, move counters and turn:
+    self.castling &= CASTLING_MASKS[square_source] & CASTLING_MASKS[square_destination]
+    self.ep_square = NO_SQUARE
+    if flags == DOUBLE_PAWN_PUSH:
+      # Only kept when a pawn can capture, so the key doesn't change for an en passant that is impossible:
+      ep_square = (square_source + square_destination) >> 1
+      if PAWN_ATTACKS[side][ep_square] & self.bitboards[PAWN_ID | (side ^ 1) << COLOR_SHIFT]:
+        self.ep_square = ep_square
+    self.hash ^= ZOBRIST_CASTLING[old_castling] ^ ZOBRIST_CASTLING[self.castling] ^ \
+                 ZOBRIST_EP[old_ep_square + 1] ^ ZOBRIST_EP[self.ep_square + 1] ^ ZOBRIST_SIDE
+    if captured or pawn_moved:
+      self.halfmove_clock = 0
+    else:
+      self.halfmove_clock += 1
+    if side == BLACK_ID:
+      self.fullmove_number += 1
+    self.side = side ^ 1
+
+  def unmake_move(self):
+    '''Method that takes back the last move played with make_move, restoring the position from the record on top of the undo stack.
+    Returns the 16-bit move taken back.'''
+    record = self.undo_stack.pop()
+    move = record & 0xFFFF
+    square_source = move & 63
+    square_destination = move >> 6 & 63
+    flags = move >> 12
+    side = self.side ^ 1
+    self.side = side
+    if side == BLACK_ID:
+      self.fullmove_number -= 1
+
+    # Castling also moves the rook back:
+    if flags == KING_CASTLE:
+      self.put_piece(square_destination + 1, self.remove_piece(square_destination - 1))
+    elif flags == QUEEN_CASTLE:
+      self.put_piece(square_destination - 2, self.remove_piece(square_destination + 1))
+
+    # Moving (and maybe unpromoting) the piece back:
+    code = self.remove_piece(square_destination)
+    if flags & PROMOTION:
+      code = PAWN_ID | side << COLOR_SHIFT
+    self.put_piece(square_source, code)
+
+    # Restoring the captured piece:
+    captured = record >> 16 & 15
+    if flags == EP_CAPTURE:
+      self.put_piece(square_destination - PAWN_FORWARD[side], captured)
+    elif captured:
+      self.put_piece(square_destination, captured)
+
+    # Restoring castling rights, en passant square and halfmove clock:
+    self.castling = record >> 20 & 15
+    self.ep_square = (record >> 24 & 127) - 1
+    self.halfmove_clock = record >> 31
+    self.hash = self.hash_history.pop()
+
+    return move
+
+
 class ChessPlayers():
   '''The class that keeps record of all players relevant data.'''
+  __slots__ = ("history", "start_time", "turn", "player_1_name", "player_1_color", "player_2_name", "player_2_color")
+
   def __init__(self, name1="Player 1", color1=WHITES, name2="Player 2"):
-    self.history = []
+    self.history = array("H")     # 16-bit moves of the current game (source, destination and flags).
+    self.start_time = None
     self.turn = WHITES
 
     # Player 1:
@@ -72,26 +722,27 @@ class ChessPlayers():
 
 
 class ChessRules():
-  '''The class that contains the rules with all the legal moves and attacks of all the chess pieces...'''
-  def __init__(self):
-    self.squares = None
-    self.aux = Aux()
+  '''The class that contains the rules with all the legal moves and attacks of all the chess pieces...
+  It keeps no state (positions are received as arguments), so a single instance (RULES) is shared by all the boards.'''
+  __slots__ = ()
+
+  @property
+  def aux(self):
+    '''The shared helpers (AUX).'''
+    return AUX
 
-  def check_move(self, source, destination, squares):
-    '''Method that checks if the move of a piece is legal. It receives 3 arguments, one with the source,the other with its destination and the last with the board object.
+  def check_move(self, source, destination, position):
+    '''Method that checks if the move of a piece is legal. It receives 3 arguments, one with the source,the other with its destination and the last with the position object.
     Returns a boolean according to the case.'''
     can_move = None
-    self.squares = squares
 
     # Get rows and cols numbers from source and destination:
     row_source, col_source, row_destination, col_destination = self.aux.get_rows_and_cols_from(source, destination)
 
-    # Get source and destination pieces:
-    square_source = self.squares[row_source, col_source]
-
-    # Get piece and color from source square:
-    piece_source = PIECES_NAMES[square_source[0]]
-    color_source = square_source[1]
+    # Get piece and color from source square code:
+    code_source = position.squares[row_source * TOTAL_COLS + col_source]
+    piece_source = code_source & PIECE_MASK
+    color_source = code_source >> COLOR_SHIFT
 
     # Creating dict for passing to methods below:
     move_data_dict = {
@@ -99,47 +750,47 @@ class ChessRules():
       "col_source": col_source,
       "row_destination": row_destination,
       "col_destination": col_destination,
+      "square_source": row_source * TOTAL_COLS + col_source,
+      "square_destination": row_destination * TOTAL_COLS + col_destination,
       "piece_source": piece_source,
-      "color_source": color_source
+      "color_source": color_source,
+      "occupied": position.occupied,
+      "ep_square": position.ep_square
     }
 
+    # A king can never be captured (check detection never lets a position get there):
+    if position.squares[move_data_dict["square_destination"]] & PIECE_MASK == KING_ID:
+      return False
+
     # Call the appropiate method:
-    if piece_source == KING:
+    if piece_source == KING_ID:
       can_move = self._king_move(move_data_dict)
-    elif piece_source == QUEEN:
+    elif piece_source == QUEEN_ID:
       can_move = self._queen_move(move_data_dict)
-    elif piece_source == ROOK:
+    elif piece_source == ROOK_ID:
       can_move = self._rook_move(move_data_dict)
-    elif piece_source == BISHOP:
+    elif piece_source == BISHOP_ID:
       can_move = self._bishop_move(move_data_dict)
-    elif piece_source == KNIGHT:
+    elif piece_source == KNIGHT_ID:
       can_move = self._knight_move(move_data_dict)
-    elif piece_source == PAWN:
+    elif piece_source == PAWN_ID:
       can_move = self._pawn_move(move_data_dict)
     else:
       pass
 
     return can_move
 
-  def check_attack(self, source, destination, squares):
-    '''Method that checks if the attack of a piece is legal. It receives 3 arguments, the 1st with the source, the 2nd with its destination and the 3rd with the board object.
+  def check_attack(self, source, destination, position):
+    '''Method that checks if the attack of a piece is legal. It receives 3 arguments, the 1st with the source, the 2nd with its destination and the 3rd with the position object.
     Returns a boolean according to the case.'''
-    # print(f"### source:{source} | destination:{destination} ###")
     can_attack = True
-    self.squares = squares
 
     # Get rows and cols numbers from source and destination:
     row_source, col_source, row_destination, col_destination = self.aux.get_rows_and_cols_from(source, destination)
 
-    # Get source and destination pieces:
-    square_source = self.squares[row_source, col_source]
-    square_destination = self.squares[row_destination, col_destination]
-
-    # Get piece and color from source and destination squares:
-    piece_source = PIECES_NAMES[square_source[0]]
-    color_source = square_source[1]
-    piece_destination = PIECES_NAMES[square_destination[0]]
-    color_destination = square_destination[1]
+    # Get source and destination piece codes:
+    code_source = position.squares[row_source * TOTAL_COLS + col_source]
+    code_destination = position.squares[row_destination * TOTAL_COLS + col_destination]
 
     # Creating dict for passing to methods below:
     attack_data_dict = {
@@ -147,327 +798,588 @@ class ChessRules():
       "col_source": col_source,
       "row_destination": row_destination,
       "col_destination": col_destination,
-      "piece_source": piece_source,
-      "color_source": color_source,
-      "piece_destination": piece_destination,
-      "color_destination": color_destination
+      "square_source": row_source * TOTAL_COLS + col_source,
+      "square_destination": row_destination * TOTAL_COLS + col_destination,
+      "piece_source": code_source & PIECE_MASK,
+      "color_source": code_source >> COLOR_SHIFT,
+      "piece_destination": code_destination & PIECE_MASK,
+      "color_destination": code_destination >> COLOR_SHIFT,
+      "occupied": position.occupied
     }
 
+    # A piece can never attack another piece of its own color:
+    if attack_data_dict["color_source"] == attack_data_dict["color_destination"]:
+      return False
+
+    # Nor capture a king (check detection never lets a position get there):
+    if attack_data_dict["piece_destination"] == KING_ID:
+      return False
+
     # Call the appropiate method:
-    if piece_source == KING:
+    piece_source = attack_data_dict["piece_source"]
+    if piece_source == KING_ID:
       can_attack = self._king_attack(attack_data_dict)
-    elif piece_source == QUEEN:
+    elif piece_source == QUEEN_ID:
       can_attack = self._queen_attack(attack_data_dict)
-    elif piece_source == ROOK:
+    elif piece_source == ROOK_ID:
       can_attack = self._rook_attack(attack_data_dict)
-    elif piece_source == BISHOP:
+    elif piece_source == BISHOP_ID:
       can_attack = self._bishop_attack(attack_data_dict)
-    elif piece_source == KNIGHT:
+    elif piece_source == KNIGHT_ID:
       can_attack = self._knight_attack(attack_data_dict)
-    elif piece_source == PAWN:
+    elif piece_source == PAWN_ID:
       can_attack = self._pawn_attack(attack_data_dict)
     else:
       pass
 
     return can_attack
 
-  def check_any_pieces_between(self, row_source, col_source, row_destination, col_destination):
-    '''Method that checks if there is any pieces in a line (row, column, diagonal). It receives 4 int arguments and returns a boolean according to the case.'''
-    piece_found = None
-    array_move = None
-    squares = self.squares # Local copy required to avoid any array mutation.
+  def check_any_pieces_between(self, row_source, col_source, row_destination, col_destination, occupied):
+    '''Method that checks if there is any pieces in a line (row, column, diagonal). It receives 4 int arguments and the occupancy of the board (bitboard),
+    and returns a boolean according to the case.'''
+    square_source = row_source * TOTAL_COLS + col_source
+    square_destination = row_destination * TOTAL_COLS + col_destination
 
-    # ROW movement:
-    if row_source == row_destination:
-      # Get only the cols in which the piece moves in the row:
-      array_move = squares[row_source, col_source:col_destination]
+    return (BETWEEN[square_source][square_destination] & occupied) != 0
 
-    # COLUMN movement:
-    elif col_source == col_destination:
-      # Get only the rows in which the piece moves in the col:
-      array_move = squares[row_source:row_destination, col_source]
-
-    # DIAGONAL movement:
-    else:
-      # Check if "normal" numpy diagonal direction kind:
-      if row_destination > row_source and col_destination > col_source or \
-         row_destination < row_source and col_destination < col_source:
-        pass
+  def is_square_attacked(self, position, square, color, occupied):
+    '''Method that checks if a square is attacked by any piece of a color (received as color id), given the occupancy of the board.
+    Returns a boolean according to the case.'''
+    bitboards = position.bitboards
+    shift = color << COLOR_SHIFT
 
-      # If "inverted" numpy diagonal direction kind:
-      else:
-        # Invert and compensate row and cols values:
-        squares = numpy.rot90(squares)
-        old_col_source = col_source
-        old_col_destination = col_destination
-        col_source = row_source
-        col_destination = row_destination
-        row_source = (TOTAL_ROWS-1) - old_col_source
-        row_destination = (TOTAL_COLS-1) - old_col_destination
-
-      print(f"\n{squares}\n")
-      
-      # Get diagonal offset from squares source:
-      offset = col_source - row_source
-
-      # Create array based on source-destination relative locations:
-      col_offset = 0
-      if col_destination > col_source:
-
-        # Create column offset:
-        if row_destination > row_source:
-            if offset > 0:
-                col_offset = offset
-        else:
-            if offset < 0:
-                col_offset = offset
-        # print(f"offset: {offset} | col_offset: {col_offset}")
-        # Get only the rows in which the piece moves in the diagonal (including source and dest.):
-        array_move = squares.diagonal(offset)[col_source-col_offset:col_destination+1]
+    return bool(KNIGHT_ATTACKS[square] & bitboards[KNIGHT_ID | shift]
+                or PAWN_ATTACKS[color ^ 1][square] & bitboards[PAWN_ID | shift]
+                or KING_ATTACKS[square] & bitboards[KING_ID | shift]
+                or rook_attacks(square, occupied) & (bitboards[ROOK_ID | shift] | bitboards[QUEEN_ID | shift])
+                or bishop_attacks(square, occupied) & (bitboards[BISHOP_ID | shift] | bitboards[QUEEN_ID | shift]))
 
-      else:
-        # Create column offset:
-        if row_destination > row_source:
-            if offset > 0:
-                col_offset = offset
+  def is_insufficient_material(self, position):
+    '''Method that checks if no side can ever checkmate: kings with at most one knight or bishop, or with bishops all on squares of the same color.
+    Returns a boolean according to the case.'''
+    bitboards = position.bitboards
+    for piece in (PAWN_ID, ROOK_ID, QUEEN_ID):
+      if bitboards[piece] | bitboards[piece | BLACK_ID << COLOR_SHIFT]:
+        return False
+
+    knights = bitboards[KNIGHT_ID] | bitboards[KNIGHT_ID | BLACK_ID << COLOR_SHIFT]
+    bishops = bitboards[BISHOP_ID] | bitboards[BISHOP_ID | BLACK_ID << COLOR_SHIFT]
+    minors = knights | bishops
+
+    return not minors & (minors - 1) or not knights and (not bishops & LIGHT_SQUARES or not bishops & ~LIGHT_SQUARES)
+
+  def generate_legal_moves(self, position):
+    '''Method that returns a list with all the legal 16-bit moves of the side to move in a position (castling, en passant, promotions, pins and check evasions included).'''
+    moves = []
+    append = moves.append
+    us = position.side
+    them = us ^ 1
+    bitboards = position.bitboards
+    occupied = position.occupied
+    our_pieces = position.colors[us]
+    their_pieces = position.colors[them]
+    our_shift = us << COLOR_SHIFT
+    their_shift = them << COLOR_SHIFT
+    their_rooks = bitboards[ROOK_ID | their_shift] | bitboards[QUEEN_ID | their_shift]
+    their_bishops = bitboards[BISHOP_ID | their_shift] | bitboards[QUEEN_ID | their_shift]
+    is_square_attacked = self.is_square_attacked
+    if not bitboards[KING_ID | our_shift]:
+      return moves   # Only a broken position has no king (set_fen and the legal moves never leave one without it).
+    king_square = bitboards[KING_ID | our_shift].bit_length() - 1
+
+    # 1) Pieces giving check to our king:
+    checkers = KNIGHT_ATTACKS[king_square] & bitboards[KNIGHT_ID | their_shift] \
+               | PAWN_ATTACKS[us][king_square] & bitboards[PAWN_ID | their_shift] \
+               | rook_attacks(king_square, occupied) & their_rooks \
+               | bishop_attacks(king_square, occupied) & their_bishops
+
+    # 2) King moves (the king is removed from the occupancy so it can't hide behind itself from a slider):
+    occupied_without_king = occupied ^ (1 << king_square)
+    targets = KING_ATTACKS[king_square] & ~our_pieces
+    while targets:
+      bit = targets & -targets
+      targets ^= bit
+      square_destination = bit.bit_length() - 1
+      if not is_square_attacked(position, square_destination, them, occupied_without_king):
+        append(king_square | square_destination << 6 | (CAPTURE << 12 if bit & their_pieces else 0))
+
+    # With a double check, only the king can move:
+    if checkers & (checkers - 1):
+      return moves
+
+    # 3) Squares where the other pieces must move (capture the checker or block the check):
+    if checkers:
+      check_mask = checkers | BETWEEN[king_square][checkers.bit_length() - 1]
+    else:
+      check_mask = FULL_BOARD
+      self._generate_castling_moves(position, king_square, them, append)
+
+    # 4) Pinned pieces and the rays where they can still move:
+    pinned = 0
+    pin_rays = {}
+    snipers = rook_attacks(king_square, their_pieces) & their_rooks | bishop_attacks(king_square, their_pieces) & their_bishops
+    while snipers:
+      bit = snipers & -snipers
+      snipers ^= bit
+      blockers = BETWEEN[king_square][bit.bit_length() - 1] & occupied
+      if blockers and not blockers & (blockers - 1) and blockers & our_pieces:
+        pinned |= blockers
+        pin_rays[blockers.bit_length() - 1] = BETWEEN[king_square][bit.bit_length() - 1] | bit
+
+    # 5) Knights, bishops, rooks and queens:
+    allowed = ~our_pieces & check_mask
+    for piece in (KNIGHT_ID, BISHOP_ID, ROOK_ID, QUEEN_ID):
+      pieces = bitboards[piece | our_shift]
+      while pieces:
+        bit = pieces & -pieces
+        pieces ^= bit
+        square_source = bit.bit_length() - 1
+        if piece == KNIGHT_ID:
+          if bit & pinned:
+            continue
+          targets = KNIGHT_ATTACKS[square_source] & allowed
+        elif piece == BISHOP_ID:
+          targets = bishop_attacks(square_source, occupied) & allowed
+        elif piece == ROOK_ID:
+          targets = rook_attacks(square_source, occupied) & allowed
         else:
-            if offset < 0:
-                col_offset = offset
-
-        # Get only the rows in which the piece moves in the diagonal (including source and dest.):
-        array_move = squares.diagonal(offset)[col_destination-col_offset:col_source+1]
-
-    array_move = array_move.tolist()
-    # print(array_move)
-    results = [x for x in array_move if x != '']
-    # print(f"{results}\n")
-    if len(results) > 1: # More than 2 because source piece is included in results.
-      piece_found = True
+          targets = (rook_attacks(square_source, occupied) | bishop_attacks(square_source, occupied)) & allowed
+        if bit & pinned:
+          targets &= pin_rays[square_source]
+
+        while targets:
+          target_bit = targets & -targets
+          targets ^= target_bit
+          append(square_source | (target_bit.bit_length() - 1) << 6 | (CAPTURE << 12 if target_bit & their_pieces else 0))
+
+    # 6) Pawns:
+    self._generate_pawn_moves(position, king_square, check_mask, checkers, pinned, pin_rays, append)
+
+    return moves
+
+  def _generate_castling_moves(self, position, king_square, them, append):
+    '''Method that appends the castling moves of the side to move (not in check), verifying that the king and the rook are on their home squares,
+    that the squares between them are empty and that the king doesn't cross attacked squares.'''
+    us = position.side
+    if king_square != KING_HOME_SQUARES[us]:
+      return
+    if us == WHITE_ID:
+      king_side, queen_side = position.castling & WHITE_KING_SIDE, position.castling & WHITE_QUEEN_SIDE
     else:
-      piece_found = False
-
-    return piece_found
+      king_side, queen_side = position.castling & BLACK_KING_SIDE, position.castling & BLACK_QUEEN_SIDE
+    occupied = position.occupied
+    rooks = position.bitboards[ROOK_ID | us << COLOR_SHIFT]
+
+    if king_side and rooks >> (king_square + 3) & 1 and not occupied & (3 << (king_square + 1)) \
+       and not self.is_square_attacked(position, king_square + 1, them, occupied) \
+       and not self.is_square_attacked(position, king_square + 2, them, occupied):
+      append(king_square | (king_square + 2) << 6 | KING_CASTLE << 12)
+
+    if queen_side and rooks >> (king_square - 4) & 1 and not occupied & (7 << (king_square - 3)) \
+       and not self.is_square_attacked(position, king_square - 1, them, occupied) \
+       and not self.is_square_attacked(position, king_square - 2, them, occupied):
+      append(king_square | (king_square - 2) << 6 | QUEEN_CASTLE << 12)
+
+  def _generate_pawn_moves(self, position, king_square, check_mask, checkers, pinned, pin_rays, append):
+    '''Method that appends the legal pawn moves of the side to move (pushes, captures, en passant and promotions).'''
+    us = position.side
+    them = us ^ 1
+    bitboards = position.bitboards
+    occupied = position.occupied
+    their_pieces = position.colors[them]
+    forward = PAWN_FORWARD[us]
+    start_row = PAWN_START_ROWS[us]
+    promotion_row = PROMOTION_ROWS[us]
+    ep_square = position.ep_square
+    pawn_attacks = PAWN_ATTACKS[us]
+
+    pawns = bitboards[PAWN_ID | us << COLOR_SHIFT]
+    while pawns:
+      bit = pawns & -pawns
+      pawns ^= bit
+      square_source = bit.bit_length() - 1
+      allowed = check_mask & pin_rays[square_source] if bit & pinned else check_mask
+      targets = 0
+
+      # Pushes (one square, or two from the starting row):
+      square_destination = square_source + forward
+      if not occupied >> square_destination & 1:
+        targets |= 1 << square_destination
+        if square_source >> 3 == start_row and not occupied >> (square_destination + forward) & 1 \
+           and allowed >> (square_destination + forward) & 1:
+          append(square_source | (square_destination + forward) << 6 | DOUBLE_PAWN_PUSH << 12)
+
+      # Captures:
+      targets = (targets | pawn_attacks[square_source] & their_pieces) & allowed
+      while targets:
+        target_bit = targets & -targets
+        targets ^= target_bit
+        square_destination = target_bit.bit_length() - 1
+        flags = CAPTURE if target_bit & their_pieces else QUIET_MOVE
+        if square_destination >> 3 == promotion_row:
+          for promotion in range(4):
+            append(square_source | square_destination << 6 | (PROMOTION | flags | promotion) << 12)
+        else:
+          append(square_source | square_destination << 6 | flags << 12)
+
+      # En passant (checked against a board without both pawns, so horizontal pins are also caught):
+      if ep_square != NO_SQUARE and pawn_attacks[square_source] >> ep_square & 1:
+        captured_square = ep_square - forward
+        if not checkers or checkers >> captured_square & 1 or check_mask >> ep_square & 1:
+          occupied_after = occupied ^ bit ^ (1 << ep_square) ^ (1 << captured_square)
+          their_shift = them << COLOR_SHIFT
+          if not rook_attacks(king_square, occupied_after) & (bitboards[ROOK_ID | their_shift] | bitboards[QUEEN_ID | their_shift]) \
+             and not bishop_attacks(king_square, occupied_after) & (bitboards[BISHOP_ID | their_shift] | bitboards[QUEEN_ID | their_shift]):
+            append(square_source | ep_square << 6 | EP_CAPTURE << 12)
 
   def _king_move(self, move_data_dict):
     '''Method that check if the current move is valid for the king. It receives 1 dict argument and returns a boolean according to the case.'''
-    valid_move = True
+    square_source = move_data_dict["square_source"]
+    square_destination = move_data_dict["square_destination"]
+
+    # One square in any direction, or two squares along the row from its initial square when castling:
+    valid_move = bool(KING_ATTACKS[square_source] >> square_destination & 1) or \
+                 (square_source == KING_HOME_SQUARES[move_data_dict["color_source"]] and abs(square_destination - square_source) == 2)
 
     return valid_move
 
   def _king_attack(self, attack_data_dict):
     '''Method that check if current attack is valid for the king. It receives 1 dict argument and returns a boolean according to the case.'''
-    valid_attack = True
+    valid_attack = bool(KING_ATTACKS[attack_data_dict["square_source"]] >> attack_data_dict["square_destination"] & 1)
 
     return valid_attack
 
   def _queen_move(self, move_data_dict):
     '''Method that check if the current move is valid for the queen. It receives 1 dict argument and returns a boolean according to the case.'''
-    valid_move = True
+    square_source = move_data_dict["square_source"]
+    attacks = rook_attacks(square_source, move_data_dict["occupied"]) | bishop_attacks(square_source, move_data_dict["occupied"])
+    valid_move = bool(attacks >> move_data_dict["square_destination"] & 1)
 
     return valid_move
 
   def _queen_attack(self, attack_data_dict):
     '''Method that check if current attack is valid for the queen. It receives 1 dict argument and returns a boolean according to the case.'''
-    valid_attack = True
+    valid_attack = self._queen_move(attack_data_dict)
 
     return valid_attack
 
   def _rook_move(self, move_data_dict):
     '''Method that check if the current move is valid for the rook. It receives 1 dict argument and returns a boolean according to the case.'''
-    valid_move = True
+    attacks = rook_attacks(move_data_dict["square_source"], move_data_dict["occupied"])
+    valid_move = bool(attacks >> move_data_dict["square_destination"] & 1)
 
     return valid_move
 
   def _rook_attack(self, attack_data_dict):
     '''Method that check if current attack is valid for the rook. It receives 1 dict argument and returns a boolean according to the case.'''
-    valid_attack = True
+    valid_attack = self._rook_move(attack_data_dict)
 
     return valid_attack
 
   def _bishop_move(self, move_data_dict):
     '''Method that check if the current move is valid for the bishop. It receives 1 dict argument and returns a boolean according to the case.'''
-    valid_move = True
+    attacks = bishop_attacks(move_data_dict["square_source"], move_data_dict["occupied"])
+    valid_move = bool(attacks >> move_data_dict["square_destination"] & 1)
 
     return valid_move
 
   def _bishop_attack(self, attack_data_dict):
     '''Method that check if current attack is valid for the bishop. It receives 1 dict argument and returns a boolean according to the case.'''
-    valid_attack = True
+    valid_attack = self._bishop_move(attack_data_dict)
 
     return valid_attack
 
   def _knight_move(self, move_data_dict):
     '''Method that check if the current move is valid for the knight. It receives 1 dict argument and returns a boolean according to the case.'''
-    valid_move = True
+    valid_move = bool(KNIGHT_ATTACKS[move_data_dict["square_source"]] >> move_data_dict["square_destination"] & 1)
 
     return valid_move
 
   def _knight_attack(self, attack_data_dict):
     '''Method that check if current attack is valid for the knight. It receives 1 dict argument and returns a boolean according to the case.'''
-    valid_attack = True
+    valid_attack = self._knight_move(attack_data_dict)
 
     return valid_attack
 
   def _pawn_move(self, move_data_dict):
     '''Method that check if the current move is valid for the pawn. It receives 1 dict argument and returns a boolean according to the case.'''
-    #print(f"### move_data_dict:{move_data_dict}")
     valid_move = None
+    square_source = move_data_dict["square_source"]
+    square_destination = move_data_dict["square_destination"]
+    forward = PAWN_FORWARD[move_data_dict["color_source"]]
 
-    # Since pawns can only move in the same column,
-    # check first if source and destination columns are the same:
-    if move_data_dict["col_source"] == move_data_dict["col_destination"]:
-
-      # Black pawns:
-      if move_data_dict["color_source"] == BLACK:
+    # Pawns can move 1 square forward (row-ascending for blacks, row-descending for whites):
+    if square_destination == square_source + forward:
+      valid_move = True
 
-        # If they are in 2nd row, they can move 1 or 2 squares row-ascending:
-        if move_data_dict["row_source"] == SECOND_ROW:
+    # If they are in their starting row, they can also move 2 squares if the square in between is empty:
+    elif square_destination == square_source + 2 * forward and \
+         move_data_dict["row_source"] == PAWN_START_ROWS[move_data_dict["color_source"]]:
+      valid_move = not self.check_any_pieces_between(move_data_dict["row_source"], move_data_dict["col_source"],
+                                                     move_data_dict["row_destination"], move_data_dict["col_destination"], move_data_dict["occupied"])
 
-          # The rows between source and destination are no more than 2 squares:
-          if move_data_dict["row_destination"] - move_data_dict["row_source"] <= 2:
-            valid_move = True
-          else:
-            valid_move = False
-
-        # If not in 2nd row, they can only move 1 square row-ascending:
-        else:
-          if move_data_dict["row_destination"] - move_data_dict["row_source"] == 1:
-            valid_move = True
-          else:
-            valid_move = False
-
-      # White pawns:
-      else:
-
-        # If they are in 7th row, they can move 1 or 2 squares row-descending:
-        if move_data_dict["row_source"] == SEVENTH_ROW:
+    # Capturing en passant (moving diagonally to the empty square just skipped by a pawn):
+    elif square_destination == move_data_dict["ep_square"]:
+      valid_move = bool(PAWN_ATTACKS[move_data_dict["color_source"]][square_source] >> square_destination & 1)
 
-          # The rows between source and destination are no more than 2 squares:
-          if move_data_dict["row_source"] - move_data_dict["row_destination"] <= 2:
-            valid_move = True
-          else:
-            valid_move = False
-
-        # If not in 7th row, they can only move 1 square row-descending:
-        else:
-          if move_data_dict["row_source"] - move_data_dict["row_destination"] == 1:
-            valid_move = True
-          else:
-            valid_move = False
-
-    # If pawns source and destination columns are not the same...
     else:
       valid_move = False
 
-    # print(f"### valid_move:{valid_move} ###")
     return valid_move
 
   def _pawn_attack(self, attack_data_dict):
     '''Method that check if current attack is valid for the pawn. It receives 1 dict argument and returns a boolean according to the case.'''
-    # print(f"### attack_data_dict:{attack_data_dict}")
-    valid_attack = None
-
-    # Black pawns can attack only 1 square forward diagonally row-ascending:
-    if attack_data_dict["color_source"] == BLACK:
-      if attack_data_dict["row_destination"] - attack_data_dict["row_source"] == 1 and \
-         abs(attack_data_dict["col_destination"] - attack_data_dict["col_source"]) == 1:
-        valid_attack = True
-      else:
-        valid_attack = False
-
-    # White pawns can attack only 1 square forward diagonally row-descending:
-    else:
-      if attack_data_dict["row_source"] - attack_data_dict["row_destination"] == 1 and \
-         abs(attack_data_dict["col_destination"] - attack_data_dict["col_source"]) == 1:
-        valid_attack = True
-      else:
-        valid_attack = False
+    # Pawns can attack only 1 square forward diagonally (row-ascending for blacks, row-descending for whites):
+    valid_attack = bool(PAWN_ATTACKS[attack_data_dict["color_source"]][attack_data_dict["square_source"]] >> attack_data_dict["square_destination"] & 1)
 
-    # print(f"### valid_attack:{valid_attack} ###")
     return valid_attack
 
 
+class ChessAttacks():
+  '''The class that keeps the attack maps of a position: the squares attacked by the piece on each square and by each side.
+  After a move only the moved pieces and the sliders whose rays crossed the changed squares are computed again (not the whole board).'''
+  __slots__ = ("piece_attacks", "attacks", "occupied", "hash", "plies")
+
+  def __init__(self):
+    self.piece_attacks = array("Q")   # Attacked squares (bitboard) by the piece on each square (0 if empty), filled on the first sync.
+    self.attacks = [0, 0]             # Attacked squares indexed by color id.
+    self.occupied = 0                 # Occupancy, hash and plies of the position of the maps.
+    self.hash = None
+    self.plies = 0
+
+  def sync(self, position):
+    '''Method that brings the maps up to date with a position: incrementally if only its last move is new, or from scratch otherwise.'''
+    plies = len(position.undo_stack)
+    if self.hash == position.hash and self.plies == plies:
+      return
+    if self.plies + 1 == plies and position.hash_history[-1] == self.hash:
+      self._update(position, position.undo_stack[-1] & 0xFFFF)
+    else:
+      self.compute(position)
+    self.hash = position.hash
+    self.plies = plies
+
+  def compute(self, position):
+    '''Method that computes the attacks of every piece of a position from scratch.'''
+    occupied = position.occupied
+    self.piece_attacks = array("Q", (self._get_piece_attacks(code, square, occupied) if code != EMPTY else 0 for square, code in enumerate(position.squares)))
+    self.occupied = occupied
+    self._join_attacks(position)
+
+  def is_in_check(self, position):
+    '''Method that checks if the king of the side to move is attacked. Returns a boolean according to the case.'''
+    self.sync(position)
+
+    return bool(self.attacks[position.side ^ 1] & position.bitboards[KING_ID | position.side << COLOR_SHIFT])
+
+  def _update(self, position, move):
+    '''Method that updates the maps after a move: the pieces on the squares it changed, and the sliders that reached any of those squares
+    (a square beyond the first changed one of a ray can't change what the slider attacks).'''
+    square_source = move & 63
+    square_destination = move >> 6 & 63
+    flags = move >> 12
+    changed = 1 << square_source | 1 << square_destination
+    if flags == EP_CAPTURE:
+      changed |= 1 << (square_destination - PAWN_FORWARD[position.side ^ 1])
+    elif flags == KING_CASTLE:
+      changed |= 1 << (square_destination + 1) | 1 << (square_destination - 1)
+    elif flags == QUEEN_CASTLE:
+      changed |= 1 << (square_destination - 2) | 1 << (square_destination + 1)
+
+    squares = position.squares
+    occupied = position.occupied
+    piece_attacks = self.piece_attacks
+    bitboards = position.bitboards
+    sliders = 0
+    for piece in (BISHOP_ID, ROOK_ID, QUEEN_ID):
+      sliders |= bitboards[piece] | bitboards[piece | BLACK_ID << COLOR_SHIFT]
+    sliders &= ~changed
+
+    # Pieces on the changed squares:
+    squares_changed = changed
+    while squares_changed:
+      bit = squares_changed & -squares_changed
+      squares_changed ^= bit
+      square = bit.bit_length() - 1
+      piece_attacks[square] = self._get_piece_attacks(squares[square], square, occupied) if squares[square] != EMPTY else 0
+
+    # Sliders whose rays reached a changed square:
+    while sliders:
+      bit = sliders & -sliders
+      sliders ^= bit
+      square = bit.bit_length() - 1
+      if piece_attacks[square] & changed:
+        piece_attacks[square] = self._get_piece_attacks(squares[square], square, occupied)
+
+    self.occupied = occupied
+    self._join_attacks(position)
+
+  def _join_attacks(self, position):
+    '''Method that joins the attacks of the pieces of each side.'''
+    piece_attacks = self.piece_attacks
+    for color in (WHITE_ID, BLACK_ID):
+      attacks = 0
+      pieces = position.colors[color]
+      while pieces:
+        bit = pieces & -pieces
+        pieces ^= bit
+        attacks |= piece_attacks[bit.bit_length() - 1]
+      self.attacks[color] = attacks
+
+  def _get_piece_attacks(self, code, square, occupied):
+    '''Method that returns the bitboard of squares attacked by a piece (received as its mailbox code) on a square, given the occupancy of the board.'''
+    piece = code & PIECE_MASK
+    if piece == PAWN_ID:
+      return PAWN_ATTACKS[code >> COLOR_SHIFT][square]
+    elif piece == KNIGHT_ID:
+      return KNIGHT_ATTACKS[square]
+    elif piece == BISHOP_ID:
+      return bishop_attacks(square, occupied)
+    elif piece == ROOK_ID:
+      return rook_attacks(square, occupied)
+    elif piece == QUEEN_ID:
+      return rook_attacks(square, occupied) | bishop_attacks(square, occupied)
+
+    return KING_ATTACKS[square]
+
+
 class ChessBoard():
-  '''The class that keeps track of all the pieces on a chessboard and enables their moves.'''
+  '''The class that keeps track of all the pieces on a chessboard and enables their moves.
+  It only keeps the state of the game (rules and helpers are shared by all the boards), so many boards can live in one process.'''
+  __slots__ = ("position", "moves", "attacks")
+
   def __init__(self):
-    # Filling 8x8 squares with empty strings:
-    self.squares = numpy.array([[""] * TOTAL_COLS] * TOTAL_ROWS, dtype='<U2')
+    # Empty position core (bitboards + mailbox):
+    self.position = ChessPosition()
     self.moves = 0
-    self.rules = ChessRules()
-    self.aux = Aux()
+    self.attacks = ChessAttacks()
+
+  @property
+  def rules(self):
+    '''The shared rules (RULES).'''
+    return RULES
+
+  @property
+  def aux(self):
+    '''The shared helpers (AUX).'''
+    return AUX
+
+  @classmethod
+  def from_fen(cls, fen):
+    '''Method that creates a board with the position of a FEN string (placement, side to move, castling rights, en passant square and move counters).
+    Raises ValueError if the string is not a valid FEN.'''
+    board = cls()
+    board.position.set_fen(fen)
+
+    return board
+
+  def to_fen(self):
+    '''Method that returns the position of the board as a FEN string.'''
+    return self.position.get_fen()
 
   def reset_chess(self):
-    '''Method that sets up the chess pieces with the initial chess positions to start a game.'''
-    # Blacks:
-    self.squares[0, 0] = PIECES_CODE[ROOK] + BLACK
-    self.squares[0, 1] = PIECES_CODE[KNIGHT] + BLACK
-    self.squares[0, 2] = PIECES_CODE[BISHOP] + BLACK
-    self.squares[0, 3] = PIECES_CODE[QUEEN] + BLACK
-    self.squares[0, 4] = PIECES_CODE[KING] + BLACK
-    self.squares[0, 5] = PIECES_CODE[BISHOP] + BLACK
-    self.squares[0, 6] = PIECES_CODE[KNIGHT] + BLACK
-    self.squares[0, 7] = PIECES_CODE[ROOK] + BLACK
-    self.squares[0, 7] = PIECES_CODE[ROOK] + BLACK
-    self.squares[1] = PIECES_CODE[PAWN] + BLACK     # 2nd row with black pawns.
-
-    # Whites:
-    self.squares[6] = PIECES_CODE[PAWN] + WHITE     # 6th row with white pawns.
-    self.squares[7, 0] = PIECES_CODE[ROOK] + WHITE
-    self.squares[7, 1] = PIECES_CODE[KNIGHT] + WHITE
-    self.squares[7, 2] = PIECES_CODE[BISHOP] + WHITE
-    self.squares[7, 3] = PIECES_CODE[QUEEN] + WHITE
-    self.squares[7, 4] = PIECES_CODE[KING] + WHITE
-    self.squares[7, 5] = PIECES_CODE[BISHOP] + WHITE
-    self.squares[7, 6] = PIECES_CODE[KNIGHT] + WHITE
-    self.squares[7, 7] = PIECES_CODE[ROOK] + WHITE
-
-  def move_piece(self, source, destination):
+    '''Method that sets up the chess pieces with the initial chess positions to start a game (whites start and both players can castle to both sides).'''
+    self.position.set_fen(START_FEN)
+
+  @property
+  def hash(self):
+    '''The 64-bit Zobrist key of the current position.'''
+    return self.position.hash
+
+  def is_threefold_repetition(self):
+    '''Method that checks if the current position has appeared 3 times in the game. Returns a boolean according to the case.'''
+    return self.position.is_threefold_repetition()
+
+  def is_in_check(self):
+    '''Method that checks if the king of the player in turn is in check (using the attack maps). Returns a boolean according to the case.'''
+    return self.attacks.is_in_check(self.position)
+
+  def get_status(self):
+    '''Method that returns the status of the game for the player in turn: CHECKMATE or STALEMATE (no legal moves), FIFTY_MOVE_RULE, INSUFFICIENT_MATERIAL,
+    CHECK or None if the game goes on without check.'''
+    if not self.position.bitboards[KING_ID | self.position.side << COLOR_SHIFT]:
+      return CHECKMATE   # A king that is gone can only be from a broken position, and it lost the game anyway.
+    in_check = self.is_in_check()
+    if not self.rules.generate_legal_moves(self.position):
+      return CHECKMATE if in_check else STALEMATE
+    if self.position.halfmove_clock >= FIFTY_MOVE_PLIES:
+      return FIFTY_MOVE_RULE
+    if self.rules.is_insufficient_material(self.position):
+      return INSUFFICIENT_MATERIAL
+
+    return CHECK if in_check else None
+
+  def get_status_message(self, status):
+    '''Method that returns the text of a game status (see get_status) for the player in turn, or an empty string if the status is None.'''
+    color = COLOR_NAMES[self.position.side]
+    if status == CHECK:
+      return f"The {color} King is in check!"
+    elif status == CHECKMATE:
+      return f"Checkmate! {COLOR_NAMES[self.position.side ^ 1].title()}s win."
+    elif status == STALEMATE:
+      return f"Stalemate: {color}s can't move, the game is a draw."
+    elif status == FIFTY_MOVE_RULE:
+      return "Fifty moves without captures or pawn moves: the game is a draw."
+    elif status == INSUFFICIENT_MATERIAL:
+      return "Insufficient material to checkmate: the game is a draw."
+
+    return ""
+
+  def move_piece(self, source, destination, promotion=None):
     '''Method that moves a piece from its source square to its destination square, according to the values passed as arguments.
+    An optional piece letter ('Q', 'R', 'B' or 'N') chooses the promotion of a pawn (queen by default).
     The method checks if the arguments are correct and then calls other methods to check if the move is valid and, if it is, call another method to change it.'''
     status = None
     message = None
 
     # Checking received arguments:
-    if source[0] not in ROWS and source[1] not in COLS:
+    if len(source) != 2 or source[0] not in ROWS or source[1] not in COLS:
       status = False
       message = "An invalid starting position was received as an argument."
 
-    elif destination[0] not in ROWS and destination[1] not in COLS:
+    elif len(destination) != 2 or destination[0] not in ROWS or destination[1] not in COLS:
       status = False
       message = "An invalid end position was received as an argument."
 
+    elif promotion is not None and promotion.upper() not in PROMOTION_IDS:
+      status = False
+      message = f"An invalid promotion piece was received as an argument: {promotion}."
+
     else:
       # If the move or attack is legal, do it:
-      status, message = self._check_if_move_is_legal(source, destination)
+      status, message, move = self._check_if_move_is_legal(source, destination, promotion)
       if status:
-        self._change_piece_position(source, destination)
+        self._change_piece_position(move)
         self.moves += 1
 
     return status, message
 
-  def _check_if_move_is_legal(self, source, destination):
-    '''Method that checks if the desired move of a piece is legal. It receives 2 arguments, one with the source of a piece and the other with its destination.
-    Calls other methods to check if the move or attack is legal. Returns tuple of data according to the case.'''
+  def _check_if_move_is_legal(self, source, destination, promotion=None):
+    '''Method that checks if the desired move of a piece is legal. It receives 2 arguments, one with the source of a piece and the other with its destination (and an optional promotion letter).
+    Calls other methods to check if the move or attack is legal. Returns tuple of data according to the case (with the 16-bit legal move, if any).'''
     status = None
     message = None
+    move = None
 
     # 1) Get rows and cols numbers from source and destination:
     row_source, col_source, row_destination, col_destination = self.aux.get_rows_and_cols_from(source, destination)
+    square_source = row_source * TOTAL_COLS + col_source
+    square_destination = row_destination * TOTAL_COLS + col_destination
 
-    # 2) Get source and destination pieces:
-    square_source = self.squares[row_source, col_source]
-    square_destination = self.squares[row_destination, col_destination]
+    # 2) Get source and destination piece codes:
+    code_source = self.position.squares[square_source]
+    code_destination = self.position.squares[square_destination]
 
     # 3) Get piece and color from source square:
-    piece_source = PIECES_NAMES[square_source[0]]
-    color_source = PIECES_COLORS[square_source[1]]
+    piece_source = PIECE_ID_NAMES[code_source & PIECE_MASK]
+    color_source = COLOR_NAMES[code_source >> COLOR_SHIFT]
 
-    # 4a) If there is piece in source square...
-    if len(square_source) > 0:
+    # 4a) If there is a piece of the player in turn in source square...
+    if code_source != EMPTY and code_source >> COLOR_SHIFT == self.position.side:
 
       # 5a) Checking if source piece can make a legal move to destination square:
-      if len(square_destination) == 0:
-        if self.rules.check_move(source, destination, self.squares):
+      if code_destination == EMPTY:
+        if self.rules.check_move(source, destination, self.position):
           status = True
           message = f"Moving {color_source} {piece_source} from {source} to {destination}."
         else:
@@ -477,10 +1389,13 @@ class ChessBoard():
       # 5b) Checking if source piece can make a legal attack to destination piece:
       else:
         # 6) Get piece and color from destination square:
-        piece_destination = PIECES_NAMES[square_destination[0]]
-        color_destination = PIECES_COLORS[square_destination[1]]
+        piece_destination = PIECE_ID_NAMES[code_destination & PIECE_MASK]
+        color_destination = COLOR_NAMES[code_destination >> COLOR_SHIFT]
 
-        if self.rules.check_attack(source, destination, self.squares):
+        if code_destination & PIECE_MASK == KING_ID:
+          status = False
+          message = f"The {color_destination} King can't be captured."
+        elif self.rules.check_attack(source, destination, self.position):
           status = True
           message = f"Attacking w/{color_source} {piece_source} from {source} " \
                       f"to {color_destination} {piece_destination} on {destination}."
@@ -488,27 +1403,361 @@ class ChessBoard():
           status = False
           message = "This attack is not legal for this piece."
 
-    # 4b) If there is no piece at source...
+      # 7) The move must also be in the list of legal moves of the position (pins, checks and castling rules):
+      if status:
+        move = self._find_legal_move(square_source, square_destination, promotion)
+        if move is None:
+          status = False
+          if code_source & PIECE_MASK == KING_ID and abs(col_destination - col_source) == 2:
+            message = "Castling is not allowed in this position."
+          else:
+            message = f"This move would leave the {color_source} King in check."
+        elif move >> 12 == KING_CASTLE or move >> 12 == QUEEN_CASTLE:
+          message = f"Castling {color_source} King from {source} to {destination}."
+        elif move >> 12 == EP_CAPTURE:
+          message = f"Attacking w/{color_source} {piece_source} from {source} en passant on {destination}."
+        elif move >> 12 & PROMOTION:
+          message += f" Promoting to {PIECE_ID_NAMES[KNIGHT_ID + (move >> 12 & 3)]}."
+
+    # 4b) If the piece at source is not from the player in turn...
+    elif code_source != EMPTY:
+      status = False
+      message = f"It's {COLOR_NAMES[self.position.side]}'s turn, the {color_source} {piece_source} in {source} can't move."
+
+    # 4c) If there is no piece at source...
     else:
       status = False
-      message = f"No piece was found in the square {square_source}."
+      message = f"No piece was found in the square {source}."
 
-    return status, message
+    return status, message, move
 
-  def _change_piece_position(self, source, destination):
-    '''Method that moves a chess piece from its current position. It receives 2 arguments, one with the source of a chess piece and the other with its destination.
-    This method only modifies the values of an array of arrays of the class.'''
-    # Get rows and cols numbers from source and destination:
-    row_source, col_source, row_destination, col_destination = self.aux.get_rows_and_cols_from(source, destination)
+  def _find_legal_move(self, square_source, square_destination, promotion=None):
+    '''Method that searches the 16-bit legal move going from a source square to a destination square (both ints).
+    Promotions default to a queen. Returns the move or None if there is no such legal move.'''
+    promotion_id = PROMOTION_IDS[promotion.upper()] if promotion else QUEEN_ID
+
+    for move in self.rules.generate_legal_moves(self.position):
+      if move & 63 == square_source and move >> 6 & 63 == square_destination:
+        if not move >> 12 & PROMOTION or KNIGHT_ID + (move >> 12 & 3) == promotion_id:
+          return move
+
+    return None
+
+  def _change_piece_position(self, move):
+    '''Method that moves a chess piece from its current position. It receives 1 argument with the 16-bit legal move to play.
+    This method only updates the bitboards and the mailbox of the position core (the attack maps are updated when the check or status is asked for).'''
+    self.position.make_move(move)
+
+
+class ChessPerft():
+  '''The class that counts the leaf nodes of the tree of legal moves (perft), to measure the speed of the move generator and check its correctness.'''
+  def __init__(self):
+    self.rules = RULES
+    self.aux = AUX
+
+  def perft(self, position, depth):
+    '''Method that returns the number of leaf nodes of the legal moves tree of a position at a depth (int).'''
+    if depth == 0:
+      return 1
+
+    moves = self.rules.generate_legal_moves(position)
+    if depth == 1:
+      return len(moves)
+
+    nodes = 0
+    for move in moves:
+      position.make_move(move)
+      nodes += self.perft(position, depth - 1)
+      position.unmake_move()
+
+    return nodes
+
+  def divide(self, position, depth):
+    '''Method that returns a list of (move, leaf nodes) tuples with the perft count below each legal move of a position.'''
+    results = []
 
-    # Get piece from source square:
-    piece = self.squares[row_source, col_source]
+    for move in self.rules.generate_legal_moves(position):
+      position.make_move(move)
+      results.append((move, self.perft(position, depth - 1)))
+      position.unmake_move()
 
-    # Putting the source piece in destination square:
-    self.squares[row_destination, col_destination] = piece
+    return results
 
-    # Remove piece in source square:
-    self.squares[row_source, col_source] = ""
+  def run_divide(self, depth, fen=None):
+    '''Method that prints the perft divide of a position (the initial one if no FEN string is received), with the total nodes and nodes/sec.
+    Returns the exit status for the command line.'''
+    board = ChessBoard.from_fen(fen or START_FEN)
+
+    start = time.perf_counter()
+    results = self.divide(board.position, depth)
+    elapsed = time.perf_counter() - start
+    nodes = sum(count for _, count in results)
+
+    for move, count in sorted(results, key=lambda result: self.aux.get_move_name(result[0])):
+      print(f"{self.aux.get_move_name(move)}: {count}")
+    print()
+    print(f"Moves: {len(results)}")
+    print(f"Nodes: {nodes}")
+    print(f"Time: {elapsed:.3f} s")
+    print(f"Nodes/sec: {nodes / elapsed if elapsed else 0:,.0f}")
+
+    return 0
+
+  def run_suite(self, max_depth=PERFT_SUITE_DEPTH):
+    '''Method that checks the perft counts of the reference positions (up to a max depth) against their published values and prints the results.
+    Returns the exit status for the command line (1 if any count is wrong).'''
+    failures = 0
+    total_nodes = 0
+    total_time = 0.0
+
+    for name, fen, expected_counts in PERFT_SUITE:
+      position = ChessPosition()
+      position.set_fen(fen)
+
+      for depth, expected in enumerate(expected_counts[:max_depth], 1):
+        start = time.perf_counter()
+        nodes = self.perft(position, depth)
+        elapsed = time.perf_counter() - start
+        total_nodes += nodes
+        total_time += elapsed
+
+        status = "ok" if nodes == expected else "FAILED"
+        if nodes != expected:
+          failures += 1
+        print(f"{name:<17} depth {depth}: {nodes:>10} / {expected:>10}  {status:<6}  {nodes / elapsed if elapsed else 0:>12,.0f} nodes/sec")
+
+    print()
+    print(f"Nodes: {total_nodes} in {total_time:.3f} s ({total_nodes / total_time if total_time else 0:,.0f} nodes/sec), {failures} failed.")
+
+    return 1 if failures else 0
+
+
+class ChessValidator():
+  '''The class that replays move files with no rendering or pauses, through the same legality checks of the game, to validate many games at full speed.'''
+  def __init__(self):
+    self.aux = AUX
+
+  def replay_file(self, file):
+    '''Generator that replays the moves of each game of a move file (read as a stream) on a new board, stopping each game at its first illegal move.
+    Yields a tuple per game with a dict of results (the moves applied, the first illegal move and its message, the final position as a FEN string or the error if the file cannot be read),
+    the board with the game played and the FEN string of its initial position.'''
+    result = None
+    board = None
+    start_fen = START_FEN
+    games = 0
+
+    try:
+      for data_move_array in self.aux.get_moves_from_file(file):
+        if result is None:
+          games += 1
+          result = {"file": file, "game": games, "moves": 0, "illegal_move": None, "message": None, "fen": None, "error": None}
+          board = ChessBoard()
+          board.reset_chess()
+          start_fen = START_FEN
+
+        if data_move_array is GAME_END:
+          result["fen"] = board.position.get_fen()
+          yield result, board, start_fen
+          result = None
+          continue
+
+        # The rest of a game is skipped after its first illegal move:
+        if result["illegal_move"]:
+          continue
+
+        # A game that does not start from the initial position sets it up before its first move (an invalid FEN ends that game only, like an illegal move):
+        if isinstance(data_move_array, dict) and "fen" in data_move_array and not result["moves"]:
+          try:
+            board.position.set_fen(str(data_move_array["fen"]))
+            start_fen = data_move_array["fen"]
+          except ValueError as error:
+            result["illegal_move"] = (1, data_move_array)
+            result["message"] = str(error)
+          continue
+
+        try:
+          if isinstance(data_move_array, str):
+            status, message = False, f"Illegal move: {data_move_array}."   # Moves that the readers could not understand are yielded as text.
+          elif not isinstance(data_move_array, (list, tuple)) or not 2 <= len(data_move_array) <= 3 or not all(isinstance(item, str) for item in data_move_array):
+            status, message = False, f"Malformed move: {json.dumps(data_move_array)} (expected [source, destination] and an optional promotion letter)."
+          else:
+            status, message = board.move_piece(*data_move_array)
+        except (TypeError, ValueError) as error:
+          status, message = False, f"Malformed move: {error}"
+        if status:
+          result["moves"] += 1
+        else:
+          result["illegal_move"] = (result["moves"] + 1, data_move_array)
+          result["message"] = message
+
+    except (OSError, ValueError) as error:
+      if result is None:
+        games += 1
+        result = {"file": file, "game": games, "moves": 0, "illegal_move": None, "message": None, "fen": None, "error": None}
+      result["error"] = str(error)
+      yield result, board, start_fen
+      return
+
+    if not games:
+      yield {"file": file, "game": 1, "moves": 0, "illegal_move": None, "message": None, "fen": None, "error": "The file does not contain any moves."}, None, start_fen
+
+  def validate_file(self, file):
+    '''Method that replays the games of a move file, stopping each game at its first illegal move. Returns a list with the dict of results of each game (see replay_file).'''
+    return [result for result, _, _ in self.replay_file(file)]
+
+  def validate_files(self, files):
+    '''Method that validates a list of move files and returns the list of the results of their games.'''
+    return [result for file in files for result in self.validate_file(file)]
+
+  def iterate_results(self, files, workers=1, chunk_size=VALIDATE_CHUNK_SIZE):
+    '''Generator that yields the result of each game of the files in order. With 1 worker each result is yielded as soon as its game is replayed,
+    so even a single huge file is never held whole. With more than 1 worker the files are sent in chunks to a process pool (collecting the results of each chunk),
+    keeping only a few chunks in flight so the memory stays bounded whatever the number of files.'''
+    if workers <= 1:
+      for file in files:
+        for result, _, _ in self.replay_file(file):
+          yield result
+      return
+
+    from concurrent.futures import ProcessPoolExecutor
+    files = iter(files)
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+      while True:
+        # Keep 2 chunks per worker in flight, so workers never wait for the results to be written:
+        while len(pending) < workers * 2:
+          chunk = list(islice(files, chunk_size))
+          if not chunk:
+            break
+          pending.append(executor.submit(_validate_files, chunk))
+        if not pending:
+          break
+        yield from pending.popleft().result()
+
+  def run(self, files, workers=1, report=None):
+    '''Method that validates a list of move files (in a pool of worker processes if more than 1), printing a summary per file and the total throughput in moves/sec.
+    Each result is also streamed to a report file (CSV if its name ends with ".csv", JSON lines otherwise), if any.
+    Returns the exit status for the command line (1 if any file is unreadable or any game has an illegal move).'''
+    total_files = 0
+    total_games = 0
+    failures = 0
+    total_moves = 0
+    report_file = open(report, "w", newline="") if report else None
+    writer = None
+    if report_file and report.lower().endswith(".csv"):
+      writer = csv.DictWriter(report_file, fieldnames=VALIDATE_REPORT_FIELDS)
+      writer.writeheader()
+
+    start = time.perf_counter()
+    try:
+      for result in self.iterate_results(files, workers):
+        game = f"{result['file']} #{result['game']}"
+        total_files += result["game"] == 1
+        total_games += 1
+        total_moves += result["moves"]
+
+        if result["error"]:
+          failures += 1
+          print(f"{game}: ERROR {result['error']}")
+        elif result["illegal_move"]:
+          failures += 1
+          number, data_move_array = result["illegal_move"]
+          print(f"{game}: {result['moves']} moves, ILLEGAL move {number} {data_move_array} ({result['message']}) {result['fen']}")
+        else:
+          print(f"{game}: {result['moves']} moves, ok {result['fen']}")
+
+        if writer:
+          number, data_move_array = result["illegal_move"] or (None, None)
+          writer.writerow({**result, "illegal_move": None if data_move_array is None else json.dumps(data_move_array), "illegal_move_number": number})
+        elif report_file:
+          report_file.write(json.dumps(result) + "\n")
+    finally:
+      if report_file:
+        report_file.close()
+    elapsed = time.perf_counter() - start
+
+    print()
+    print(f"Files: {total_files}, games: {total_games}, {failures} failed.")
+    print(f"Moves: {total_moves} in {elapsed:.3f} s ({total_moves / elapsed if elapsed else 0:,.0f} moves/sec)")
+
+    return 1 if failures else 0
+
+
+def _validate_files(files):
+  '''Function that validates a chunk of move files in a worker process of ChessValidator.'''
+  return ChessValidator().validate_files(files)
+
+
+class JsonStream():
+  '''The class that reads the values of JSON arrays from a file a few chars at a time, so big files are never loaded whole.'''
+  def __init__(self, open_file, chunk_size=READ_CHUNK_SIZE):
+    self.file = open_file
+    self.chunk_size = chunk_size
+    self.buffer = ""
+    self.index = 0
+    self.decoder = json.JSONDecoder()
+
+  def peek(self):
+    '''Method that returns the next char that is not blank without consuming it (an empty string at the end of the file).'''
+    while True:
+      while self.index < len(self.buffer) and self.buffer[self.index] in " \t\r\n":
+        self.index += 1
+      if self.index < len(self.buffer):
+        return self.buffer[self.index]
+      if not self._read():
+        return ""
+
+  def peek_next(self):
+    '''Method that returns the first char that is not blank after the next one, without consuming any.'''
+    self.peek()
+    index = self.index + 1
+    while True:
+      while index < len(self.buffer) and self.buffer[index] in " \t\r\n":
+        index += 1
+      if index < len(self.buffer):
+        return self.buffer[index]
+      index -= self.index
+      if not self._read():
+        return ""
+      index += self.index
+
+  def decode(self):
+    '''Method that decodes and returns the next JSON value, reading more of the file until it is complete.'''
+    self.peek()
+    while True:
+      try:
+        value, self.index = self.decoder.raw_decode(self.buffer, self.index)
+        return value
+      except json.JSONDecodeError:
+        if not self._read():
+          raise
+
+  def iterate_array(self):
+    '''Generator that consumes the JSON array that starts at the next char, yielding once before each of its items (which must be consumed by the caller).
+    Raises ValueError if there is no array or its items are not separated by commas.'''
+    if self.peek() != '[':
+      raise ValueError(f"Expected '[' to start a JSON array, found {self.peek()!r}.")
+    self.index += 1
+    if self.peek() == ']':
+      self.index += 1
+      return
+
+    while True:
+      yield
+      char = self.peek()
+      self.index += 1
+      if char == ']':
+        return
+      if char != ',':
+        raise ValueError(f"Expected ',' or ']' in JSON array, found {char!r}.")
+
+  def _read(self):
+    '''Method that drops the consumed chars of the buffer and appends the next chunk of the file. Returns False at the end of the file.'''
+    chunk = self.file.read(self.chunk_size)
+    self.buffer = self.buffer[self.index:] + chunk
+    self.index = 0
+
+    return bool(chunk)
 
 
 class Aux():
@@ -522,26 +1771,112 @@ class Aux():
 
     return row_source, col_source, row_destination, col_destination
 
+  def get_move_name(self, move):
+    '''Method that returns the standard coordinates name (like "e2e4" or "e7e8q") of a 16-bit move.'''
+    name = ALGEBRAIC_NAMES[move & 63] + ALGEBRAIC_NAMES[move >> 6 & 63]
+    if move >> 12 & PROMOTION:
+      name += PIECE_LETTERS[KNIGHT_ID + (move >> 12 & 3)].lower()
+
+    return name
+
+  def get_move_array(self, move):
+    '''Method that returns a 16-bit move as an array like the ones of the move files: source and destination (like ["7e", "5e"]), plus the promotion letter if any.'''
+    move_array = [SQUARE_NAMES[move & 63], SQUARE_NAMES[move >> 6 & 63]]
+    if move >> 12 & PROMOTION:
+      move_array.append(PIECE_LETTERS[KNIGHT_ID + (move >> 12 & 3)])
+
+    return move_array
+
+  def get_move_from_input(self, text):
+    '''Method that reads a move typed by the user like "7e 5e", "7e5e" or "2a 1a q" (source, destination and optional promotion letter).
+    Returns a tuple (source, destination, promotion) or None if the text is not a move.'''
+    text = text.replace(" ", "").replace("-", "")
+    if len(text) not in (4, 5):
+      return None
+
+    source, destination, promotion = text[:2], text[2:4], text[4:].upper() or None
+    if source[0] not in ROWS or source[1] not in COLS or destination[0] not in ROWS or destination[1] not in COLS:
+      return None
+    if promotion and promotion not in PROMOTION_IDS:
+      return None
+
+    return source, destination, promotion
+
   def clear_terminal_console(self):
-    '''Method that clears any text from the terminal console.'''
-    command = "clear"
-    if os.name in ("nt", "dos"):  # If OS is running Windows, uses 'cls' command.
-        command = "cls"
-    os.system(command)
-
-  def get_moves_from_json_file(self, file):
-    '''Method that reads file containing an array of valid chess moves. Receives a string argument containg the file.
-    Returns an array with the file content (if any).'''
-    results = None
-    
-    try:
-      with open(file, "r") as open_file:
-        results = json.load(open_file)
-    except Exception as error:
-      print(f"Error while reading {JSON_FILE}.")
-      print(f"Message: {error}")
-    finally:
-      return results
+    '''Method that clears any text from the terminal console (with escape codes, so no shell is run).'''
+    sys.stdout.write(ESCAPE_CLEAR_SCREEN)
+    sys.stdout.flush()
+
+  def get_moves_from_file(self, file):
+    '''Method that opens a file of chess moves and returns a generator that reads it lazily, yielding each move (an array like ["7e", "5e"]) and GAME_END after the last move of each game.
+    JSON files hold an array of moves (a single game) or an array of games. JSON lines files (".jsonl" or ".ndjson") hold a move or a whole game per line, and blank lines end games.
+    PGN files (".pgn") may hold many games: a game with a FEN tag starts with {"fen": <FEN string>}, and a move that is not legal is yielded as its SAN text (ending the game).
+    Binary game archives (".cga") are memory-mapped, and their games are read like the PGN ones.
+    Raises OSError if the file cannot be opened and ValueError if its content is not valid (the generator can raise it too).'''
+    if file.lower().endswith(ARCHIVE_EXTENSION):
+      from chess_formats import GameArchive
+      return GameArchive(file).iterate_moves()
+
+    open_file = open(file, "r")
+    if file.lower().endswith(JSON_LINES_EXTENSIONS):
+      return self._iterate_moves_from_json_lines(open_file)
+    if file.lower().endswith(PGN_EXTENSION):
+      from chess_formats import Pgn
+      return Pgn().iterate_moves(open_file)
+
+    return self._iterate_moves_from_json(open_file)
+
+  def _iterate_moves_from_json(self, open_file):
+    '''Generator that yields the moves (and game ends) of a JSON file, decoding one move at a time so the memory used does not depend on the file size.'''
+    with open_file:
+      stream = JsonStream(open_file)
+      games = 0
+      loose_moves = 0
+
+      for _ in stream.iterate_array():
+        # An array that starts with another array (or is empty) is a game, anything else is a move:
+        if stream.peek() == '[' and stream.peek_next() in "[]":
+          if loose_moves:
+            loose_moves = 0
+            yield GAME_END
+          for _ in stream.iterate_array():
+            yield stream.decode()
+          games += 1
+          yield GAME_END
+        else:
+          loose_moves += 1
+          yield stream.decode()
+
+      if loose_moves or not games:
+        yield GAME_END
+
+  def _iterate_moves_from_json_lines(self, open_file):
+    '''Generator that yields the moves (and game ends) of a JSON lines file, reading one line at a time.'''
+    with open_file:
+      loose_moves = 0
+
+      for line in open_file:
+        line = line.strip()
+        if not line:
+          if loose_moves:
+            loose_moves = 0
+            yield GAME_END
+          continue
+
+        value = json.loads(line)
+        if isinstance(value, list) and all(isinstance(item, list) for item in value):
+          # A whole game in a line ends the previous one too:
+          if loose_moves:
+            loose_moves = 0
+            yield GAME_END
+          yield from value
+          yield GAME_END
+        else:
+          loose_moves += 1
+          yield value
+
+      if loose_moves:
+        yield GAME_END
 
   def pause_and_wait_for_key(self, ui):
     '''Method that waits for a any key from user. Receives a ui object as argument for showing text in terminal console.'''
@@ -562,8 +1897,15 @@ class Aux():
       sys.exit(0)
 
 
+# Shared stateless helpers (one instance for all the boards and games of the process):
+AUX = Aux()
+RULES = ChessRules()
+
+
 class UI():
   '''A class uses as (informal) interface for any other UI type classes.'''
+  __slots__ = ()
+
   def show_pieces(self):
     '''This method shows player name/turn and all current pieces from a board.'''
     pass
@@ -571,12 +1913,94 @@ class UI():
 
 class TUI(UI):
   '''The Text User Interface class that shows the chessboard on screen via terminal console.'''
+  __slots__ = ("_console", "frame")
+
   def __init__(self):
-    self.console = Console(color_system="256")
+    self._console = None
+    self.frame = None   # Mailbox codes of the board on screen (None if the board must be drawn whole).
+
+  @property
+  def console(self):
+    '''The Rich console of the interface, created (importing Rich) the first time it is used.'''
+    if self._console is None:
+      from rich.console import Console
+      self._console = Console(color_system="256")
+
+    return self._console
+
+  def clear(self):
+    '''Method that clears the terminal console (with escape codes, so no shell is run). The next board is drawn whole.'''
+    self.frame = None
+    if self.console.is_terminal:
+      sys.stdout.write(ESCAPE_CLEAR_SCREEN)
+      sys.stdout.flush()
 
   def show_pieces(self, board, players, message=""):
+    '''Method that shows the status (player's turn, message, and check or result of the game) and the pieces of the board. On a terminal it keeps the
+    previous frame and, using cursor addressing, draws again only the squares that changed and the status (the text below the board is erased).
+    Otherwise (like when the output is redirected) the board is printed as a table.'''
+    result = board.get_status_message(board.get_status())
+    if not self.console.is_terminal:
+      self._show_table(board, players, message, result)
+      return
+
+    squares = board.position.squares.tobytes()
+    output = []
+
+    # The whole board the first time (col letters, 8 rows and row numbers), and then only the squares that changed:
+    if self.frame is None:
+      output.append(ESCAPE_CLEAR_SCREEN)
+      output.append(self._move_cursor(BOARD_TOP_LINE, BOARD_LEFT_COLUMN)
+                    + ESCAPE_STYLE_1 + "".join(f" {col} ".ljust(SQUARE_WIDTH) for col in COLS) + ESCAPE_RESET)
+      for row in range(TOTAL_ROWS):
+        output.append(self._move_cursor(BOARD_TOP_LINE + 1 + row, BOARD_LEFT_COLUMN + TOTAL_COLS * SQUARE_WIDTH)
+                      + ESCAPE_STYLE_1 + f" {ROWS[row]}" + ESCAPE_RESET)
+      changed = range(TOTAL_SQUARES)
+    else:
+      changed = [square for square in range(TOTAL_SQUARES) if squares[square] != self.frame[square]]
+
+    for square in changed:
+      row, col = divmod(square, TOTAL_COLS)
+      output.append(self._move_cursor(BOARD_TOP_LINE + 1 + row, BOARD_LEFT_COLUMN + col * SQUARE_WIDTH) + self._format_square(squares[square]))
+
+    # Status lines (styled according to the player's turn):
+    if board.moves > 0:
+      style = ESCAPE_STYLE_WHITE if players.turn == WHITES else ESCAPE_STYLE_BLACK
+      title = f"{style}{board.moves}) {players.turn.title()}'s move:{ESCAPE_RESET}"
+    else:
+      title = f"{ESCAPE_STYLE_1}¡Starting a new game!{ESCAPE_RESET}"
+    output.append(self._move_cursor(1, 1) + ESCAPE_ERASE_LINE + " " + title)
+    output.append(self._move_cursor(2, 1) + ESCAPE_ERASE_LINE + " " + message)
+    output.append(self._move_cursor(3, 1) + ESCAPE_ERASE_LINE + (f" {ESCAPE_STYLE_1}{result}{ESCAPE_RESET}" if result else ""))
+
+    # Leave the cursor below the board, erasing the text of the previous move:
+    output.append(self._move_cursor(BOARD_TOP_LINE + TOTAL_ROWS + 2, 1) + ESCAPE_ERASE_DOWN)
+
+    sys.stdout.write("".join(output))
+    sys.stdout.flush()
+    self.frame = squares
+
+  def _move_cursor(self, line, column):
+    '''Method that returns the escape code that moves the cursor to a line and column of the screen (starting at 1).'''
+    return f"\x1b[{line};{column}H"
+
+  def _format_square(self, code):
+    '''Method that returns the text (with escape codes) of a square according to its piece (if any) for the differential renderer.'''
+    if code == EMPTY:
+      return ESCAPE_EMPTY_SQUARE + " · " + ESCAPE_RESET
+    piece = PIECE_LETTERS[code & PIECE_MASK]
+    if code >> COLOR_SHIFT == WHITE_ID:
+      return f"{ESCAPE_WHITE_PIECE}[{piece}]{ESCAPE_RESET}"
+
+    return f"{ESCAPE_BLACK_PIECE}[{piece}]{ESCAPE_RESET}"
+
+  def _show_table(self, board, players, message="", result=""):
     '''Method that creates a table (using Rich library) according to the position of the pieces on the board (from internal array of the class).
-    And then the content of this table is printed on the terminal.'''
+    And then the content of this table is printed on the terminal (with the check or result of the game, if any, below the title).'''
+    from rich import box
+    from rich.padding import Padding
+    from rich.table import Table
+
     # Create and style the title of the table according to the player's turn:
     table_title = ""
     if board.moves > 0:
@@ -586,6 +2010,8 @@ class TUI(UI):
         table_title = f" [{STYLE_BLACK}]{board.moves}) {players.turn.title()}'s move:[/{STYLE_BLACK}]\n {message}"
     else:
       table_title = f" [{STYLE_1}]¡Starting a new game![/{STYLE_1}]"
+    if result:
+      table_title += f"\n [{STYLE_1}]{result}[/{STYLE_1}]"
 
     # Creating table:
     table = Table(title=table_title,
@@ -606,10 +2032,11 @@ class TUI(UI):
     table.add_column(f"[{STYLE_1}]h[/{STYLE_1}]", justify="center", style="black", no_wrap=True)
     table.add_column(" ", justify="center", style=STYLE_1, no_wrap=True)
 
-    # Set the 8 rows with the current pieces:
-    for row_number, row_board in enumerate(board.squares, 1):
+    # Set the 8 rows with the current pieces (read from the position mailbox):
+    squares = board.position.squares
+    for row_number in range(1, TOTAL_ROWS+1):
       # Each square that has a piece is colored and then is saved in array:
-      row_board = self._format_square_according_to_color_piece(row_board)
+      row_board = self._format_square_according_to_color_piece(squares[(row_number-1) * TOTAL_COLS:row_number * TOTAL_COLS])
 
       # Adding a last column of board numbers to each row in array:
       row_board.append(f" {str(ROWS[row_number-1])} ")
@@ -625,12 +2052,11 @@ class TUI(UI):
     '''Method that receives an array as argument and returns it modified based on its content.'''
     new_row = []
 
-    for square in row:
+    for code in row:
       # If the square contains a piece and its color, style it as such and discard the rest:
-      if len(square) > 0:
-        piece = square[0]
-        color = square[1]
-        if color == WHITE:
+      if code != EMPTY:
+        piece = PIECE_LETTERS[code & PIECE_MASK]
+        if code >> COLOR_SHIFT == WHITE_ID:
           new_row.append(f"[black on white][{piece}][/black on white]")
         else:
           new_row.append(f"[white on black][{piece}][/white on black]")
@@ -649,6 +2075,7 @@ class TUI(UI):
                            justify=justify,
                            width=width)
       else:
+        from rich.panel import Panel
         self.console.print(Panel(f" {text} "),
                            style=style,
                            justify=justify,
@@ -661,15 +2088,21 @@ class TUI(UI):
 
 
 class ChessGame():
-  '''The class that uses all the others classes to run the game.'''
-  def __init__(self):
+  '''The class that uses all the others classes to run the game (the state is in its board and players, and the interface is kept apart in its ui).'''
+  __slots__ = ("board", "players", "ui", "aux", "book", "tablebase")
+
+  def __init__(self, book=None, tablebase=None):
     self.board = ChessBoard()
     self.players = ChessPlayers()
     self.ui = TUI()
-    self.aux = Aux()
+    self.aux = AUX
+    self.book = book              # Opening book file used by the computer (optional).
+    self.tablebase = tablebase    # Endgame tablebase directory used by the computer (optional).
 
   def show_menu(self):
     '''Method that shows in terminal a inital menu with all actions in the game.'''
+    from rich.padding import Padding
+    from rich.panel import Panel
     selected_option = None
 
     menu = Padding(Panel('''
@@ -683,9 +2116,11 @@ Please select an option:
 
 [b]1)[/b] Start new game
 
-[b]2)[/b] Load saved game from file
+[b]2)[/b] Play vs computer
 
-[b]3)[/b] Exit
+[b]3)[/b] Load saved game from file
+
+[b]4)[/b] Exit
 
     ''', width=TABLE_WIDTH))
     # Clear screen and show menu:
@@ -698,8 +2133,10 @@ Please select an option:
     if selected_option == OPTION_ONE:
       self.start_new_game()
     elif selected_option == OPTION_TWO:
-      self.play_from_file(file=JSON_FILE)
+      self.play_vs_computer()
     elif selected_option == OPTION_THREE:
+      self.play_from_file(file=JSON_FILE)
+    elif selected_option == OPTION_FOUR:
       self.ui.console.print("\nGoodbye! 👋\n")
       sys.exit(0)
     else:
@@ -707,15 +2144,18 @@ Please select an option:
 
   def start_new_game(self):
     '''A method that starts a chess game by resetting the pieces on the board to their initial positions, taking the initial time and finally displaying the board on the terminal.'''
-    self.aux.clear_terminal_console()
+    self.ui.clear()
     self.board.reset_chess()
-    self.players.history.append(["Start", "--------------", time.ctime()])
+    self.board.moves = 0
+    self.players.turn = WHITES
+    self.players.history = array("H")
+    self.players.start_time = time.ctime()
     self.ui.show_pieces(self.board, self.players)
     self.aux.pause_and_wait_for_key(self.ui)
 
-  def move(self, source, destination):
-    '''Method that moves a chess part from its source to its destination, both received by argument.
-    This method calls another method from ChessBoard class to complete the task.'''
+  def move(self, source, destination, promotion=None, pause=True):
+    '''Method that moves a chess part from its source to its destination, both received by argument (and an optional promotion letter).
+    This method calls another method from ChessBoard class to complete the task. Returns a boolean with the status of the move.'''
     # Checking source and destination values:
     if len(source) == 0 or len(source) > 2:
       message=f"Invalid source value: {source}."
@@ -726,34 +2166,79 @@ Please select an option:
       self.ui._show_text(text=message, text_type=ERROR_TYPE)
 
     # Move piece to destination:
-    status, message = self.board.move_piece(source, destination)
+    status, message = self.board.move_piece(source, destination, promotion)
 
     # If the piece was moved successfully, show move on terminal and end turn:
     if status:
-      self.aux.clear_terminal_console()
       self.ui.show_pieces(self.board, self.players, message)
-      self._save_last_move(source, destination)
-      self._finish_turn()
+      if self.board.is_threefold_repetition():
+        self.ui._show_text(text="Threefold repetition: a draw can be claimed.", text_type=NORMAL_TYPE)
+      self._save_last_move(self.board.position.undo_stack[-1] & 0xFFFF)
+      self._finish_turn(pause)
 
     # Otherwise, show error:
     else:
       self.ui._show_text(text=message, text_type=ERROR_TYPE)
 
+    return status
+
+  def play_vs_computer(self, time_limit=None):
+    '''Method that plays a game of the user (with whites) against the engine. Moves are read from the terminal as "7e 5e" (source and destination, and an optional promotion letter).'''
+    from chess_engine import ChessEngine, OpeningBook, DEFAULT_TIME_LIMIT
+    tablebase = None
+    if self.tablebase:
+      from chess_tablebase import Tablebase
+      tablebase = Tablebase(self.tablebase)
+    engine = ChessEngine(time_limit=time_limit or DEFAULT_TIME_LIMIT, book=OpeningBook(self.book) if self.book else None, tablebase=tablebase)
+    computer_side = BLACK_ID
+
+    self.start_new_game()
+    while self.board.get_status() not in GAME_OVER_STATUSES:
+      # Engine's turn:
+      if self.board.position.side == computer_side:
+        self.ui._show_text(text="Thinking... 🤔", text_type=NORMAL_TYPE)
+        move = engine.search(self.board.position)
+        self.move(*self.aux.get_move_array(move), pause=False)
+        self.ui._show_text(text=engine.get_info(), text_type=NORMAL_TYPE, justify="left")
+
+      # User's turn:
+      else:
+        try:
+          text = input("> ").strip()
+        except (KeyboardInterrupt, EOFError):
+          text = QUIT_COMMANDS[0]
+        if text.lower() in QUIT_COMMANDS:
+          return
+        user_move = self.aux.get_move_from_input(text)
+        if user_move:
+          if self.move(*user_move, pause=False) and tablebase:
+            self._show_tablebase_result(tablebase)
+        else:
+          self.ui._show_text(text=f"Invalid move: '{text}' (example: 7e 5e).", text_type=ERROR_TYPE)
+
+    self.ui._show_text(text="Game over.", text_type=NORMAL_TYPE)
+    self.aux.pause_and_wait_for_key(self.ui)
+
   def play_from_file(self, file):
-    '''Method that plays a chess game with moves fetched from a JSON file.'''
+    '''Method that plays the chess games of a file of moves (JSON or JSON lines), reading the moves as they are played.'''
     # Clear terminal console and show initial message:
-    self.aux.clear_terminal_console()
+    self.ui.clear()
     message = f"Reading chess moves from file '{file}... 💾"
     self.ui._show_text(text=message, justify="left", panel=True)
 
-    # Get moves from JSON file:
-    chess_moves = game.aux.get_moves_from_json_file(file)
+    # Open the file of moves (they are read as the game goes on):
+    try:
+      chess_moves = self.aux.get_moves_from_file(file)
+    except (OSError, ValueError) as error:
+      chess_moves = None
+      print(f"Error while reading {file}.")
+      print(f"Message: {error}")
 
     # If successful...
-    if chess_moves:
+    if chess_moves is not None:
       # Show message:
       print()
-      message = "JSON file ok and list of chess moves fetched. ✅"
+      message = "File ok, its chess moves are played as they are read. ✅"
       self.ui._show_text(message, justify="left", panel=True)
 
       # Wait for ENTER key from user:
@@ -763,59 +2248,236 @@ Please select an option:
       # Start new game:
       self.start_new_game()
 
-      # And play the moves:
-      for data_move_array in chess_moves:
-        game.move(*data_move_array)
+      # And play the moves, starting a new game after the end of each one (if more moves follow):
+      new_game = False
+      try:
+        for data_move_array in chess_moves:
+          if data_move_array is GAME_END:
+            new_game = True
+            continue
+          if new_game:
+            self.start_new_game()
+            new_game = False
+          if isinstance(data_move_array, dict) and "fen" in data_move_array:
+            self.board.position.set_fen(data_move_array["fen"])
+            self.players.turn = WHITES if self.board.position.side == WHITE_ID else BLACKS
+            self.ui.show_pieces(self.board, self.players)
+          elif isinstance(data_move_array, str):
+            self.ui._show_text(text=f"Illegal move: {data_move_array}.", text_type=ERROR_TYPE)
+          else:
+            self.move(*data_move_array)
+      except ValueError as error:
+        message = f"Invalid file of moves, aborting: {error}"
+        self.ui._show_text(text=message, text_type=ERROR_TYPE)
 
     # If unsuccessful, show error message on terminal console:
     else:
-      message = f"Cant open JSON file and play moves, aborting."
+      message = f"Cant open file and play moves, aborting."
       self.ui._show_text(text=message, text_type=ERROR_TYPE)
 
-  def _finish_turn(self):
+  def _finish_turn(self, pause=True):
     '''Simple method that assigns new turn for the other player in internal string.'''
-    # Change player turn and wait a few seconds:
+    # Change player turn and wait for a key (if required):
     if self.players.turn == WHITES:
       self.players.turn = BLACKS
     else:
       self.players.turn = WHITES
 
-    self.aux.pause_and_wait_for_key(self.ui)
-
-  def _save_last_move(self, source, destination):
-    '''Method that saves last move in history array. Receives 2 strings arguments.'''
-    # Get rows and cols numbers from source and destination:
-    _, _, row_destination, col_destination = self.aux.get_rows_and_cols_from(source, destination)
-
-    # Get current source piece:
-    square = self.board.squares[row_destination, col_destination]
-    piece = PIECES_NAMES[square[0]]
+    if pause:
+      self.aux.pause_and_wait_for_key(self.ui)
 
-    # Save move on history array:
-    self.players.history.append([self.players.turn,
-                                 f"{piece}: {source} -> {destination}",
-                                 time.ctime()])
+  def _save_last_move(self, move):
+    '''Method that saves last move (16-bit) in history array.'''
+    self.players.history.append(move)
+
+  def _show_tablebase_result(self, tablebase):
+    '''Method that shows the result of the position in the endgame tablebase (the winner and the moves to mate, or a draw), if the position is there.'''
+    probe = tablebase.probe(self.board.position)
+    if probe is None:
+      return
+    result, plies = probe
+    if result:
+      winner = COLOR_NAMES[self.board.position.side if result > 0 else self.board.position.side ^ 1]
+      message = f"Tablebase: {winner}s win, mate in {(plies + 1) // 2}."
+    else:
+      message = "Tablebase: draw."
+    self.ui._show_text(text=message, text_type=NORMAL_TYPE)
 
   def _show_history(self):
     '''Internal method only used for showin self.players.history array content.'''
     print()
     print("-"*TABLE_WIDTH)
-    print("# History:")
+    print(f"# History (started {self.players.start_time}):")
     print("-"*TABLE_WIDTH)
 
-    # Print every row from history array:
-    for row in self.players.history:
-      print(row)
+    # Print every move from history array (whites move first):
+    for index, move in enumerate(self.players.history):
+      print(f"{index // 2 + 1}. {COLOR_NAMES[index % 2]}: {' -> '.join(self.aux.get_move_array(move)[:2])} ({self.aux.get_move_name(move)})")
 
     print("-"*TABLE_WIDTH)
     print()
 
 
 # Main:
+def main(arguments=None):
+  '''Function that reads the command line options and runs the selected mode (the interactive menu if no option is given).'''
+  parser = argparse.ArgumentParser(description="A simple chess game to play from the terminal console.")
+  parser.add_argument("--perft", type=int, metavar="DEPTH",
+                      help="count the leaf nodes of the legal moves tree at DEPTH, with a per-move divide")
+  parser.add_argument("--fen", help="position for --perft, --search and --speedup as a FEN string (the initial position by default)")
+  parser.add_argument("--perft-suite", type=int, nargs="?", const=PERFT_SUITE_DEPTH, metavar="DEPTH",
+                      help=f"check the perft counts of the reference positions up to DEPTH (default {PERFT_SUITE_DEPTH})")
+  parser.add_argument("--search", type=float, metavar="SECONDS",
+                      help="search the position of --fen (or the initial one) for SECONDS, printing depth, score and nodes/sec per iteration")
+  parser.add_argument("--hash", type=int, default=16, metavar="MB", help="size of the engine transposition table in MB (default 16)")
+  parser.add_argument("--hash-policy", choices=("two-tier", "depth-preferred", "always"), default="two-tier",
+                      help="replacement policy of the transposition table (default two-tier)")
+  parser.add_argument("--threads", type=int, metavar="N",
+                      help="processes used by --search, --speedup, --validate and --analyze (default 1) and by --to-tablebase (default all the cores)")
+  parser.add_argument("--speedup", type=int, metavar="DEPTH",
+                      help="search the position of --fen (or the initial one) to DEPTH with 1 worker and with --threads, and report the speedup")
+  parser.add_argument("--validate", nargs="+", metavar="FILE",
+                      help="replay move files (JSON, JSON lines or PGN) with no rendering or pauses, printing a summary per game and moves/sec")
+  parser.add_argument("--report", metavar="FILE", help="stream the --validate result of each file to FILE (CSV if it ends with .csv, JSON lines otherwise)")
+  parser.add_argument("--analyze", nargs="+", metavar="FILE",
+                      help="analyze the games of move files with the engine, flagging mistakes and blunders, streamed to --output (annotated PGN if it ends with .pgn, JSON lines otherwise) or to the standard output")
+  parser.add_argument("--nodes", type=int, default=10000, metavar="N", help="nodes searched per position by --analyze (default 10000)")
+  parser.add_argument("--move-time", type=float, metavar="SECONDS", help="seconds per position for --analyze, instead of --nodes")
+  parser.add_argument("--to-pgn", nargs="+", metavar="FILE", help="convert the games of move files (JSON, JSON lines or PGN) to PGN, printed to the standard output")
+  parser.add_argument("--to-archive", nargs="+", metavar="FILE",
+                      help=f"write the games of move files (JSON, JSON lines or PGN) to the binary game archive of --output ({ARCHIVE_EXTENSION})")
+  parser.add_argument("--to-book", nargs="+", metavar="FILE",
+                      help="compile an opening book from the games of move files (JSON, JSON lines, PGN or archives) to the file of --output")
+  parser.add_argument("--book-plies", type=int, default=16, metavar="N", help="plies of each game added to the book by --to-book (default 16)")
+  parser.add_argument("--book", metavar="FILE", help="opening book used by --search and by the computer in the menu game")
+  parser.add_argument("--to-tablebase", nargs="*", metavar="ENDING",
+                      help="generate the endgame tables of lone king endings (KQK, KRK, KPK and KBNK by default, and the ones they need) to the directory of --output")
+  parser.add_argument("--tablebase", metavar="DIR", help="endgame tablebase directory used by --search and by the computer in the menu game")
+  parser.add_argument("--output", metavar="FILE",
+                      help="game archive written by --to-archive, opening book written by --to-book, tablebase directory written by --to-tablebase or analysis written by --analyze")
+  parser.add_argument("--serve", metavar="ADDRESS",
+                      help='host many games over a line protocol on ADDRESS ("host:port", "port" or "unix:path")')
+  parser.add_argument("--load-test", metavar="ADDRESS", help="play games on the server of ADDRESS with many clients, reporting moves/sec and p99 latency")
+  parser.add_argument("--clients", type=int, default=50, metavar="N", help="clients playing at once in --load-test (default 50)")
+  parser.add_argument("--games", type=int, default=10, metavar="N", help="games played by each client in --load-test (default 10)")
+  parser.add_argument("--idle", type=int, default=0, metavar="N", help="idle connections kept open during --load-test (default 0)")
+  parser.add_argument("--debug", action="store_true",
+                      help="verify the incremental evaluation against a full-board one on every evaluated position (slow)")
+  parser.add_argument("--profile", nargs="?", const="table", choices=("table", "json"),
+                      help="count calls and time of rule checks, board changes, rendering and file I/O, printed at exit as a table (default) or JSON")
+  parser.add_argument("--cprofile", nargs="?", const="", metavar="FILE",
+                      help="also run cProfile, adding its top functions to the --profile output (and saving its stats to FILE for pstats, if given)")
+  parser.add_argument("--startup-benchmark", type=int, nargs="?", const=5, metavar="REPEAT",
+                      help="measure the startup time of each mode with -X importtime (median of REPEAT runs, default 5)")
+  parser.add_argument("--memory-benchmark", type=int, nargs="?", const=100000, metavar="GAMES",
+                      help="keep GAMES games alive at once (default 100000) and report the bytes used per game, new and after 4 plies (played in a sample)")
+  options = parser.parse_args(arguments)
+
+  # The profiler wraps the measured methods only when used, so nothing else pays for it (worker processes are not counted):
+  if options.profile or options.cprofile is not None:
+    from chess_profile import Profiler
+    Profiler(options.profile or "table", use_cprofile=options.cprofile is not None, cprofile_file=options.cprofile or None).start()
+
+  if options.perft is not None:
+    try:
+      sys.exit(ChessPerft().run_divide(options.perft, options.fen))
+    except ValueError as error:
+      parser.error(str(error))
+
+  elif options.startup_benchmark is not None:
+    from chess_profile import run_startup_benchmark
+    sys.exit(run_startup_benchmark(options.startup_benchmark))
+
+  elif options.memory_benchmark is not None:
+    from chess_profile import run_memory_benchmark
+    sys.exit(run_memory_benchmark(options.memory_benchmark))
+
+  elif options.perft_suite is not None:
+    sys.exit(ChessPerft().run_suite(options.perft_suite))
+
+  elif options.validate:
+    # Patterns are expanded here too, for shells that do not expand them (like the Windows one):
+    files = [file for pattern in options.validate for file in (sorted(glob.glob(pattern)) or [pattern])]
+    sys.exit(ChessValidator().run(files, options.threads or 1, options.report))
+
+  elif options.analyze:
+    from chess_analysis import run_analysis
+    files = [file for pattern in options.analyze for file in (sorted(glob.glob(pattern)) or [pattern])]
+    sys.exit(run_analysis(files, options.threads or 1, options.nodes, options.move_time, options.output))
+
+  elif options.to_pgn:
+    from chess_formats import Pgn
+    files = [file for pattern in options.to_pgn for file in (sorted(glob.glob(pattern)) or [pattern])]
+    sys.exit(Pgn().run_export(files))
+
+  elif options.to_archive:
+    if not options.output:
+      parser.error("--to-archive requires --output")
+    from chess_formats import GameArchive
+    files = [file for pattern in options.to_archive for file in (sorted(glob.glob(pattern)) or [pattern])]
+    sys.exit(GameArchive.run_build(files, options.output))
+
+  elif options.to_book:
+    if not options.output:
+      parser.error("--to-book requires --output")
+    from chess_engine import OpeningBook
+    files = [file for pattern in options.to_book for file in (sorted(glob.glob(pattern)) or [pattern])]
+    positions, records = OpeningBook.build(files, options.output, options.book_plies)
+    print(f"Opening book {options.output}: {positions} positions, {records} moves.")
+
+  elif options.to_tablebase is not None:
+    if not options.output:
+      parser.error("--to-tablebase requires --output")
+    from chess_tablebase import Tablebase, DEFAULT_ENDINGS
+    sys.exit(Tablebase.run_generate(options.to_tablebase or DEFAULT_ENDINGS, options.output, options.threads))
+
+  elif options.serve:
+    from chess_server import run_server
+    sys.exit(run_server(options.serve))
+
+  elif options.load_test:
+    from chess_server import run_load_test
+    sys.exit(run_load_test(options.load_test, options.clients, options.games, options.idle))
+
+  elif options.search is not None or options.speedup is not None:
+    from chess_engine import OpeningBook, ParallelSearch
+    try:
+      board = ChessBoard.from_fen(options.fen or START_FEN)
+    except ValueError as error:
+      parser.error(str(error))
+
+    book = OpeningBook(options.book) if options.book and options.search is not None else None
+    tablebase = None
+    if options.tablebase and options.search is not None:
+      from chess_tablebase import Tablebase   # Imported only when used, since it needs NumPy.
+      tablebase = Tablebase(options.tablebase)
+    with ParallelSearch(options.threads or 1, hash_mb=options.hash, policy=options.hash_policy, book=book, tablebase=tablebase) as search:
+      search.engine.debug = options.debug
+      if options.speedup is not None:
+        single_time, single_nps, threads_time, threads_nps = search.measure_speedup(board.position, options.speedup)
+        print(f"1 worker: {single_time:.2f} s ({single_nps:,.0f} nodes/sec)")
+        print(f"{search.threads} worker{'s' if search.threads > 1 else ''}: {threads_time:.2f} s ({threads_nps:,.0f} nodes/sec)")
+        print(f"Speedup to depth {options.speedup}: {single_time / threads_time if threads_time else 0:.2f}x")
+      else:
+        move = search.search(board.position, time_limit=options.search, on_iteration=lambda engine: print(engine.get_info()))
+        searched = not (search.engine.from_book or search.engine.from_tablebase)
+        if not searched:
+          print(search.engine.get_info())
+        print(search.engine.tt.get_stats())
+        if search.threads > 1 and searched:
+          print(f"{search.threads} workers: {search.nodes} nodes, {search.nodes_per_second:,.0f} nodes/sec")
+        print(f"bestmove {board.aux.get_move_name(move) if move else '(none)'}")
+
+  else:
+    game = ChessGame(book=options.book, tablebase=options.tablebase)
+    game.show_menu()
+
+
 if __name__ == "__main__":
-  game = ChessGame()
-  game.show_menu()
+  # Local modules (like chess_engine) import this file by name, so it is registered once instead of being loaded again:
+  sys.modules.setdefault("chess_in_terminal", sys.modules[__name__])
+  main()
 
 
   # print(f"{game._show_history()}")
-  # print(f"\n# 1a: {game.board.squares[0, 0]}\n")
+  # print(f"\n# 1a: {game.board.position.squares[0]}\n")
@@ -0,0 +1,260 @@
+# Standard libraries:
+import atexit
+import cProfile
+import functools
+import inspect
+import json
+import os
+import pstats
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# Local modules:
+from chess_in_terminal import Aux, ChessAttacks, ChessBoard, ChessPosition, ChessRules, JsonStream, TUI
+from chess_formats import GameArchive, Pgn
+
+
+# Constants:
+PROFILE_FORMATS = ("table", "json")
+PROFILE_TOP_FUNCTIONS = 20   # Functions listed from the cProfile stats.
+RULES_PHASE = "rules"
+BOARD_PHASE = "board"
+RENDER_PHASE = "render"
+IO_PHASE = "io"
+PHASES = (RULES_PHASE, BOARD_PHASE, RENDER_PHASE, IO_PHASE)
+STARTUP_REPEAT = 5
+MEMORY_GAMES = 100000
+MEMORY_PLIES = 4          # Moves played by the memory benchmark in each game of a sample, after measuring the new games.
+MEMORY_SAMPLE_GAMES = 1000
+PACKAGE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+MAIN_SCRIPT = os.path.join(PACKAGE_DIRECTORY, "chess_in_terminal.py")
+
+# Modes started by the startup benchmark (name and interpreter arguments), from the bare core import to a board rendered with Rich.
+# A script run as __main__ is not imported, so its own time is only part of the wall time:
+STARTUP_MODES = (
+  ("import", ("-c", "import chess_in_terminal")),
+  ("--help", (MAIN_SCRIPT, "--help")),
+  ("--perft 1", (MAIN_SCRIPT, "--perft", "1")),
+  ("--validate", (MAIN_SCRIPT, "--validate", os.devnull)),
+  ("--to-pgn", (MAIN_SCRIPT, "--to-pgn", os.devnull)),
+  ("--search 0.01", (MAIN_SCRIPT, "--search", "0.01")),
+  ("board", ("-c", "import chess_in_terminal as chess; chess.TUI().show_pieces(chess.ChessBoard.from_fen(chess.START_FEN), chess.ChessPlayers())")),
+)
+
+# Methods measured by phase (generators are measured while they produce each item, not while their items are used):
+INSTRUMENTED_METHODS = (
+  (RULES_PHASE, ChessBoard, ("_check_if_move_is_legal", "get_status")),
+  (RULES_PHASE, ChessRules, ("check_move", "check_attack", "check_any_pieces_between", "generate_legal_moves", "is_insufficient_material")),
+  (RULES_PHASE, Pgn, ("parse_san",)),
+  (BOARD_PHASE, ChessBoard, ("_change_piece_position", "reset_chess")),
+  (BOARD_PHASE, ChessPosition, ("set_fen", "make_move", "unmake_move")),
+  (BOARD_PHASE, ChessAttacks, ("sync",)),
+  (RENDER_PHASE, TUI, ("show_pieces", "clear", "_show_text")),
+  (RENDER_PHASE, Aux, ("clear_terminal_console",)),
+  (IO_PHASE, Aux, ("get_moves_from_file", "_iterate_moves_from_json", "_iterate_moves_from_json_lines")),
+  (IO_PHASE, JsonStream, ("_read",)),
+  (IO_PHASE, Pgn, ("read_games", "write_game")),
+  (IO_PHASE, GameArchive, ("__getitem__",)),
+)
+
+
+# Classes:
+class Profiler():
+  '''The class that counts the calls and wall time of the hot paths of the game: rule checks, board changes, rendering and file I/O.
+  Nothing is measured until enable is called, which wraps the methods of INSTRUMENTED_METHODS (so the code runs untouched without --profile).
+  Each phase only adds the time of its outermost calls, so nested methods of the same phase are not counted twice.'''
+  def __init__(self, output_format="table", cprofile_file=None, use_cprofile=False):
+    self.output_format = output_format
+    self.cprofile_file = cprofile_file
+    self.cprofile = cProfile.Profile() if use_cprofile or cprofile_file else None
+    self.methods = {}                                  # Calls and seconds indexed by (phase, "Class.method").
+    self.phases = {phase: [0, 0.0] for phase in PHASES}
+    self.depths = dict.fromkeys(PHASES, 0)            # Nested calls running in each phase.
+    self.originals = []
+    self.start_time = None
+
+  def enable(self):
+    '''Method that wraps the instrumented methods and starts the cProfile profiler (if used).'''
+    for phase, cls, names in INSTRUMENTED_METHODS:
+      for name in names:
+        function = cls.__dict__[name]
+        self.originals.append((cls, name, function))
+        setattr(cls, name, self._wrap(phase, f"{cls.__name__}.{name}", function))
+
+    self.start_time = time.perf_counter()
+    if self.cprofile:
+      self.cprofile.enable()
+
+  def disable(self):
+    '''Method that restores the instrumented methods and stops the cProfile profiler (if used).'''
+    if self.cprofile:
+      self.cprofile.disable()
+    for cls, name, function in reversed(self.originals):
+      setattr(cls, name, function)
+    self.originals = []
+
+  def start(self):
+    '''Method that enables the profiler and registers the report to be printed at exit (to the standard error, like after sys.exit).'''
+    self.enable()
+    atexit.register(self.stop)
+
+  def stop(self):
+    '''Method that disables the profiler and prints its report (and saves the cProfile stats, if a file was given).'''
+    elapsed = time.perf_counter() - self.start_time
+    self.disable()
+    if self.cprofile_file:
+      self.cprofile.dump_stats(self.cprofile_file)
+
+    report = self.get_report(elapsed)
+    if self.output_format == "json":
+      print(json.dumps(report, indent=2), file=sys.stderr)
+    else:
+      self.print_table(report)
+
+  def get_report(self, elapsed=0.0):
+    '''Method that returns the counters as a dict: total time, the calls and seconds of each phase and method, and the top functions of cProfile (if used).'''
+    report = {
+      "time": elapsed,
+      "phases": {phase: {"calls": calls, "seconds": seconds} for phase, (calls, seconds) in self.phases.items()},
+      "methods": [{"phase": phase, "method": name, "calls": calls, "seconds": seconds}
+                  for (phase, name), (calls, seconds) in sorted(self.methods.items(), key=lambda item: -item[1][1]) if calls],
+    }
+    if self.cprofile:
+      stats = pstats.Stats(self.cprofile).sort_stats("cumulative")
+      report["cprofile"] = [{"function": f"{file}:{line}({name})", "calls": calls, "seconds": own_time, "cumulative_seconds": cumulative_time}
+                            for (file, line, name), (_, calls, own_time, cumulative_time, _) in
+                            sorted(stats.stats.items(), key=lambda item: -item[1][3])[:PROFILE_TOP_FUNCTIONS]]
+
+    return report
+
+  def print_table(self, report, open_file=sys.stderr):
+    '''Method that prints a report (see get_report) as text tables.'''
+    print(f"\nProfile ({report['time']:.3f} s):", file=open_file)
+    print(f"{'Phase':<8} {'Method':<42} {'Calls':>10} {'Total ms':>11} {'Avg us':>9}", file=open_file)
+    for phase, counters in report["phases"].items():
+      print(f"{phase:<8} {'(total)':<42} {counters['calls']:>10} {counters['seconds'] * 1000:>11.2f} "
+            f"{counters['seconds'] * 1e6 / counters['calls'] if counters['calls'] else 0:>9.2f}", file=open_file)
+    for counters in report["methods"]:
+      print(f"{counters['phase']:<8} {counters['method']:<42} {counters['calls']:>10} {counters['seconds'] * 1000:>11.2f} "
+            f"{counters['seconds'] * 1e6 / counters['calls']:>9.2f}", file=open_file)
+
+    if "cprofile" in report:
+      print(f"\ncProfile (top {PROFILE_TOP_FUNCTIONS} by cumulative time):", file=open_file)
+      print(f"{'Calls':>10} {'Own ms':>10} {'Cum ms':>10}  Function", file=open_file)
+      for counters in report["cprofile"]:
+        print(f"{counters['calls']:>10} {counters['seconds'] * 1000:>10.2f} {counters['cumulative_seconds'] * 1000:>10.2f}  {counters['function']}",
+              file=open_file)
+
+  def _wrap(self, phase, name, function):
+    '''Method that returns a function that runs another one adding its calls and time to the counters of a method and phase.'''
+    counters = self.methods.setdefault((phase, name), [0, 0.0])
+    phase_counters = self.phases[phase]
+    depths = self.depths
+
+    def add_time(elapsed):
+      counters[0] += 1
+      counters[1] += elapsed
+      if not depths[phase]:
+        phase_counters[0] += 1
+        phase_counters[1] += elapsed
+
+    if inspect.isgeneratorfunction(function):
+      @functools.wraps(function)
+      def wrapper(*args, **kwargs):
+        iterator = function(*args, **kwargs)
+        while True:
+          depths[phase] += 1
+          start = time.perf_counter()
+          try:
+            item = next(iterator)
+          except StopIteration:
+            return
+          finally:
+            depths[phase] -= 1
+            add_time(time.perf_counter() - start)
+          yield item
+    else:
+      @functools.wraps(function)
+      def wrapper(*args, **kwargs):
+        depths[phase] += 1
+        start = time.perf_counter()
+        try:
+          return function(*args, **kwargs)
+        finally:
+          depths[phase] -= 1
+          add_time(time.perf_counter() - start)
+
+    return wrapper
+
+
+# Functions:
+def measure_startup(arguments, repeat=STARTUP_REPEAT):
+  '''Function that starts the interpreter with some arguments (and -X importtime) several times. Returns a dict with the median wall and import times (ms),
+  the modules imported and whether Rich and NumPy were loaded.'''
+  wall_times = []
+  import_times = []
+  modules = set()
+  for _ in range(repeat):
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", *arguments], cwd=PACKAGE_DIRECTORY,
+                             stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wall_times.append(time.perf_counter() - start)
+
+    # Lines like "import time: <self us> | <cumulative us> | <module>" (the total is the sum of the self times):
+    import_time = 0
+    for line in process.stderr.splitlines():
+      fields = line.partition("import time:")[2].split("|")
+      if len(fields) == 3 and fields[0].strip().isdigit():
+        import_time += int(fields[0])
+        modules.add(fields[2].strip())
+    import_times.append(import_time / 1e6)
+
+  return {"wall_ms": statistics.median(wall_times) * 1000, "imports_ms": statistics.median(import_times) * 1000, "modules": len(modules),
+          "rich": "rich" in modules, "numpy": "numpy" in modules}
+
+
+def run_startup_benchmark(repeat=STARTUP_REPEAT):
+  '''Function that measures the startup of every mode of STARTUP_MODES and prints a table. Returns the exit status for the command line.'''
+  print(f"Startup of each mode (median of {repeat} runs, imports measured with -X importtime):")
+  print(f"{'Mode':<15} {'Wall ms':>9} {'Imports ms':>11} {'Modules':>8} {'Rich':>5} {'NumPy':>6}")
+  for name, arguments in STARTUP_MODES:
+    results = measure_startup(arguments, repeat)
+    print(f"{name:<15} {results['wall_ms']:>9.1f} {results['imports_ms']:>11.1f} {results['modules']:>8} "
+          f"{'yes' if results['rich'] else 'no':>5} {'yes' if results['numpy'] else 'no':>6}")
+
+  return 0
+
+
+def measure_game_memory(games=MEMORY_GAMES, plies=MEMORY_PLIES):
+  '''Function that keeps many games alive at once (server sessions) and measures the memory they use with tracemalloc. The moves are only played
+  in a sample of the games (tracemalloc slows every allocation down), whose growth is added to the bytes of a new game.
+  Returns a dict with the bytes per game (new and after the moves) and the seconds taken.'''
+  from chess_server import GameSession, LOAD_TEST_MOVES
+  start = time.perf_counter()
+  tracemalloc.start()
+  base = tracemalloc.get_traced_memory()[0]
+
+  sessions = [GameSession() for _ in range(games)]
+  new_games = tracemalloc.get_traced_memory()[0] - base
+  sample = sessions[:MEMORY_SAMPLE_GAMES]
+  for session in sample:
+    for move in LOAD_TEST_MOVES[:plies]:
+      session.handle(f"move {move}")
+  growth = tracemalloc.get_traced_memory()[0] - base - new_games
+  tracemalloc.stop()
+
+  return {"games": len(sessions), "plies": plies, "new_game_bytes": new_games / games,
+          "played_game_bytes": new_games / games + (growth / len(sample) if sample else 0), "time": time.perf_counter() - start}
+
+
+def run_memory_benchmark(games=MEMORY_GAMES, plies=MEMORY_PLIES):
+  '''Function that runs the memory benchmark and prints its results. Returns the exit status for the command line.'''
+  results = measure_game_memory(games, plies)
+  print(f"Live games: {results['games']:,} ({results['time']:.1f} s)")
+  print(f"New game: {results['new_game_bytes']:,.0f} bytes/game")
+  print(f"After {results['plies']} plies: {results['played_game_bytes']:,.0f} bytes/game")
+
+  return 0
@@ -0,0 +1,220 @@
+# Standard libraries:
+import asyncio
+import time
+
+# Local modules:
+from chess_in_terminal import ChessBoard, ChessPlayers, BLACKS, EMPTY, PIECE_LETTERS, PIECE_MASK, COLOR_SHIFT, ROWS, TOTAL_COLS, TOTAL_ROWS, WHITE_ID, WHITES
+
+
+# Constants:
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5050
+UNIX_PREFIX = "unix:"
+PROTOCOL_HELP = "commands: move <source> <destination> [promotion], board, fen, new, resign, stats, quit"
+LOAD_TEST_CLIENTS = 50
+LOAD_TEST_GAMES = 10
+LOAD_TEST_MOVES = ("7e 5e", "2e 4e", "8g 6f", "1b 3c", "8f 5c", "1g 3f", "6f 4g", "2d 4d", "5e 4d", "3c 4a",
+                   "5c 4b", "2c 3c", "4d 3c", "2b 3c", "4b 7e", "2h 3h", "4g 6f", "4e 5e", "6f 4e", "1f 3d")   # An Italian game, played by every client.
+
+
+# Classes:
+class GameSession():
+  '''The class that keeps the state of a game of the server (its own board and players) and answers the commands of its client, one line each.'''
+  __slots__ = ("board", "players", "total_moves")
+
+  def __init__(self):
+    self.board = ChessBoard()
+    self.board.reset_chess()
+    self.players = ChessPlayers()
+    self.total_moves = 0
+
+  def handle(self, line):
+    '''Method that runs a command line of the protocol and returns a tuple with the response (lines starting with "ok" or "error") and a boolean
+    that is False if the session must end.'''
+    command, _, arguments = line.strip().partition(" ")
+
+    if command == "move":
+      move = self.board.aux.get_move_from_input(arguments)
+      if move is None:
+        return f"error Invalid move: '{arguments}' (example: move 7e 5e).", True
+      status, message = self.board.move_piece(*move)
+      if not status:
+        return f"error {message}", True
+      self.players.history.append(self.board.position.undo_stack[-1] & 0xFFFF)
+      self.players.turn = BLACKS if self.players.turn == WHITES else WHITES
+      self.total_moves += 1
+      result = self.board.get_status_message(self.board.get_status())
+      return f"ok {message} {result}".rstrip(), True
+
+    elif command == "board":
+      return "\n".join(self._get_board_lines()) + "\nok", True
+
+    elif command == "fen":
+      return f"ok {self.board.to_fen()}", True
+
+    elif command == "new":
+      self.board.reset_chess()
+      self.board.moves = 0
+      self.players = ChessPlayers()
+      return "ok New game.", True
+
+    elif command == "resign":
+      return f"ok {self.players.turn.title()} resigns.", False
+
+    elif command == "quit":
+      return "ok Goodbye!", False
+
+    return f"error Unknown command: '{command}' ({PROTOCOL_HELP}).", True
+
+  def _get_board_lines(self):
+    '''Method that returns the rows of the board as text lines (row number and a letter per square, uppercase for whites and '.' for empty squares).'''
+    lines = []
+    squares = self.board.position.squares
+    for row in range(TOTAL_ROWS):
+      letters = []
+      for code in squares[row * TOTAL_COLS:(row + 1) * TOTAL_COLS]:
+        if code == EMPTY:
+          letters.append('.')
+        elif code >> COLOR_SHIFT == WHITE_ID:
+          letters.append(PIECE_LETTERS[code & PIECE_MASK])
+        else:
+          letters.append(PIECE_LETTERS[code & PIECE_MASK].lower())
+      lines.append(f"{ROWS[row]} {' '.join(letters)}")
+
+    return lines
+
+
+class ChessServer():
+  '''The class that hosts many games at once in a single process (with asyncio), over TCP ("host:port" or "port") or Unix sockets ("unix:path").
+  Each connection gets its own game session, and the protocol is a command per line (see PROTOCOL_HELP).'''
+  def __init__(self, address):
+    self.address = address
+    self.server = None
+    self.sessions = 0
+    self.moves = 0
+
+  async def start(self):
+    '''Method that starts listening for connections.'''
+    host, port, path = parse_address(self.address)
+    if path:
+      self.server = await asyncio.start_unix_server(self._handle_client, path)
+    else:
+      self.server = await asyncio.start_server(self._handle_client, host, port)
+
+  async def serve(self):
+    '''Method that starts the server and serves clients until it is cancelled.'''
+    await self.start()
+    print(f"Serving chess games on {self.address} ({PROTOCOL_HELP}).")
+    async with self.server:
+      await self.server.serve_forever()
+
+  async def _handle_client(self, reader, writer):
+    '''Method that runs the session of a client, answering its commands until it quits, resigns or disconnects.'''
+    session = GameSession()
+    self.sessions += 1
+    try:
+      while True:
+        line = await reader.readline()
+        if not line:
+          break
+        command = line.decode(errors="replace").strip()
+        if command == "stats":
+          response, keep_open = f"ok sessions {self.sessions} moves {self.moves}", True
+        else:
+          moves = session.total_moves
+          response, keep_open = session.handle(command)
+          self.moves += session.total_moves - moves
+
+        writer.write(response.encode() + b"\n")
+        await writer.drain()
+        if not keep_open:
+          break
+    except ConnectionError:
+      pass
+    finally:
+      self.sessions -= 1
+      writer.close()
+
+
+# Functions:
+def parse_address(address):
+  '''Function that returns a tuple (host, port, path) from an address like "host:port", "port" or "unix:path" (path is None for TCP addresses).'''
+  if address.startswith(UNIX_PREFIX):
+    return None, None, address[len(UNIX_PREFIX):]
+  host, _, port = address.rpartition(":")
+
+  return host or DEFAULT_HOST, int(port or DEFAULT_PORT), None
+
+
+async def open_connection(address):
+  '''Function that opens a connection to a server address. Returns its (reader, writer) streams.'''
+  host, port, path = parse_address(address)
+  if path:
+    return await asyncio.open_unix_connection(path)
+
+  return await asyncio.open_connection(host, port)
+
+
+async def load_test(address, clients=LOAD_TEST_CLIENTS, games=LOAD_TEST_GAMES, idle=0):
+  '''Function that plays games on a server with many clients at once (and keeps some idle connections open), measuring the latency of every move.
+  Returns a dict with the moves, time, moves/sec and p50/p99 latencies (ms), and the sessions of the server.'''
+  latencies = []
+
+  async def play(client):
+    reader, writer = await open_connection(address)
+    for _ in range(games):
+      for move in LOAD_TEST_MOVES:
+        start = time.perf_counter()
+        writer.write(f"move {move}\n".encode())
+        response = await reader.readline()
+        latencies.append(time.perf_counter() - start)
+        if not response.startswith(b"ok"):
+          raise RuntimeError(f"Client {client}: {response.decode().strip()}")
+      writer.write(b"new\n")
+      await reader.readline()
+    writer.write(b"quit\n")
+    await reader.readline()
+    writer.close()
+
+  idle_connections = [await open_connection(address) for _ in range(idle)]
+  start = time.perf_counter()
+  await asyncio.gather(*(play(client) for client in range(clients)))
+  elapsed = time.perf_counter() - start
+
+  reader, writer = await open_connection(address)
+  writer.write(b"stats\n")
+  stats = (await reader.readline()).decode().split()
+  writer.close()
+  for _, idle_writer in idle_connections:
+    idle_writer.close()
+
+  latencies.sort()
+  return {"moves": len(latencies), "time": elapsed, "moves_per_second": len(latencies) / elapsed if elapsed else 0.0,
+          "p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+          "p99_ms": latencies[int((len(latencies) - 1) * 0.99)] * 1000 if latencies else 0.0,
+          "sessions": int(stats[2]) if len(stats) > 2 else 0}
+
+
+def run_server(address):
+  '''Function that runs the server until CTRL + C is pressed. Returns the exit status for the command line.'''
+  try:
+    asyncio.run(ChessServer(address).serve())
+  except KeyboardInterrupt:
+    print("\nServer stopped.")
+
+  return 0
+
+
+def run_load_test(address, clients=LOAD_TEST_CLIENTS, games=LOAD_TEST_GAMES, idle=0):
+  '''Function that runs a load test on a server and prints its results. Returns the exit status for the command line.'''
+  try:
+    results = asyncio.run(load_test(address, clients, games, idle))
+  except (OSError, RuntimeError) as error:
+    print(f"Load test failed: {error}")
+    return 1
+
+  print(f"Clients: {clients} ({games} games each), idle connections: {idle}, server sessions: {results['sessions']}")
+  print(f"Moves: {results['moves']} in {results['time']:.3f} s ({results['moves_per_second']:,.0f} moves/sec)")
+  print(f"Latency: p50 {results['p50_ms']:.2f} ms, p99 {results['p99_ms']:.2f} ms")
+
+  return 0
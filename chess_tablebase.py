@@ -0,0 +1,547 @@
+# Standard libraries:
+from multiprocessing import shared_memory
+import multiprocessing
+import os
+import time
+
+# 3° libraries:
+import numpy as np
+
+# Local modules:
+from chess_batch import BETWEEN_TABLE, DIAGONAL_DIRECTIONS, DIAGONAL_LINES, KING_TABLE, KNIGHT_TABLE, PAWN_TABLE, RAYS, STRAIGHT_DIRECTIONS, STRAIGHT_LINES
+from chess_in_terminal import (BISHOP_ID, BLACK_ID, COLOR_SHIFT, KING_ID, KNIGHT_ID, NO_SQUARE, PAWN_ID, PIECE_IDS, QUEEN_ID, ROOK_ID, TOTAL_COLS, TOTAL_ROWS,
+                               TOTAL_SQUARES, WHITE_ID)
+
+
+# Constants:
+TABLEBASE_EXTENSION = ".npy"
+DEFAULT_ENDINGS = ("KQK", "KRK", "KPK", "KBNK")
+MAX_TABLE_PIECES = 4                 # Kings included.
+PIECE_ORDER = "QRBNP"                # Order of the pieces in the signatures of the endings (like "KBNK") and in the table indexes.
+PROMOTION_LETTERS = "QRBN"
+GENERATION_CHUNK_SIZE = 1 << 18      # Positions handled at once by a worker, so the temporary arrays stay small whatever the table size.
+FLIP_ROWS = (TOTAL_ROWS - 1) * TOTAL_COLS   # XOR with a square to mirror its row (tables keep the strong side as the whites).
+
+# Values of the tables (a byte per position): a draw, an illegal position or the plies to mate plus one:
+DRAW_VALUE = 0
+ILLEGAL_VALUE = 255
+MAX_MATE_VALUE = 254
+
+# Results of a probe, from the point of view of the side to move:
+TABLEBASE_WIN = 1
+TABLEBASE_DRAW = 0
+TABLEBASE_LOSS = -1
+
+# Codes of the moves of the lone king during the generation (moves inside the table are coded by the index they reach, so they are >= 0):
+NO_MOVE = -1
+ESCAPE_MOVE = -2       # Capture that leaves a drawn ending.
+EXTERNAL_MOVE = -3     # Capture into an ending won by the strong side, minus the plies to mate.
+
+
+# Precomputed tables:
+def _build_transforms():
+  '''Function that returns the 8 symmetries of the board as tuples with the image of each square (the identity first and then the mirror of the columns,
+  the only ones allowed with pawns).'''
+  transforms = []
+  for transpose in (False, True):
+    for flip_row in (False, True):
+      for flip_col in (False, True):
+        transform = []
+        for square in range(TOTAL_SQUARES):
+          row, col = divmod(square, TOTAL_COLS)
+          if transpose:
+            row, col = col, row
+          if flip_row:
+            row = TOTAL_ROWS - 1 - row
+          if flip_col:
+            col = TOTAL_COLS - 1 - col
+          transform.append(row * TOTAL_COLS + col)
+        transforms.append(tuple(transform))
+
+  return tuple(transforms)
+
+
+def _build_king_tables(king_squares, symmetries):
+  '''Function that returns the index of each square in the region of the strong king (-1 outside) and, for each square, the first of the symmetries
+  that takes it into the region.'''
+  indexes = [NO_SQUARE] * TOTAL_SQUARES
+  for index, square in enumerate(king_squares):
+    indexes[square] = index
+  transforms = [next(symmetry for symmetry in range(symmetries) if TRANSFORMS[symmetry][square] in king_squares) for square in range(TOTAL_SQUARES)]
+
+  return tuple(indexes), tuple(transforms)
+
+
+def _build_step_table(steps):
+  '''Function that returns the destination of each step from each square (len, 64), -1 if it leaves the board.'''
+  table = np.full((len(steps), TOTAL_SQUARES), NO_SQUARE, dtype=np.int64)
+  for step, (row_step, col_step) in enumerate(steps):
+    for square in range(TOTAL_SQUARES):
+      row, col = divmod(square, TOTAL_COLS)
+      if 0 <= row + row_step < TOTAL_ROWS and 0 <= col + col_step < TOTAL_COLS:
+        table[step, square] = (row + row_step) * TOTAL_COLS + col + col_step
+
+  return table
+
+
+TRANSFORMS = _build_transforms()
+TRANSFORM_TABLE = np.array(TRANSFORMS, dtype=np.int64)
+PAWNLESS_KING_SQUARES = tuple(square for square in range(TOTAL_SQUARES) if square // TOTAL_COLS < 4 and square % TOTAL_COLS <= square // TOTAL_COLS)   # 10 squares.
+PAWN_KING_SQUARES = tuple(square for square in range(TOTAL_SQUARES) if square % TOTAL_COLS < 4)   # 32 squares (pawns only allow the mirror of the columns).
+PAWNLESS_KING_TABLES = _build_king_tables(PAWNLESS_KING_SQUARES, len(TRANSFORMS))
+PAWN_KING_TABLES = _build_king_tables(PAWN_KING_SQUARES, 2)
+KING_STEPS = _build_step_table(STRAIGHT_DIRECTIONS + DIAGONAL_DIRECTIONS)
+KNIGHT_STEPS = _build_step_table(((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)))
+SLIDER_DIRECTIONS = {BISHOP_ID: range(4, 8), ROOK_ID: range(4), QUEEN_ID: range(8)}   # Directions of RAYS (straight ones first).
+BITS = np.left_shift(np.uint64(1), np.arange(TOTAL_SQUARES, dtype=np.uint64))
+
+
+# Classes:
+class EndgameTable():
+  '''The class of the table of an ending with a lone king, where the strong side is always kept as the whites. Its values are a (2, size) uint8 array,
+  with the strong side to move in the first row and the lone king to move in the second one. Positions are indexed by the squares of the strong king
+  (in its region, after a symmetry of the board), the lone king and the pieces, in the order of the signature.'''
+  __slots__ = ("signature", "pieces", "pawns", "king_array", "king_indexes", "king_transforms", "index_array", "transform_array", "size", "values")
+
+  def __init__(self, signature, values=None):
+    self.signature = get_signature(signature)
+    self.pieces = tuple(PIECE_IDS[letter] for letter in self.signature[1:-1])
+    self.pawns = PAWN_ID in self.pieces
+    king_squares = PAWN_KING_SQUARES if self.pawns else PAWNLESS_KING_SQUARES
+    self.king_array = np.array(king_squares, dtype=np.int64)
+    self.king_indexes, self.king_transforms = PAWN_KING_TABLES if self.pawns else PAWNLESS_KING_TABLES
+    self.index_array = np.array(self.king_indexes, dtype=np.int64)
+    self.transform_array = np.array(self.king_transforms, dtype=np.int64)
+    self.size = len(king_squares) * TOTAL_SQUARES ** (len(self.pieces) + 1)
+    self.values = values
+
+  def get_index(self, king, lone_king, pieces):
+    '''Method that returns the index of a position from the squares of the strong king, the lone king and the pieces.'''
+    transform = TRANSFORMS[self.king_transforms[king]]
+    index = self.king_indexes[transform[king]] * TOTAL_SQUARES + transform[lone_king]
+    for square in pieces:
+      index = index * TOTAL_SQUARES + transform[square]
+
+    return index
+
+  def get_indexes(self, kings, lone_kings, pieces):
+    '''Method that returns the indexes of many positions at once, from arrays of squares (like get_index).'''
+    transforms = self.transform_array[kings]
+    indexes = self.index_array[TRANSFORM_TABLE[transforms, kings]] * TOTAL_SQUARES + TRANSFORM_TABLE[transforms, lone_kings]
+    for squares in pieces:
+      indexes = indexes * TOTAL_SQUARES + TRANSFORM_TABLE[transforms, squares]
+
+    return indexes
+
+  def decode(self, indexes):
+    '''Method that returns the squares of the positions of an array of indexes: a tuple with the strong kings, the lone kings and a list with the
+    squares of each piece.'''
+    pieces = []
+    for _ in self.pieces:
+      pieces.insert(0, indexes % TOTAL_SQUARES)
+      indexes = indexes // TOTAL_SQUARES
+
+    return self.king_array[indexes // TOTAL_SQUARES], indexes % TOTAL_SQUARES, pieces
+
+
+class Tablebase():
+  '''The class that probes the endgame tables of a directory (files like "KQK.npy", written by Tablebase.generate). Tables are memory-mapped the first time
+  they are needed, so a probe is an index computation and a byte read, and only the pages used are loaded.'''
+  __slots__ = ("directory", "tables")
+
+  def __init__(self, directory):
+    self.directory = directory
+    self.tables = {}     # EndgameTable of each signature (None if its file is missing).
+
+  def get_table(self, signature):
+    '''Method that returns the EndgameTable of an ending, memory-mapped from the directory (None if it was not generated).'''
+    if signature not in self.tables:
+      self.tables[signature] = load_table(self.directory, signature)
+
+    return self.tables[signature]
+
+  def probe(self, position):
+    '''Method that looks up a position with a lone king and up to MAX_TABLE_PIECES pieces in all. Returns a tuple with the result for the side to move
+    (TABLEBASE_WIN, TABLEBASE_DRAW or TABLEBASE_LOSS) and the plies to mate (0 for draws), or None if the position is not in the tables.'''
+    occupied = position.occupied
+    if position.castling or bin(occupied).count("1") > MAX_TABLE_PIECES:
+      return None
+
+    bitboards = position.bitboards
+    for strong in (WHITE_ID, BLACK_ID):
+      lone = strong ^ 1
+      if position.colors[lone] == bitboards[KING_ID | lone << COLOR_SHIFT]:
+        break
+    else:
+      return None
+
+    # The strong side is stored as the whites, so the rows of the blacks are mirrored:
+    flip = FLIP_ROWS if strong == BLACK_ID else 0
+    letters = []
+    pieces = []
+    for letter in PIECE_ORDER:
+      bitboard = bitboards[PIECE_IDS[letter] | strong << COLOR_SHIFT]
+      while bitboard:
+        letters.append(letter)
+        pieces.append(((bitboard & -bitboard).bit_length() - 1) ^ flip)
+        bitboard &= bitboard - 1
+    if not pieces:
+      return TABLEBASE_DRAW, 0
+
+    table = self.get_table(f"K{''.join(letters)}K")
+    if table is None:
+      return None
+    king = (bitboards[KING_ID | strong << COLOR_SHIFT].bit_length() - 1) ^ flip
+    lone_king = (bitboards[KING_ID | lone << COLOR_SHIFT].bit_length() - 1) ^ flip
+    value = int(table.values[0 if position.side == strong else 1, table.get_index(king, lone_king, pieces)])
+
+    if value == ILLEGAL_VALUE:
+      return None
+    if value == DRAW_VALUE:
+      return TABLEBASE_DRAW, 0
+    return TABLEBASE_WIN if position.side == strong else TABLEBASE_LOSS, value - 1
+
+  def choose_move(self, position, legal_moves):
+    '''Method that chooses the best move of a position of the tables: the fastest mate if it wins, a draw if it can, or the longest resistance.
+    Returns a tuple with the 16-bit move, the result and the plies to mate after playing it, or None if some move leaves the tables.'''
+    best = None
+    best_key = None
+    for move in legal_moves:
+      position.make_move(move)
+      probe = self.probe(position)
+      position.unmake_move()
+      if probe is None:
+        return None
+
+      result, plies = -probe[0], probe[1] + 1 if probe[0] else 0
+      key = (result, -plies if result == TABLEBASE_WIN else plies)
+      if best_key is None or key > best_key:
+        best, best_key = (move, result, plies), key
+
+    return best
+
+  @staticmethod
+  def generate(endings, directory, workers=None, on_table=None):
+    '''Method that generates the tables of some endings (and the ones they need, first) to a directory, reusing the ones already there except for
+    the endings asked. An optional on_table function is called with the stats of each table. Returns a list with the stats of the tables generated.'''
+    signatures = [get_signature(ending) for ending in endings]
+    os.makedirs(directory, exist_ok=True)
+    stats = []
+    for signature in get_dependencies(signatures):
+      if signature not in signatures and os.path.exists(os.path.join(directory, signature + TABLEBASE_EXTENSION)):
+        continue
+      stats.append(generate_table(signature, directory, workers or os.cpu_count() or 1))
+      if on_table:
+        on_table(stats[-1])
+
+    return stats
+
+  @staticmethod
+  def run_generate(endings, directory, workers=None):
+    '''Method that generates the tables of some endings and prints the stats of each one. Returns the exit status for the command line.'''
+    def show(stats):
+      print(f"{stats['signature']}: {stats['positions']:,} positions, {stats['wins']:,} won and {stats['draws']:,} drawn with the strong side to move, "
+            f"longest mate {stats['max_plies']} plies, {stats['time']:.2f} s")
+
+    try:
+      Tablebase.generate(endings, directory, workers, show)
+    except ValueError as error:
+      print(f"Error: {error}")
+      return 1
+
+    return 0
+
+
+# Functions:
+def get_signature(ending):
+  '''Function that returns the signature of an ending, with its pieces in the usual order (like "KBNK" from "knbk").
+  Raises ValueError if it is not an ending of a lone king against one or more pieces, with MAX_TABLE_PIECES pieces at most.'''
+  letters = ending.upper()
+  pieces = letters[1:-1]
+  if len(letters) < 3 or len(letters) > MAX_TABLE_PIECES or letters[0] != 'K' or letters[-1] != 'K' or any(letter not in PIECE_ORDER for letter in pieces):
+    raise ValueError(f"Invalid ending: '{ending}' (examples: KQK, KRK, KPK, KBNK).")
+
+  return f"K{''.join(sorted(pieces, key=PIECE_ORDER.index))}K"
+
+
+def get_successors(signature):
+  '''Function that returns the set of endings reached from an ending by a capture of the lone king or a promotion (without "KK").'''
+  pieces = signature[1:-1]
+  successors = {get_signature(f"K{pieces[:piece]}{pieces[piece+1:]}K") for piece in range(len(pieces)) if len(pieces) > 1}
+  successors.update(get_signature(f"K{pieces[:piece]}{letter}{pieces[piece+1:]}K")
+                    for piece in range(len(pieces)) if pieces[piece] == 'P' for letter in PROMOTION_LETTERS)
+
+  return successors
+
+
+def get_dependencies(signatures):
+  '''Function that returns the endings and all the ones they need, in generation order (fewer pieces first, and then fewer pawns).'''
+  pending = list(signatures)
+  endings = set()
+  while pending:
+    signature = pending.pop()
+    if signature not in endings:
+      endings.add(signature)
+      pending.extend(get_successors(signature))
+
+  return sorted(endings, key=lambda signature: (len(signature), signature.count('P'), signature))
+
+
+def load_table(directory, signature):
+  '''Function that returns the EndgameTable of an ending with its values memory-mapped from its file (None if it does not exist).
+  Raises ValueError if the file does not have the size of the table.'''
+  path = os.path.join(directory, signature + TABLEBASE_EXTENSION)
+  if not os.path.exists(path):
+    return None
+  table = EndgameTable(signature)
+  values = np.load(path, mmap_mode="r")
+  if values.shape != (2, table.size) or values.dtype != np.uint8:
+    raise ValueError(f"Invalid tablebase file: {path}")
+  table.values = values
+
+  return table
+
+
+def generate_table(signature, directory, workers):
+  '''Function that generates the table of an ending by retrograde analysis and saves it to the directory (the tables it needs must be there).
+  Mates are found first and then, ply by ply, the positions where the strong side reaches a lost one and those where every move of the lone king
+  reaches a won one, until no more are found: the rest are draws. The work is split among worker processes that share the values.
+  Returns a dict with the stats of the table.'''
+  start = time.perf_counter()
+  table = EndgameTable(signature)
+  memory = shared_memory.SharedMemory(create=True, size=2 * table.size)
+  try:
+    values = np.ndarray((2, table.size), dtype=np.uint8, buffer=memory.buf)
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(table.signature, directory, memory.name)) as pool:
+      # Legal positions, mates, moves of the lone king and promotions:
+      chunks = [(first, min(first + GENERATION_CHUNK_SIZE, table.size)) for first in range(0, table.size, GENERATION_CHUNK_SIZE)]
+      results = pool.starmap(_initialize_chunk, chunks)
+      codes = np.concatenate([result[0] for result in results], axis=1)
+      drawn = np.concatenate([result[1] for result in results])
+      promotions = np.concatenate([result[2] for result in results])
+      del results
+      externals = EXTERNAL_MOVE - codes[codes <= EXTERNAL_MOVE]
+      last_plies = max(int(promotions.max(initial=0)), int(externals.max(initial=0)) + 1)
+
+      # Retrograde iteration, a ply at a time (odd plies for the strong side to move, even ones for the lone king):
+      plies = 0
+      last_change = 0
+      while plies + 1 < MAX_MATE_VALUE and (plies <= last_change + 1 or plies < last_plies):
+        plies += 1
+        if plies % 2:
+          undecided = np.flatnonzero(values[0] == DRAW_VALUE)
+          found = [undecided[promotions[undecided] == plies]]
+          chunks = [undecided[first:first + GENERATION_CHUNK_SIZE] for first in range(0, len(undecided), GENERATION_CHUNK_SIZE)]
+          found += [chunk[wins] for chunk, wins in zip(chunks, pool.starmap(_find_wins, [(chunk, plies) for chunk in chunks]))]
+          found = np.concatenate(found)
+          values[0, found] = plies + 1
+        else:
+          undecided = np.flatnonzero((values[1] == DRAW_VALUE) & ~drawn)
+          found = np.concatenate([chunk[_find_losses(codes[:, chunk], values[0], plies)]
+                                  for chunk in np.array_split(undecided, max(len(undecided) // GENERATION_CHUNK_SIZE, 1))])
+          values[1, found] = plies + 1
+        if len(found):
+          last_change = plies
+
+    np.save(os.path.join(directory, table.signature + TABLEBASE_EXTENSION), values)
+    strong_values = values[0]
+    stats = {"signature": table.signature, "positions": int(np.count_nonzero(strong_values != ILLEGAL_VALUE)),
+             "wins": int(np.count_nonzero((strong_values != DRAW_VALUE) & (strong_values != ILLEGAL_VALUE))),
+             "draws": int(np.count_nonzero(strong_values == DRAW_VALUE)), "max_plies": last_change, "time": time.perf_counter() - start}
+    del values, strong_values
+  finally:
+    memory.close()
+    memory.unlink()
+
+  return stats
+
+
+def _get_attacks(table, targets, pieces, occupied):
+  '''Function that returns whether the pieces of the strong side (not its king) attack the target squares, with the occupancy bitboards of the positions.'''
+  attacked = np.zeros(len(targets), dtype=bool)
+  for piece_id, squares in zip(table.pieces, pieces):
+    if piece_id == PAWN_ID:
+      attacked |= PAWN_TABLE[WHITE_ID, squares, targets]
+    elif piece_id == KNIGHT_ID:
+      attacked |= KNIGHT_TABLE[squares, targets]
+    else:
+      lines = STRAIGHT_LINES[squares, targets] if piece_id == ROOK_ID else DIAGONAL_LINES[squares, targets]
+      if piece_id == QUEEN_ID:
+        lines |= STRAIGHT_LINES[squares, targets]
+      attacked |= lines & ((BETWEEN_TABLE[squares, targets] & occupied) == 0)
+
+  return attacked
+
+
+def _get_piece_moves(piece_id, squares, occupied):
+  '''Generator that yields the moves of a piece of the strong side from an array of squares, as tuples (mask of the positions where the move exists,
+  destinations), one step of each direction at a time. Pawn moves to the last row are left out (they are promotions, handled apart).'''
+  if piece_id == PAWN_ID:
+    destinations = squares - TOTAL_COLS
+    moves = (squares >= 2 * TOTAL_COLS) & ((BITS[destinations] & occupied) == 0)
+    yield moves, destinations
+    doubles = np.maximum(squares - 2 * TOTAL_COLS, 0)
+    yield moves & (squares >= FLIP_ROWS - TOTAL_COLS) & ((BITS[doubles] & occupied) == 0), doubles
+
+  elif piece_id == KNIGHT_ID:
+    for steps in KNIGHT_STEPS:
+      destinations = steps[squares]
+      moves = destinations >= 0
+      destinations = np.where(moves, destinations, squares)
+      yield moves & ((BITS[destinations] & occupied) == 0), destinations
+
+  else:
+    for direction in SLIDER_DIRECTIONS[piece_id]:
+      blocked = np.zeros(len(squares), dtype=bool)
+      for step in range(TOTAL_ROWS - 1):
+        destinations = RAYS[direction, squares, step]
+        blocked |= destinations < 0
+        destinations = np.where(blocked, squares, destinations)
+        blocked |= (BITS[destinations] & occupied) != 0
+        if blocked.all():
+          break
+        yield ~blocked, destinations
+
+
+def _find_losses(codes, strong_values, plies):
+  '''Function that returns the positions of the lone king lost in some plies, from the codes of their moves (8, N): those where every move reaches a
+  position won in fewer plies.'''
+  successors = strong_values[np.maximum(codes, 0)]
+  won = (codes >= 0) & (successors != DRAW_VALUE) & (successors <= plies) | (codes <= EXTERNAL_MOVE) & (EXTERNAL_MOVE - codes < plies)
+
+  return (won | (codes == NO_MOVE)).all(axis=0)
+
+
+# Helper processes:
+_worker_memory = None
+_worker_table = None
+_worker_tables = {}     # Tables needed by the one being generated, by signature.
+
+
+def _init_worker(signature, directory, shared_memory_name):
+  '''Function that prepares a worker process of the generation: the table being generated, with its values in shared memory, and the ones it needs.'''
+  global _worker_memory, _worker_table
+  _worker_memory = shared_memory.SharedMemory(name=shared_memory_name)
+  _worker_table = EndgameTable(signature)
+  _worker_table.values = np.ndarray((2, _worker_table.size), dtype=np.uint8, buffer=_worker_memory.buf)
+  for successor in get_successors(_worker_table.signature):
+    _worker_tables[successor] = load_table(directory, successor)
+    if _worker_tables[successor] is None:
+      raise ValueError(f"Missing tablebase of {successor}, needed by {signature}.")
+
+
+def _get_worker_table(signature):
+  '''Function that returns one of the tables needed by the table of the worker (None for "KK").'''
+  return _worker_tables[get_signature(signature)] if len(signature) > 2 else None
+
+
+def _initialize_chunk(first, last):
+  '''Function that sets the values of a range of indexes (illegal positions and mates) and returns the codes of the moves of the lone king (8, N),
+  the positions of the lone king that are draws anyway (stalemates and captures that draw) and the plies to mate of the best promotion of the strong side.'''
+  table = _worker_table
+  kings, lone_kings, pieces = table.decode(np.arange(first, last, dtype=np.int64))
+  squares = [kings, lone_kings] + pieces
+
+  # Legal positions (squares apart, kings not in contact and pawns out of the first and last rows):
+  legal = ~KING_TABLE[kings, lone_kings]
+  for index, first_squares in enumerate(squares):
+    for second_squares in squares[index+1:]:
+      legal &= first_squares != second_squares
+  for piece_id, piece_squares in zip(table.pieces, pieces):
+    if piece_id == PAWN_ID:
+      legal &= (piece_squares >= TOTAL_COLS) & (piece_squares < FLIP_ROWS)
+
+  occupied = BITS[kings]
+  for piece_squares in pieces:
+    occupied = occupied | BITS[piece_squares]
+  check = _get_attacks(table, lone_kings, pieces, occupied)
+  values = table.values[:, first:last]
+  values[0] = np.where(legal & ~check, DRAW_VALUE, ILLEGAL_VALUE)
+  values[1] = np.where(legal, DRAW_VALUE, ILLEGAL_VALUE)
+
+  codes = _get_lone_king_moves(table, kings, lone_kings, pieces, occupied)
+  has_moves = (codes != NO_MOVE).any(axis=0)
+  values[1, legal & check & ~has_moves] = 1
+  drawn = legal & (~check & ~has_moves | (codes == ESCAPE_MOVE).any(axis=0))
+  promotions = _get_promotions(table, kings, lone_kings, pieces, occupied | BITS[lone_kings])
+  promotions[~legal | check] = 0
+
+  return codes, drawn, promotions
+
+
+def _get_lone_king_moves(table, kings, lone_kings, pieces, occupied):
+  '''Function that returns the codes of the 8 moves of the lone kings (8, N): the index reached, NO_MOVE, ESCAPE_MOVE or EXTERNAL_MOVE minus the plies to mate.'''
+  codes = np.full((len(KING_STEPS), len(kings)), NO_MOVE, dtype=np.int32)
+  for direction, steps in enumerate(KING_STEPS):
+    destinations = steps[lone_kings]
+    moves = destinations >= 0
+    destinations = np.where(moves, destinations, lone_kings)
+    moves &= ~KING_TABLE[kings, destinations] & (destinations != kings) & ~_get_attacks(table, destinations, pieces, occupied)
+    direction_codes = table.get_indexes(kings, destinations, pieces)
+
+    # Captures leave the table:
+    for piece, piece_squares in enumerate(pieces):
+      captures = moves & (destinations == piece_squares)
+      if captures.any():
+        subtable = _get_worker_table(table.signature[:piece+1] + table.signature[piece+2:])
+        if subtable is None:
+          direction_codes[captures] = ESCAPE_MOVE
+        else:
+          rest = [other[captures] for other_piece, other in enumerate(pieces) if other_piece != piece]
+          subtable_values = subtable.values[0, subtable.get_indexes(kings[captures], destinations[captures], rest)].astype(np.int64)
+          direction_codes[captures] = np.where(subtable_values == DRAW_VALUE, ESCAPE_MOVE, EXTERNAL_MOVE - (subtable_values - 1))
+    codes[direction] = np.where(moves, direction_codes, NO_MOVE)
+
+  return codes
+
+
+def _get_promotions(table, kings, lone_kings, pieces, occupied):
+  '''Function that returns the plies to mate of the best promotion of each position with the strong side to move (0 if none wins).'''
+  best = np.zeros(len(kings), dtype=np.int64)
+  letters = table.signature[1:-1]
+  for piece, piece_id in enumerate(table.pieces):
+    if piece_id != PAWN_ID:
+      continue
+    destinations = np.maximum(pieces[piece] - TOTAL_COLS, 0)
+    moves = (pieces[piece] < 2 * TOTAL_COLS) & ((BITS[destinations] & occupied) == 0)
+    if not moves.any():
+      continue
+
+    for letter in PROMOTION_LETTERS:
+      promoted = letters[:piece] + letter + letters[piece+1:]
+      subtable = _get_worker_table(f"K{promoted}K")
+      order = sorted(range(len(promoted)), key=lambda index: PIECE_ORDER.index(promoted[index]))
+      squares = [destinations[moves] if index == piece else pieces[index][moves] for index in order]
+      subtable_values = subtable.values[1, subtable.get_indexes(kings[moves], lone_kings[moves], squares)].astype(np.int64)
+      plies = np.where((subtable_values != DRAW_VALUE) & (subtable_values != ILLEGAL_VALUE), subtable_values, 0)
+      current = best[moves]
+      best[moves] = np.where((plies > 0) & ((current == 0) | (plies < current)), plies, current)
+
+  return best
+
+
+def _find_wins(indexes, plies):
+  '''Function that returns the positions of the strong side (from an array of indexes) with a move to a position of the lone king lost in plies - 1.'''
+  table = _worker_table
+  kings, lone_kings, pieces = table.decode(indexes)
+  occupied = BITS[kings] | BITS[lone_kings]
+  for piece_squares in pieces:
+    occupied = occupied | BITS[piece_squares]
+  lost_values = table.values[1]
+  wins = np.zeros(len(indexes), dtype=bool)
+
+  # Moves of the king (never next to the lone king):
+  for steps in KING_STEPS:
+    destinations = steps[kings]
+    moves = destinations >= 0
+    destinations = np.where(moves, destinations, kings)
+    moves &= ~KING_TABLE[lone_kings, destinations] & ((BITS[destinations] & occupied) == 0)
+    wins |= moves & (lost_values[table.get_indexes(destinations, lone_kings, pieces)] == plies)
+
+  # Moves of the pieces:
+  for piece, (piece_id, piece_squares) in enumerate(zip(table.pieces, pieces)):
+    for moves, destinations in _get_piece_moves(piece_id, piece_squares, occupied):
+      moved = pieces[:piece] + [destinations] + pieces[piece+1:]
+      wins |= moves & (lost_values[table.get_indexes(kings, lone_kings, moved)] == plies)
+
+  return wins